@@ -1,4 +1,9 @@
 from pymongo import MongoClient
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "microservice", "common"))
+from mongo_schema import ensure_indexes
+from result_cache import bump_cache_generation
 # Connect to MongoDB
 client = MongoClient("mongodb://localhost:27017/")
 soil_db = client['soil_database']
@@ -10,6 +15,17 @@ monolith_db = client['monolith_database']
 
 soil_db['soil_profiles'].delete_many({})
 plotting_db['plotting'].delete_many({})
+# Cached results point at the simulations removed above
+plotting_db['simulation_cache'].delete_many({})
+# Running services drop their in-memory cache entries once they see the new generation
+bump_cache_generation(plotting_db)
+plotting_db['sweeps'].delete_many({})
+# Reset the ID counters so profile_id and simulation_id start again at 1
+soil_db['counters'].delete_many({})
+plotting_db['counters'].delete_many({})
 monolith_db['plotting_monolith'].delete_many({})
 
+# Create the indexes the services look documents up by
+ensure_indexes(client)
+
 print("Database has been initialized and collections cleared.")
\ No newline at end of file
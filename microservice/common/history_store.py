@@ -0,0 +1,300 @@
+import os
+import zlib
+import numpy as np
+import gridfs
+from bson.binary import Binary
+
+# Storage settings shared by the services, overridable per container
+HISTORY_STORAGE = os.getenv("HISTORY_STORAGE", "packed")  # "packed" or "list"
+HISTORY_COMPRESSION = os.getenv("HISTORY_COMPRESSION", "none")  # "none" or "zlib"
+GRIDFS_THRESHOLD = int(os.getenv("HISTORY_GRIDFS_THRESHOLD", 8 * 1024 * 1024))
+GRIDFS_BUCKET = "plotting_histories"
+
+CONC_DTYPE = "<f8"
+STEP_DTYPE = "<i8"
+
+
+def _pack(array, dtype, compression):
+    raw = np.ascontiguousarray(array, dtype=dtype).tobytes()
+    if compression == "zlib":
+        return zlib.compress(raw, 1)
+    return raw
+
+
+def _unpack(payload, dtype, compression):
+    raw = zlib.decompress(payload) if compression == "zlib" else bytes(payload)
+    return np.frombuffer(raw, dtype=dtype)
+
+
+def store_history(db, collection, document, time_steps, layer_ids, history, **options):
+    """Insert a simulation document with its (layers, samples) concentration history."""
+    document = encode_history(db, document, time_steps, layer_ids, history, **options)
+    try:
+        return collection.insert_one(document)
+    except Exception:
+        delete_history_files(db, document)
+        raise
+
+
+def delete_history_files(db, document):
+    """Remove the GridFS files of an encoded history, e.g. when its document could not be inserted."""
+    storage = document.get("storage") or {}
+    file_ids = [storage[key] for key in ("gridfs_id", "time_steps_gridfs_id") if key in storage]
+    if file_ids:
+        fs = gridfs.GridFS(db, collection=GRIDFS_BUCKET)
+        for file_id in file_ids:
+            fs.delete(file_id)
+
+
+def encode_history(db, document, time_steps, layer_ids, history,
+                   storage=None, compression=None, gridfs_threshold=None):
+    """
+    Return a copy of document carrying its (layers, samples) concentration history.
+
+    "list" storage keeps the original {"time_steps", "layers": [{"id", "conc"}]}
+    layout. "packed" storage writes little-endian float64/int64 arrays, zlib
+    compressed if asked, and moves both arrays to GridFS once together they
+    exceed gridfs_threshold bytes so the document stays under the BSON size
+    limit. If the document is not inserted, delete_history_files() removes them.
+    """
+    storage = storage or HISTORY_STORAGE
+    compression = compression or HISTORY_COMPRESSION
+    if gridfs_threshold is None:
+        gridfs_threshold = GRIDFS_THRESHOLD
+    history = np.asarray(history, dtype=np.float64)
+    document = dict(document)
+
+    if storage == "list":
+        document["time_steps"] = list(time_steps)
+        document["layers"] = [
+            {"id": layer_id, "conc": history[i].tolist()}
+            for i, layer_id in enumerate(layer_ids)
+        ]
+        return document
+
+    conc = _pack(history, CONC_DTYPE, compression)
+    steps = _pack(time_steps, STEP_DTYPE, compression)
+    document["storage"] = {
+        "format": "packed",
+        "dtype": CONC_DTYPE,
+        "compression": compression,
+        "shape": list(history.shape),
+    }
+    document["layer_ids"] = list(layer_ids)
+    if len(conc) + len(steps) > gridfs_threshold:
+        fs = gridfs.GridFS(db, collection=GRIDFS_BUCKET)
+        try:
+            document["storage"]["gridfs_id"] = fs.put(conc, simulation_id=document.get("simulation_id"))
+            document["storage"]["time_steps_gridfs_id"] = fs.put(
+                steps, simulation_id=document.get("simulation_id")
+            )
+        except Exception:
+            delete_history_files(db, document)
+            raise
+    else:
+        document["time_steps_bin"] = Binary(steps)
+        document["conc_bin"] = Binary(conc)
+    return document
+
+
+def _read_time_steps(db, record, compression):
+    """Time steps of a packed history, inline or in GridFS."""
+    storage = record["storage"]
+    if "time_steps_gridfs_id" in storage:
+        payload = gridfs.GridFS(db, collection=GRIDFS_BUCKET).get(storage["time_steps_gridfs_id"]).read()
+    else:
+        payload = record["time_steps_bin"]
+    return _unpack(payload, STEP_DTYPE, compression)
+
+
+def read_history(db, record):
+    """
+    Decode a stored simulation document, packed or list-of-lists.
+    Returns (time_steps, layer_ids, conc) with conc shaped (layers, samples).
+    """
+    storage = record.get("storage")
+    if storage is None:
+        layers = record["layers"]
+        conc = np.array([layer["conc"] for layer in layers], dtype=np.float64)
+        conc = conc.reshape(len(layers), len(record["time_steps"]))
+        return (np.asarray(record["time_steps"]),
+                [layer["id"] for layer in layers],
+                conc)
+
+    compression = storage.get("compression", "none")
+    time_steps = _read_time_steps(db, record, compression)
+    if "gridfs_id" in storage:
+        fs = gridfs.GridFS(db, collection=GRIDFS_BUCKET)
+        payload = fs.get(storage["gridfs_id"]).read()
+    else:
+        payload = record["conc_bin"]
+    conc = _unpack(payload, storage.get("dtype", CONC_DTYPE), compression)
+    return time_steps, record["layer_ids"], conc.reshape(storage["shape"])
+
+
+# Fields needed to locate a window: the time steps and layer IDs, not the concentrations
+WINDOW_META_PROJECTION = {
+    "_id": 0,
+    "time_steps": 1,
+    "layers.id": 1,
+    "storage": 1,
+    "layer_ids": 1,
+    "time_steps_bin": 1,
+}
+
+
+def window_from_request(args):
+    """
+    Read the window options "layers" (list or comma-separated IDs), "start",
+    "stop" and "stride" from query arguments or a JSON body.
+    Returns keyword arguments for read_history_window; raises ValueError.
+    """
+    layers = args.get("layers")
+    try:
+        if isinstance(layers, str):
+            layers = [int(layer_id) for layer_id in layers.split(",") if layer_id.strip()]
+        elif layers is not None:
+            layers = [int(layer_id) for layer_id in layers]
+        window = {"layers": layers, "stride": int(args.get("stride", 1))}
+        for key in ("start", "stop"):
+            window[key] = None if args.get(key) is None else int(args.get(key))
+    except (TypeError, ValueError):
+        raise ValueError("layers, start, stop and stride must be integers")
+    return window
+
+
+def _window_meta(db, collection, query, fields=None):
+    """
+    Find the document of a stored history without its concentrations.
+    Returns (meta, time_steps, layer_ids), or None if no document matches query.
+    """
+    meta = collection.find_one(query, dict(WINDOW_META_PROJECTION, **(fields or {})))
+    if meta is None:
+        return None
+    storage = meta.get("storage")
+    if storage is None:
+        return meta, np.asarray(meta["time_steps"], dtype=np.int64), [layer["id"] for layer in meta["layers"]]
+    return meta, _read_time_steps(db, meta, storage.get("compression", "none")), list(meta["layer_ids"])
+
+
+def _read_window(db, collection, query, storage, rows, lo, hi, stride):
+    """Concentrations of the given layer rows over samples lo..hi (exclusive), every stride-th."""
+    samples = len(range(lo, hi, stride))
+    if samples == 0 or not rows:
+        return np.empty((len(rows), samples))
+    if storage is None:
+        conc = _list_window(collection, query, rows, lo, hi, stride)
+    else:
+        conc = _packed_window(db, collection, query, storage, rows, lo, hi, stride)
+    return conc.reshape(len(rows), samples)
+
+
+def read_history_window(db, collection, query, layers=None, start=None, stop=None, stride=1):
+    """
+    Read part of a stored history: the given layer IDs (default all) over the
+    time steps start..stop, inclusive, keeping every stride-th sample.
+    For list storage the selection runs inside Mongo ($slice / $arrayElemAt),
+    so only the requested values are transferred. Packed histories in GridFS
+    are read by byte range; inline or compressed ones are decoded whole first.
+    Returns (time_steps, layer_ids, conc (layers, samples)), or None if no
+    document matches query. Raises ValueError for unknown layer IDs.
+    """
+    stride = int(stride)
+    if stride < 1:
+        raise ValueError("stride must be a positive integer")
+    found = _window_meta(db, collection, query)
+    if found is None:
+        return None
+    meta, time_steps, all_ids = found
+
+    if layers is None:
+        rows = list(range(len(all_ids)))
+    else:
+        unknown = [layer_id for layer_id in layers if layer_id not in all_ids]
+        if unknown:
+            raise ValueError(f"Unknown layer IDs: {', '.join(map(str, unknown))}")
+        rows = [all_ids.index(layer_id) for layer_id in layers]
+    lo = 0 if start is None else int(np.searchsorted(time_steps, start, side="left"))
+    hi = len(time_steps) if stop is None else int(np.searchsorted(time_steps, stop, side="right"))
+    hi = max(hi, lo)
+    conc = _read_window(db, collection, query, meta.get("storage"), rows, lo, hi, stride)
+    return time_steps[lo:hi:stride], [all_ids[row] for row in rows], conc
+
+
+def read_history_chunks(db, collection, query, every=1, chunk=1000, fields=None):
+    """
+    Read a stored history chunk by chunk, keeping every every-th sample, so
+    only one chunk of concentrations is held at a time: list histories are
+    sliced inside Mongo and uncompressed GridFS histories read by byte range.
+    Inline packed histories (below the GridFS threshold) and compressed GridFS
+    ones are decoded once. fields adds to the projection of the returned meta.
+    Returns (meta, layer_ids, samples, chunks), chunks yielding
+    (time_steps, conc (layers, samples of the chunk)), or None if no
+    document matches query.
+    """
+    found = _window_meta(db, collection, query, fields)
+    if found is None:
+        return None
+    meta, time_steps, layer_ids = found
+    storage = meta.get("storage")
+    rows = list(range(len(layer_ids)))
+    selected = time_steps[::every]
+
+    def chunks():
+        whole = None
+        if storage is not None and not ("gridfs_id" in storage and storage.get("compression", "none") == "none"):
+            whole = _read_window(db, collection, query, storage, rows, 0, len(time_steps), every)
+        for start in range(0, selected.size, chunk):
+            steps = selected[start:start + chunk]
+            if whole is not None:
+                conc = whole[:, start:start + chunk]
+            else:
+                lo = start * every
+                hi = min(lo + steps.size * every, len(time_steps))
+                conc = _read_window(db, collection, query, storage, rows, lo, hi, every)
+            yield steps, conc
+
+    return meta, layer_ids, int(selected.size), chunks()
+
+
+def _list_window(collection, query, rows, lo, hi, stride):
+    def window(conc):
+        if stride == 1:
+            return {"$slice": [conc, lo, hi - lo]}
+        return {"$map": {
+            "input": {"$range": [lo, hi, stride]},
+            "as": "i",
+            "in": {"$arrayElemAt": [conc, "$$i"]},
+        }}
+
+    pipeline = [
+        {"$match": query},
+        {"$limit": 1},
+        {"$project": dict(
+            {"_id": 0},
+            **{f"row_{k}": window({"$arrayElemAt": ["$layers.conc", row]}) for k, row in enumerate(rows)}
+        )},
+    ]
+    record = next(collection.aggregate(pipeline))
+    return np.array([record[f"row_{k}"] for k in range(len(rows))], dtype=np.float64)
+
+
+def _packed_window(db, collection, query, storage, rows, lo, hi, stride):
+    compression = storage.get("compression", "none")
+    dtype = np.dtype(storage.get("dtype", CONC_DTYPE))
+    n_samples = storage["shape"][1]
+    if "gridfs_id" in storage and compression == "none":
+        # Each layer is a contiguous run of samples, read only the window of it
+        grid_out = gridfs.GridFS(db, collection=GRIDFS_BUCKET).get(storage["gridfs_id"])
+        conc = []
+        for row in rows:
+            grid_out.seek((row * n_samples + lo) * dtype.itemsize)
+            raw = grid_out.read((hi - lo) * dtype.itemsize)
+            conc.append(np.frombuffer(raw, dtype=dtype)[::stride])
+        return np.array(conc, dtype=np.float64)
+    if "gridfs_id" in storage:
+        payload = gridfs.GridFS(db, collection=GRIDFS_BUCKET).get(storage["gridfs_id"]).read()
+    else:
+        payload = collection.find_one(query, {"_id": 0, "conc_bin": 1})["conc_bin"]
+    conc = _unpack(payload, dtype, compression).reshape(storage["shape"])
+    return conc[rows, lo:hi:stride].astype(np.float64)
@@ -0,0 +1,111 @@
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from metrics import timed
+
+
+class IdAllocator:
+    """
+    Hand out sequential integer IDs from a counters collection with atomic $inc
+    updates, so concurrent requests never get the same ID and no request has
+    to count the target collection.
+
+    On first use the counter is seeded with $max from the highest ID already
+    stored, and a unique index on the ID field is requested so duplicates are
+    rejected by the database itself.
+    """
+
+    def __init__(self, counters, name, collection, field):
+        self.counters = counters
+        self.name = name
+        self.collection = collection
+        self.field = field
+        self._seeded = False
+
+    def _seed(self):
+        try:
+            self.collection.create_index(self.field, unique=True)
+        except OperationFailure as e:
+            # Existing duplicates from count-based IDs block the index, keep going
+            print(f"Could not create unique index on {self.field}: {e}")
+        latest = self.collection.find_one(
+            {self.field: {"$exists": True}},
+            projection={self.field: 1},
+            sort=[(self.field, -1)],
+        )
+        highest = 0
+        if latest:
+            value = latest
+            for key in self.field.split("."):
+                value = value[key]
+            highest = value
+        try:
+            self.counters.update_one({"_id": self.name}, {"$max": {"seq": highest}}, upsert=True)
+        except DuplicateKeyError:
+            # Another process created the counter first, $max again against it
+            self.counters.update_one({"_id": self.name}, {"$max": {"seq": highest}})
+        self._seeded = True
+
+    def reserve(self, count=1):
+        """Reserve a block of count consecutive IDs and return the first one."""
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        with timed("id_allocation"):
+            if not self._seeded:
+                self._seed()
+            counter = self.counters.find_one_and_update(
+                {"_id": self.name},
+                {"$inc": {"seq": count}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        return counter["seq"] - count + 1
+
+    def next_id(self):
+        return self.reserve(1)
+
+    def insert_many(self, documents, prepare=None, discard=None):
+        """
+        Give documents a reserved block of IDs and insert them in one unordered
+        bulk write, so one failing document does not stop the others. prepare,
+        if given, maps each document to what is written once its ID is set, and
+        discard is called with every prepared document that was not written.
+        Returns (ids, failures): the ID assigned to each document, and a dict
+        mapping the index of every document that was not written to its error.
+        """
+        if not documents:
+            return [], {}
+        first_id = self.reserve(len(documents))
+        *parents, leaf = self.field.split(".")
+        ids = []
+        for offset, document in enumerate(documents):
+            target = document
+            for key in parents:
+                target = target.setdefault(key, {})
+            target[leaf] = first_id + offset
+            ids.append(first_id + offset)
+        if prepare is not None:
+            prepared = []
+            try:
+                for document in documents:
+                    prepared.append(prepare(document))
+            except Exception:
+                self._discard(discard, prepared)
+                raise
+            documents = prepared
+        failures = {}
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failures[write_error["index"]] = write_error["errmsg"]
+        except Exception:
+            self._discard(discard, documents)
+            raise
+        self._discard(discard, [documents[index] for index in failures])
+        return ids, failures
+
+    @staticmethod
+    def _discard(discard, documents):
+        if discard is not None:
+            for document in documents:
+                discard(document)
@@ -0,0 +1,64 @@
+import os
+import threading
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+MAX_FINISHED_JOBS = int(os.getenv("MAX_FINISHED_JOBS", 10000))
+
+
+class JobQueue:
+    """
+    In-process worker pool for simulation requests that should not hold the
+    HTTP connection open. A job runs fn(*args), which returns (body, status)
+    like the synchronous handlers; its state moves queued -> running -> done
+    or failed. Only the newest MAX_FINISHED_JOBS finished jobs are remembered.
+    """
+
+    def __init__(self, max_workers=None, max_finished=None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or JOB_WORKERS, thread_name_prefix="simulation-job"
+        )
+        self.max_finished = max_finished or MAX_FINISHED_JOBS
+        self.jobs = {}
+        self.finished = deque()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return the new job ID."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = {"job_id": job_id, "status": "queued"}
+        self.executor.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def status(self, job_id):
+        """Return a copy of the job's state, or None for unknown job IDs."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job_id, fn, args):
+        self._update(job_id, status="running")
+        try:
+            body, status = fn(*args)
+        except Exception as e:
+            print(f"Job {job_id} failed:", traceback.format_exc())
+            self._update(job_id, status="failed", error=str(e), finished=True)
+            return
+        if status >= 400:
+            self._update(job_id, status="failed", error=body.get("error", body), finished=True)
+        else:
+            fields = {"simulation_id": body["simulation_id"]} if "simulation_id" in body else {}
+            self._update(job_id, status="done", result=body, finished=True, **fields)
+
+    def _update(self, job_id, finished=False, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+            if finished:
+                # Forget the oldest finished jobs first
+                self.finished.append(job_id)
+                while len(self.finished) > self.max_finished:
+                    del self.jobs[self.finished.popleft()]
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+
+METRICS = os.getenv("METRICS", "on")  # "on" or "off"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Histogram bucket upper bounds; every histogram also has a +Inf bucket
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+ITERATION_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Prometheus histogram with fixed buckets and one series per label-value
+    tuple. An observation is a bisect and three increments under a lock, so
+    it can stay on in every request.
+    """
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if METRICS != "on":
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        """The histogram in the text exposition format."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(v)}"' for name, v in zip(self.labels, label_values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return "\n".join(lines)
+
+
+STAGE_SECONDS = Histogram(
+    "bioturbation_stage_seconds", "Time spent in a hot-path stage of a request.", ("stage",), SECONDS_BUCKETS,
+)
+SIMULATION_ITERATIONS = Histogram(
+    "bioturbation_simulation_iterations", "Iterations taken by a simulation run.", ("kind", "mode"), ITERATION_BUCKETS,
+)
+MONGO_SECONDS = Histogram(
+    "bioturbation_mongo_command_seconds", "Round trip of a MongoDB command (find for find_one, insert for insert_one).",
+    ("command", "outcome"), SECONDS_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "bioturbation_http_request_seconds", "Time to build the response of an HTTP request.",
+    ("method", "endpoint", "status"), SECONDS_BUCKETS,
+)
+HISTOGRAMS = (STAGE_SECONDS, SIMULATION_ITERATIONS, MONGO_SECONDS, REQUEST_SECONDS)
+
+
+@contextmanager
+def timed(stage):
+    """Record the time spent in the with block as stage, also when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Pass as MongoClient(event_listeners=[...]) to time every command the driver sends."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "success")
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "failure")
+
+
+def render():
+    """Every histogram in the text exposition format."""
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+
+
+def instrument_app(app, path="/metrics"):
+    """Time every request of a Flask app by route and serve the histograms on path."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None and request.url_rule is not None and request.url_rule.rule != path:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, request.method,
+                                    request.url_rule.rule, response.status_code)
+        return response
+
+    @app.route(path, methods=["GET"])
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,71 @@
+import threading
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+SOIL_DB = "soil_database"
+PLOTTING_DB = "plotting_database"
+
+# (database, collection) -> list of (keys, options) for every index a service query relies on.
+# Default index names are kept so IdAllocator's own create_index call matches them.
+INDEXES = {
+    (SOIL_DB, "soil_profiles"): [
+        ([("profile.id", ASCENDING)], {"unique": True}),
+    ],
+    (PLOTTING_DB, "plotting"): [
+        ([("simulation_id", ASCENDING)], {"unique": True}),
+    ],
+    (PLOTTING_DB, "sweeps"): [
+        ([("sweep_id", ASCENDING)], {"unique": True}),
+    ],
+    (PLOTTING_DB, "simulation_cache"): [
+        ([("key", ASCENDING)], {"unique": True}),
+    ],
+}
+
+# Projections for the read paths, so lookups only fetch the fields they use
+EXISTS_PROJECTION = {"_id": 1}
+PROFILE_RUN_PROJECTION = {"_id": 0, "model": 1, "layers": 1}
+PROFILE_BATCH_PROJECTION = {"_id": 0, "profile.id": 1, "model": 1, "layers": 1}
+PROFILE_SWEEP_PROJECTION = {"_id": 0, "model": 1, "layers": 1, "h": 1}
+# Sweep summaries without the (possibly large) packed histories
+SWEEP_PROJECTION = {"_id": 0, "history": 0}
+
+
+def ensure_indexes(client):
+    """
+    Create the indexes the services query by. Safe to call on every startup,
+    create_index is a no-op when the index already exists.
+    """
+    for (db_name, collection_name), indexes in INDEXES.items():
+        collection = client[db_name][collection_name]
+        for keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+            except OperationFailure as e:
+                # e.g. duplicate IDs left over from count-based allocation
+                print(f"Could not create index {keys} on {db_name}.{collection_name}: {e}")
+
+
+def bootstrap_indexes(app, client):
+    """
+    Run ensure_indexes before the first request a Flask app handles, so the
+    indexes exist however the app is served (app.run, a WSGI server, a test
+    client). If Mongo cannot be reached the request goes on and the next one
+    tries again.
+    """
+    done = threading.Event()
+    lock = threading.Lock()
+
+    @app.before_request
+    def ensure_indexes_once():
+        if done.is_set():
+            return
+        with lock:
+            if done.is_set():
+                return
+            try:
+                ensure_indexes(client)
+            except PyMongoError as e:
+                print(f"Could not create indexes, retrying on the next request: {e}")
+            else:
+                done.set()
@@ -0,0 +1,162 @@
+import os
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from pymongo.errors import DuplicateKeyError
+
+# Settings shared by the services, overridable per container
+RESULT_CACHE = os.getenv("RESULT_CACHE", "on")  # "on" or "off"
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", 16 * 1024 * 1024))
+# Seconds between checks of the cache generation, i.e. how long a cleared cache can still hit in memory
+RESULT_CACHE_CHECK_SECONDS = float(os.getenv("RESULT_CACHE_CHECK_SECONDS", 5))
+
+CACHE_PROJECTION = {"_id": 0, "key": 1, "result": 1}
+GENERATION_ID = "simulation_cache"
+
+
+def bump_cache_generation(plotting_db):
+    """
+    Tell running services that plotting_db's simulation_cache was cleared:
+    every ResultCache drops its LRU once it sees the new generation.
+    """
+    plotting_db["cache_generations"].update_one({"_id": GENERATION_ID}, {"$inc": {"generation": 1}}, upsert=True)
+
+
+def cache_key(kernel, model, params):
+    """
+    Canonical hash of a simulation: the kernel that runs it, the profile's
+    model and the kernel parameters (processed layers plus run parameters).
+    Key order and integer-valued floats do not change the hash.
+    """
+    def canonical(value):
+        if isinstance(value, dict):
+            return {str(k): canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [canonical(v) for v in value]
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    payload = json.dumps(
+        {"kernel": kernel, "model": model, "params": canonical(params)},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Map simulation cache keys to the stored result of the first identical run,
+    e.g. {"simulation_id": 12, "iterations": 3000}. Lookups go to an in-process
+    LRU bounded to max_bytes first, then to the Mongo collection, which keeps
+    the entries across restarts and shares them between service replicas.
+
+    Memory hits do not touch Mongo. Whoever clears the collection, as
+    database/database_initialize.py does, bumps the generation document with
+    bump_cache_generation; the cache reads it at most every check_seconds and
+    drops the whole LRU when it changed.
+    """
+
+    def __init__(self, collection, max_bytes=None, enabled=None, check_seconds=None):
+        self.collection = collection
+        self.generations = collection.database["cache_generations"]
+        self.max_bytes = RESULT_CACHE_BYTES if max_bytes is None else max_bytes
+        self.enabled = (RESULT_CACHE != "off") if enabled is None else enabled
+        self.check_seconds = RESULT_CACHE_CHECK_SECONDS if check_seconds is None else check_seconds
+        self.generation = None
+        self.next_check = 0.0
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss."""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Return {key: result} for the cached keys, with one Mongo query for the rest."""
+        if not self.enabled:
+            return {}
+        self._check_generation()
+        found, missing = {}, []
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key][0]
+                    self.counters["memory_hits"] += 1
+                elif key not in missing:
+                    missing.append(key)
+        if missing:
+            for entry in self.collection.find({"key": {"$in": missing}}, CACHE_PROJECTION):
+                found[entry["key"]] = entry["result"]
+                self._remember(entry["key"], entry["result"])
+            with self.lock:
+                hits = sum(key in found for key in missing)
+                self.counters["mongo_hits"] += hits
+                self.counters["misses"] += len(missing) - hits
+        return found
+
+    def put(self, key, result):
+        """Remember the result of a finished simulation."""
+        self.put_many({key: result})
+
+    def put_many(self, results):
+        if not self.enabled or not results:
+            return
+        self._check_generation()
+        for key, result in results.items():
+            try:
+                self.collection.insert_one({"key": key, "result": result})
+            except DuplicateKeyError:
+                # An identical run finished first, keep its entry; the next lookup reads it from Mongo
+                continue
+            self._remember(key, result)
+
+    def stats(self):
+        with self.lock:
+            hits = self.counters["memory_hits"] + self.counters["mongo_hits"]
+            lookups = hits + self.counters["misses"]
+            return dict(
+                self.counters,
+                hits=hits,
+                hit_ratio=hits / lookups if lookups else 0.0,
+                entries=len(self.entries),
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+                enabled=self.enabled,
+                generation=self.generation,
+            )
+
+    def _check_generation(self):
+        """Drop the LRU if the collection was cleared, reading the generation at most every check_seconds."""
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_check:
+                return
+            self.next_check = now + self.check_seconds
+        document = self.generations.find_one({"_id": GENERATION_ID}, {"generation": 1})
+        generation = document["generation"] if document else 0
+        with self.lock:
+            if generation != self.generation:
+                self.counters["invalidations"] += len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                self.generation = generation
+
+    def _remember(self, key, result):
+        """Keep result in the LRU."""
+        nbytes = len(key) + len(json.dumps(result))
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (result, nbytes)
+            self.size += nbytes
+            # Evict the least recently used entries until the cache fits
+            while self.size > self.max_bytes and self.entries:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.counters["evictions"] += 1
@@ -0,0 +1,356 @@
+from flask import Response, request, jsonify
+from simulation.sweep import merge_sweep_summaries, sweep_chunks
+from history_store import (
+    encode_history, delete_history_files, read_history_chunks, read_history_window, window_from_request,
+)
+from id_allocator import IdAllocator
+from jobs import JobQueue
+from metrics import SIMULATION_ITERATIONS, timed
+from result_cache import ResultCache
+from streaming import NDJSON, STREAM_CHUNK, stream_history
+from mongo_schema import PROFILE_BATCH_PROJECTION, PROFILE_SWEEP_PROJECTION, SWEEP_PROJECTION
+
+
+class SimulationRoutes:
+    """
+    The collections, ID allocators, job queue and result cache of a model
+    service, and the request handlers both models share: bulk profile
+    creation, batch runs, parameter sweeps, stored history reads, job status
+    and cache statistics. The model is given by its hooks:
+
+        process_layers(config)             -> (layers, error)
+        batch_key(layers, data)            -> key of the profiles run together; raises ValueError
+        batch_params(profiles, data)       -> batch kernel params of one group; raises ValueError
+        sweep_params(profile, data)        -> sweep kernel params; raises ValueError
+        batch_kernel(params), sweep_kernel(params), run by map_kernel(fn, items)
+
+    register(app, prefix) adds the routes under prefix. Sweeps without
+    histories are split into one chunk per worker process (self.processes).
+    """
+
+    def __init__(self, soil_db, plotting_db, default_model, process_layers, batch_key, batch_params,
+                 batch_kernel, sweep_params, sweep_kernel, map_kernel, processes):
+        self.plotting_db = plotting_db
+        self.soil_profiles = soil_db['soil_profiles']
+        self.plotting = plotting_db['plotting']
+        self.sweeps = plotting_db['sweeps']
+        self.profile_ids = IdAllocator(soil_db['counters'], "profile_id", self.soil_profiles, "profile.id")
+        self.simulation_ids = IdAllocator(plotting_db['counters'], "simulation_id", self.plotting, "simulation_id")
+        self.sweep_ids = IdAllocator(plotting_db['counters'], "sweep_id", self.sweeps, "sweep_id")
+        self.jobs = JobQueue()
+        self.result_cache = ResultCache(plotting_db['simulation_cache'])
+        self.default_model = default_model
+        self.process_layers = process_layers
+        self.batch_key, self.batch_params, self.batch_kernel = batch_key, batch_params, batch_kernel
+        self.sweep_params, self.sweep_kernel = sweep_params, sweep_kernel
+        self.map_kernel = map_kernel
+        self.processes = processes
+
+    def register(self, app, prefix=""):
+        """Add the shared routes to a Flask app."""
+        routes = [
+            ("/soil-profile/batch", "create_soil_profiles", self.create_soil_profiles, ["POST"]),
+            ("/bioturbation/run/batch", "run_bioturbation_batch", self.run_bioturbation_batch, ["POST"]),
+            ("/bioturbation/sweep", "run_bioturbation_sweep", self.run_bioturbation_sweep, ["POST"]),
+            ("/bioturbation/sweep/<int:sweep_id>", "get_sweep", self.get_sweep, ["GET"]),
+            ("/bioturbation/history/<int:simulation_id>", "stream_simulation_history",
+             self.stream_simulation_history, ["GET"]),
+            ("/bioturbation/history/<int:simulation_id>/window", "get_history_window",
+             self.get_history_window, ["GET"]),
+            ("/jobs/<job_id>", "get_job", self.get_job, ["GET"]),
+            ("/cache/stats", "get_cache_stats", self.get_cache_stats, ["GET"]),
+        ]
+        for rule, endpoint, view, methods in routes:
+            app.add_url_rule(prefix + rule, endpoint, view, methods=methods)
+
+    # Create many soil profiles with one bulk insert
+    def create_soil_profiles(self):
+        data = request.json
+        configs = data.get("profiles") if isinstance(data, dict) else data
+        if not isinstance(configs, list):
+            return jsonify({"error": "Expected an array of profile configs"}), 400
+
+        documents, indices, errors = [], [], []
+        for index, config in enumerate(configs):
+            layers, error = self.process_layers(config)
+            if error:
+                errors.append({"index": index, **error})
+                continue
+            config['layers'] = layers
+            documents.append(config)
+            indices.append(index)
+
+        ids = [None] * len(configs)
+        assigned, failures = self.profile_ids.insert_many(documents)
+        for k, profile_id in enumerate(assigned):
+            if k in failures:
+                errors.append({"index": indices[k], "error": failures[k]})
+            else:
+                ids[indices[k]] = profile_id
+        errors.sort(key=lambda item: item["index"])
+
+        created = sum(profile_id is not None for profile_id in ids)
+        print(f"{created} of {len(configs)} profiles have been created.")
+        return jsonify({"ids": ids, "errors": errors}), 201 if created else 400
+
+    def run_bioturbation_batch(self):
+        """
+        Run many profiles in one request, given as "profile_ids" (loaded with a
+        single $in query) or as inline "profiles" configs. Profiles that share
+        a layer count (and grid) are advanced together as one stacked
+        computation and all histories are written back with one bulk insert.
+        Histories keep at most HISTORY_MAX_SAMPLES samples per run, override
+        with "history". With "async": true the batch is queued and a job ID is
+        returned with 202.
+        """
+        data = request.json
+        if data.get("async"):
+            job_id = self.jobs.submit(self.simulate_bioturbation_batch, data)
+            return jsonify({"job_id": job_id, "status": "queued"}), 202
+        body, status = self.simulate_bioturbation_batch(data)
+        return jsonify(body), status
+
+    def simulate_bioturbation_batch(self, data):
+        """Run and store the simulations of a batch run request. Returns (body, status)."""
+        items, errors = self.load_batch_profiles(data)
+        if items is None:
+            return errors[0], 400
+
+        # Group the profiles that can be stacked into one computation
+        groups = {}
+        for item in items:
+            try:
+                key = self.batch_key(item["layers"], data)
+            except ValueError as e:
+                errors.append({"index": item["index"], "profile_id": item["profile_id"], "error": str(e)})
+                continue
+            groups.setdefault(key, []).append(item)
+
+        # Each group is one kernel call, the groups run in parallel
+        try:
+            group_params = [(self.batch_params([item["layers"] for item in group], data),)
+                            for group in groups.values()]
+            with timed("simulation_batch"):
+                group_results = self.map_kernel(self.batch_kernel, group_params)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        documents, results = [], []
+        for group, result in zip(groups.values(), group_results):
+            for item, t, (time_steps, history) in zip(group, result["iterations"], result["histories"]):
+                documents.append({
+                    "model": item["model"],
+                    "profile_id": item["profile_id"],
+                    "history": (time_steps, [layer["id"] for layer in item["layers"]], history),
+                })
+                results.append({"index": item["index"], "profile_id": item["profile_id"], "iterations": int(t)})
+                SIMULATION_ITERATIONS.observe(int(t), "batch", "step")
+
+        def prepare(document):
+            time_steps, layer_ids, history = document.pop("history")
+            return encode_history(self.plotting_db, document, time_steps, layer_ids, history)
+
+        simulation_id_list, failures = self.simulation_ids.insert_many(
+            documents, prepare, discard=lambda document: delete_history_files(self.plotting_db, document)
+        )
+        stored = []
+        for k, result in enumerate(results):
+            if k in failures:
+                errors.append({"index": result["index"], "error": failures[k]})
+            else:
+                stored.append(dict(result, simulation_id=simulation_id_list[k]))
+        stored.sort(key=lambda item: item["index"])
+        errors.sort(key=lambda item: item["index"])
+
+        print(f"Batch of {len(stored)} bioturbation simulations completed.")
+        return {"results": stored, "errors": errors}, 201 if stored else 400
+
+    def load_batch_profiles(self, data):
+        """
+        Collect the profiles of a batch run request with their request index.
+        Returns (items, errors), or (None, [error]) if the request names no profiles.
+        """
+        items, errors = [], []
+        if "profile_ids" in data:
+            profile_ids_requested = data["profile_ids"]
+            found = {
+                profile["profile"]["id"]: profile
+                for profile in self.soil_profiles.find(
+                    {"profile.id": {"$in": profile_ids_requested}}, PROFILE_BATCH_PROJECTION
+                )
+            }
+            for index, profile_id in enumerate(profile_ids_requested):
+                profile = found.get(profile_id)
+                if not profile:
+                    errors.append({"index": index, "profile_id": profile_id, "error": "Soil profile not found"})
+                else:
+                    items.append({"index": index, "profile_id": profile_id,
+                                  "model": profile.get("model", "Unknown"), "layers": profile["layers"]})
+        elif "profiles" in data:
+            for index, config in enumerate(data["profiles"]):
+                layers, error = self.process_layers(config)
+                if error:
+                    errors.append({"index": index, **error})
+                else:
+                    items.append({"index": index, "profile_id": None,
+                                  "model": config.get("model", self.default_model), "layers": layers})
+        else:
+            return None, [{"error": "profile_ids or profiles is required"}]
+
+        for item in list(items):
+            if not item["layers"]:
+                errors.append({"index": item["index"], "error": "Profile has no layers"})
+                items.remove(item)
+        return items, errors
+
+    def run_bioturbation_sweep(self):
+        """
+        Run a parameter sweep over a base profile, given as "profile_id" or as an
+        inline "profile" config. "parameters" maps earthworm_density, beta, depth
+        and dt to their values; every point of the Cartesian product is evaluated
+        in one stacked computation and only the per-point summaries are stored,
+        in one sweep document. Add "history" to also keep sampled histories.
+        With "async": true the sweep is queued and a job ID is returned with 202.
+        """
+        data = request.json
+        if data.get("async"):
+            job_id = self.jobs.submit(self.simulate_bioturbation_sweep, data)
+            return jsonify({"job_id": job_id, "status": "queued"}), 202
+        body, status = self.simulate_bioturbation_sweep(data)
+        return jsonify(body), status
+
+    def simulate_bioturbation_sweep(self, data):
+        """Run and store a parameter sweep request. Returns (body, status)."""
+        base, error = self.load_sweep_base(data)
+        if error:
+            return error
+
+        try:
+            params = self.sweep_params(base["profile"], data)
+            # Without histories the points are split into one chunk per worker process
+            chunks = 1 if params["history"] else sweep_chunks(params["parameters"], self.processes)
+            with timed("simulation_sweep"):
+                summary = merge_sweep_summaries(self.map_kernel(
+                    self.sweep_kernel, [(dict(params, chunk=(k, chunks)),) for k in range(chunks)]
+                ))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        layers = base["profile"]["layers"]
+        sweep_id = self.sweep_ids.next_id()
+        document = {
+            "sweep_id": sweep_id,
+            "model": base["model"],
+            "profile_id": base["profile_id"],
+            "parameters": data["parameters"],
+            "dt": params["dt"],
+            "steady_state_tol": params["tol"],
+            "max_iter": params["max_iter"],
+            "points": len(summary["iterations"]),
+            "results": {
+                "parameters": summary["points"],
+                "iterations": summary["iterations"],
+                "converged": summary["converged"],
+                "final_conc": summary["final"].tolist(),
+            },
+        }
+        if summary["history"] is not None:
+            time_steps, history = summary["history"]
+            document["history"] = encode_history(
+                self.plotting_db, {}, time_steps, [layer["id"] for layer in layers], history,
+                storage="packed",
+            )
+        try:
+            self.sweeps.insert_one(document)
+        except Exception:
+            delete_history_files(self.plotting_db, document.get("history", {}))
+            raise
+
+        print(f"Sweep {sweep_id} of {document['points']} points completed.")
+        return {
+            "sweep_id": sweep_id,
+            "points": document["points"],
+            "converged": sum(summary["converged"]),
+            "message": "Bioturbation sweep completed and summaries stored."
+        }, 201
+
+    def load_sweep_base(self, data):
+        """
+        Load the base profile of a sweep request from "profile_id" or "profile".
+        Returns ({"profile_id", "model", "profile"}, None) or (None, (body, status)),
+        "profile" holding the processed "layers" and the profile options.
+        """
+        if "profile_id" in data:
+            profile = self.soil_profiles.find_one({"profile.id": data["profile_id"]}, PROFILE_SWEEP_PROJECTION)
+            if not profile:
+                return None, ({"error": "Soil profile not found"}, 404)
+            base = {"profile_id": data["profile_id"], "model": profile.get("model", "Unknown"), "profile": profile}
+        elif "profile" in data:
+            layers, error = self.process_layers(data["profile"])
+            if error:
+                return None, (error, 400)
+            base = {"profile_id": None, "model": data["profile"].get("model", self.default_model),
+                    "profile": dict(data["profile"], layers=layers)}
+        else:
+            return None, ({"error": "profile_id or profile is required"}, 400)
+        if not base["profile"]["layers"]:
+            return None, ({"error": "Profile has no layers"}, 400)
+        return base, None
+
+    # Get the stored summaries of a parameter sweep
+    def get_sweep(self, sweep_id):
+        sweep = self.sweeps.find_one({"sweep_id": sweep_id}, SWEEP_PROJECTION)
+        if not sweep:
+            return jsonify({"error": "Sweep not found"}), 404
+        return jsonify(sweep), 200
+
+    # Stream a stored simulation history as NDJSON, chunk by chunk
+    def stream_simulation_history(self, simulation_id):
+        every = request.args.get("every", 1, type=int)
+        chunk = request.args.get("chunk", None, type=int)
+        if every < 1 or (chunk is not None and chunk < 1):
+            return jsonify({"error": "every and chunk must be positive integers"}), 400
+        history = read_history_chunks(
+            self.plotting_db, self.plotting, {"simulation_id": simulation_id},
+            every, chunk or STREAM_CHUNK, fields={"model": 1, "profile_id": 1},
+        )
+        if history is None:
+            return jsonify({"error": "Simulation not found"}), 404
+        record, layer_ids, samples, chunks = history
+        header = {
+            "simulation_id": simulation_id,
+            "model": record.get("model"),
+            "profile_id": record.get("profile_id"),
+            "layer_ids": list(layer_ids),
+            "samples": samples,
+        }
+        return Response(stream_history(header, chunks), mimetype=NDJSON)
+
+    # Read part of a stored history, e.g. ?layers=1&start=9500&stop=10000&stride=10
+    def get_history_window(self, simulation_id):
+        try:
+            window = read_history_window(
+                self.plotting_db, self.plotting, {"simulation_id": simulation_id},
+                **window_from_request(request.args)
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if window is None:
+            return jsonify({"error": "Simulation not found"}), 404
+        time_steps, layer_ids, conc = window
+        return jsonify({
+            "simulation_id": simulation_id,
+            "time_steps": time_steps.tolist(),
+            "layers": [{"id": layer_id, "conc": row} for layer_id, row in zip(layer_ids, conc.tolist())],
+        }), 200
+
+    # Get the status of an asynchronous simulation job
+    def get_job(self, job_id):
+        job = self.jobs.status(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job), 200
+
+    # Hit/miss counters of the simulation result cache
+    def get_cache_stats(self):
+        return jsonify(self.result_cache.stats()), 200
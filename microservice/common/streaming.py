@@ -0,0 +1,79 @@
+import json
+import queue
+import threading
+import traceback
+import numpy as np
+
+NDJSON = "application/x-ndjson"
+STREAM_QUEUE_ROWS = 1000  # rows buffered between a running simulation and a slow client
+STREAM_CHUNK = 1000  # stored samples serialised per chunk
+
+
+class StreamClosed(Exception):
+    """Raised inside a streamed simulation once its client has gone away."""
+
+
+def ndjson_line(item):
+    return json.dumps(item) + "\n"
+
+
+def stream_run(simulate, data):
+    """
+    Run simulate(data, progress) in a thread and yield NDJSON lines while it
+    runs: {"step", "conc"} rows for every progress(step, values) call, then one
+    final line with the (body, status) it returned, as {"result", "status"}.
+    The row buffer is bounded, so a slow client slows the simulation down
+    instead of growing memory; a closed client stops it.
+    """
+    rows = queue.Queue(maxsize=STREAM_QUEUE_ROWS)
+    closed = threading.Event()
+
+    def put(item):
+        while True:
+            try:
+                rows.put(item, timeout=1)
+                return
+            except queue.Full:
+                if closed.is_set():
+                    raise StreamClosed()
+
+    def progress(step, values):
+        if closed.is_set():
+            raise StreamClosed()
+        put({"step": int(step), "conc": np.asarray(values, dtype=np.float64).tolist()})
+
+    def run():
+        try:
+            body, status = simulate(data, progress)
+        except StreamClosed:
+            return
+        except Exception as e:
+            print("Streamed simulation failed:", traceback.format_exc())
+            body, status = {"error": str(e)}, 500
+        try:
+            put({"result": body, "status": status})
+        except StreamClosed:
+            pass
+
+    worker = threading.Thread(target=run, name="simulation-stream", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = rows.get()
+            yield ndjson_line(item)
+            if "result" in item:
+                return
+    finally:
+        closed.set()
+
+
+def stream_history(header, chunks):
+    """
+    Yield a stored history as NDJSON: the header object first, then one
+    {"step", "conc"} row per sample, serialised one (time_steps, conc) chunk
+    at a time as chunks yields them.
+    """
+    yield ndjson_line(header)
+    for time_steps, conc in chunks:
+        values = np.asarray(conc).T.tolist()
+        yield "".join(ndjson_line({"step": step, "conc": row}) for step, row in zip(time_steps.tolist(), values))
@@ -1,11 +1,27 @@
 import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from pymongo import MongoClient
 import requests
 import numpy as np
 import os
+import sys
+from process_pool import run_kernel, map_kernel, SIMULATION_PROCESSES
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from simulation.kernels import model_1_kernel, model_1_batch_kernel, model_1_sweep_kernel
+from simulation.profiles import (
+    process_model_1_layers as process_layers, create_model_1_layer as create_soil_layer, model_1_run_params,
+    model_1_batch_key, model_1_batch_params, model_1_sweep_params,
+)
+from history_store import store_history
+from metrics import MongoCommandTimer, SIMULATION_ITERATIONS, instrument_app, timed
+from result_cache import cache_key
+from simulation_routes import SimulationRoutes
+from streaming import NDJSON, stream_run
+from mongo_schema import bootstrap_indexes, EXISTS_PROJECTION, PROFILE_RUN_PROJECTION
 
 app = Flask(__name__)
+instrument_app(app)
 #soil_layers = {}  # In-memory storage 
 #soil_profiles = {}  # In-memory storage 
 #port = int(os.getenv("PORT", 5001))# Read port dynamically 
@@ -14,13 +30,23 @@ app = Flask(__name__)
 #client = MongoClient("mongodb://host.docker.internal:27017/") localtesting with docker
 # monogodb atlas
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(mongo_uri)
+client = MongoClient(mongo_uri, connect=False, event_listeners=[MongoCommandTimer()])  # Connects on first use
+bootstrap_indexes(app, client)  # Indexes are created before the first request
 
 soil_db = client['soil_database']
 plotting_db = client['plotting_database']
 #soil_layers_collection = db['soil_layers']
-soil_profiles_collection = soil_db['soil_profiles']
-plotting_collection = plotting_db['plotting']
+# Batch, sweep, history, job and cache routes shared with the other model service
+routes = SimulationRoutes(
+    soil_db, plotting_db, "Model1", process_layers,
+    model_1_batch_key, model_1_batch_params, model_1_batch_kernel,
+    model_1_sweep_params, model_1_sweep_kernel, map_kernel, SIMULATION_PROCESSES,
+)
+routes.register(app, "/model")
+soil_profiles_collection = routes.soil_profiles
+plotting_collection = routes.plotting
+profile_ids, simulation_ids = routes.profile_ids, routes.simulation_ids
+jobs, result_cache = routes.jobs, routes.result_cache
 
 @app.route('/model', methods=['GET'])
 def health_check():
@@ -30,47 +56,21 @@ def health_check():
 # Create soil profile
 @app.route('/model/soil-profile', methods=['POST'])
 def create_soil_profile():
-    #request_start_time = datetime.utcnow()
-    #print(f"[Server] /soil-profile received at {request_start_time.isoformat()}Z")
     data = request.json
-    profile_id = soil_profiles_collection.count_documents({}) + 1
-    data['profile'] = {"id": profile_id}
-    layers = []
-    for i, layer_data in enumerate(data['layers'], start=1):
-        # Add ID for soil layer
-        layer_data['id'] = i
-        # Calculate bioturbation rate
-        processed_layer = create_soil_layer(layer_data)
-        if "error" in processed_layer:
-            return jsonify(processed_layer), 400
-        layers.append(processed_layer)
+    layers, error = process_layers(data)
+    if error:
+        return jsonify(error), 400
     
     # Update layer data
     data['layers'] = layers
+    profile_id = profile_ids.next_id()
+    data['profile'] = {"id": profile_id}
     # Store in database
     soil_profiles_collection.insert_one(data)
 
     print(f"Profile {profile_id} has been updated.")
     return jsonify({"id": profile_id}), 201
 
-def create_soil_layer(layer_data):
-    required_fields = ['id', 'depth', 'initial_conc', 'earthworm_density', 'beta']
-    if not all(field in layer_data for field in required_fields):
-        return {"error": "Missing required fields"}
-    try:
-        bioturbation_rate = (layer_data['earthworm_density'] * layer_data['beta']) / layer_data['depth']
-    except ZeroDivisionError:
-        return {"error": "Depth cannot be zero"}
-    # Return the processed layer data
-    return {
-        "id": layer_data['id'],
-        "depth": layer_data['depth'],
-        "conc": layer_data['initial_conc'],
-        "earthworm_density": layer_data['earthworm_density'],
-        "beta": layer_data['beta'],
-        "bioturbation_rate": bioturbation_rate
-    }
-
 # Get soil profile by ID
 @app.route('/model/soil-profile/<int:profile_id>', methods=['GET'])
 def get_soil_profile(profile_id):
@@ -98,7 +98,7 @@ def update_soil_profile(profile_id):
     data = request.json
 
     # Find profile
-    profile = soil_profiles_collection.find_one({"profile.id": profile_id})
+    profile = soil_profiles_collection.find_one({"profile.id": profile_id}, EXISTS_PROJECTION)
     if not profile:
         return jsonify({"error": "Profile not found"}), 404
 
@@ -125,87 +125,100 @@ def update_soil_profile(profile_id):
 
     return jsonify({"message": "Profile updated successfully"}), 200
 
-# Model 1 implementation
-def bioturbation(soil_layers, dt):
-    """
-    Perform bioturbation for the soil layers for the given time step.
-    Modifies the concentrations of the layers in-place.
-    """
-    for l, layer in enumerate(soil_layers):
-        fraction_of_layer_to_mix = layer["bioturbation_rate"] * dt
-        if l < len(soil_layers) - 1:  # Skip the last layer
-            delta = fraction_of_layer_to_mix * (soil_layers[l + 1]["conc"] - layer["conc"])
-            layer["conc"] += delta
-            soil_layers[l + 1]["conc"] -= delta
-
-
-def equal(lst, tol=1e-10):
-    """
-    Check if the concentrations in the list are equal within the specified tolerance.
-    """
-    return abs(max(lst) - min(lst)) < tol
-
 
 @app.route('/model/bioturbation/run', methods=['POST'])
 def run_bioturbation():
-    #print(f"[Server] /bioturbation/run received at {datetime.utcnow().isoformat()}Z")
     """
     Perform bioturbation calculations for the specified soil profile.
+    With "async": true the run is queued and a job ID is returned with 202.
+    With "stream": true every "stream_every"-th step is sent as an NDJSON row
+    while the simulation runs.
     """
     data = request.json
+    if data.get("stream"):
+        # Send NDJSON rows while the run goes on, the last line holds the result
+        return Response(stream_run(simulate_bioturbation, data), mimetype=NDJSON)
+    if data.get("async"):
+        job_id = jobs.submit(simulate_bioturbation, data)
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+    body, status = simulate_bioturbation(data)
+    return jsonify(body), status
+
+
+def simulate_bioturbation(data, progress=None):
+    """
+    Run and store the simulation for a run request. Returns (body, status).
+    A streamed run passes progress(step, values) and runs in this process.
+    """
     profile_id = data["profile_id"]
-    dt = data.get("dt", 86400)
-    tol = data.get("steady_state_tol", 1e-10)
-    max_iter = data.get("max_iter", 10000)
 
     # Fetch the soil profile from MongoDB
-    profile = soil_profiles_collection.find_one({"profile.id": profile_id})
+    profile = soil_profiles_collection.find_one({"profile.id": profile_id}, PROFILE_RUN_PROJECTION)
     if not profile:
-        return jsonify({"error": "Soil profile not found"}), 404
+        return {"error": "Soil profile not found"}, 404
 
-    # Extract layers and initialize variables
+    # Only the compact layer parameters are sent to the worker process
     soil_layers = profile["layers"]
-    data_t = [layer["conc"] for layer in soil_layers]
-    data_matrix = [[layer["conc"]] for layer in soil_layers]
-    t = 0
-    time_steps = [0] 
-    # Perform bioturbation until concentrations are equal
-    while t < max_iter + 1 and not equal(data_t, tol=tol):
-        bioturbation(soil_layers, dt)
-        for l, layer in enumerate(soil_layers):
-            data_matrix[l].append(layer["conc"])
-        data_t = [layer["conc"] for layer in soil_layers]
-        t += 1
-        time_steps.append(t)
-
-        #if t > max_iter:
-            #return jsonify({"error": "Steady state not reached after max #iterations"}), 400
+    try:
+        params = model_1_run_params(soil_layers, data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    mode = params["mode"]
+
+    # Identical runs return the simulation stored by the first one
+    key = cache_key("model_1_kernel", profile["model"], params)
+    use_cache = data.get("cache", True)
+    cached = result_cache.get(key) if use_cache and progress is None else None
+    if cached:
+        return {
+            "profile_id": profile_id,
+            "iterations": cached["iterations"],
+            "simulation_id": cached["simulation_id"],
+            "cached": True,
+            "message": "Bioturbation simulation found in the result cache."
+        }, 201
+
+    try:
+        with timed("simulation"):
+            if progress is None:
+                result = run_kernel(model_1_kernel, params)
+            else:
+                result = model_1_kernel(dict(params, stream_every=data.get("stream_every", 1)), progress)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    time_steps, data_matrix, t = result["time_steps"], result["history"], result["iterations"]
+    SIMULATION_ITERATIONS.observe(t, "run", mode)
 
     # Preparing the data for inserting plotting db
-    simulation_id = plotting_collection.count_documents({}) + 1
+    simulation_id = simulation_ids.next_id()
     plotting_data = {
         "simulation_id": simulation_id,
         "model": profile["model"],
         "profile_id": profile_id,
-        "time_steps": time_steps,
-        "layers": [
-            {"id": layer["id"], "conc": data_matrix[idx]}
-            for idx, layer in enumerate(soil_layers)
-        ]
     }
 
-    plotting_collection.insert_one(plotting_data)
+    store_history(
+        plotting_db, plotting_collection, plotting_data, time_steps,
+        [layer["id"] for layer in soil_layers], data_matrix,
+    )
+    if use_cache:
+        result_cache.put(key, {"simulation_id": simulation_id, "iterations": t})
 
     # Return the results
-    return jsonify({
+    body = {
         "profile_id": profile_id,
         "iterations": t,
         "simulation_id": simulation_id,
         "message": "Bioturbation simulation completed and results stored."
-    }), 201
+    }
+    if mode == "adaptive":
+        body.update(solver_steps=result["solver_steps"], evaluations=result["evaluations"])
+    return body, 201
 
 
 #if __name__ == '__main__':
     app.run(debug=True,port=port)
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
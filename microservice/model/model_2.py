@@ -1,59 +1,61 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from pymongo import MongoClient
 import numpy as np
 import os
+import sys
+from process_pool import run_kernel, map_kernel, SIMULATION_PROCESSES
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from simulation.kernels import model_2_kernel, model_2_batch_kernel, model_2_sweep_kernel
+from simulation.profiles import (
+    process_model_2_layers as process_layers, create_model_2_layer as create_soil_layer, model_2_run_params,
+    model_2_batch_key, model_2_batch_params, model_2_sweep_params,
+)
+from history_store import store_history
+from metrics import MongoCommandTimer, SIMULATION_ITERATIONS, instrument_app, timed
+from result_cache import cache_key
+from simulation_routes import SimulationRoutes
+from streaming import NDJSON, stream_run
+from mongo_schema import bootstrap_indexes, EXISTS_PROJECTION, PROFILE_RUN_PROJECTION
 app = Flask(__name__)
+instrument_app(app)
 port = int(os.getenv("PORT", 5002))# Read port dynamically 
 
 # Connect to MongoDB
-client = MongoClient("mongodb://localhost:27017/")
+client = MongoClient("mongodb://localhost:27017/", connect=False, event_listeners=[MongoCommandTimer()])  # Connects on first use
+bootstrap_indexes(app, client)  # Indexes are created before the first request
 soil_db = client['soil_database']
 plotting_db = client['plotting_database']
-soil_profiles_collection = soil_db['soil_profiles']
-plotting_collection = plotting_db['plotting']
+# Batch, sweep, history, job and cache routes shared with the other model service
+routes = SimulationRoutes(
+    soil_db, plotting_db, "Model2", process_layers,
+    model_2_batch_key, model_2_batch_params, model_2_batch_kernel,
+    model_2_sweep_params, model_2_sweep_kernel, map_kernel, SIMULATION_PROCESSES,
+)
+routes.register(app)
+soil_profiles_collection = routes.soil_profiles
+plotting_collection = routes.plotting
+profile_ids, simulation_ids = routes.profile_ids, routes.simulation_ids
+jobs, result_cache = routes.jobs, routes.result_cache
 
 # Create soil profile
 @app.route('/soil-profile', methods=['POST'])
 def create_soil_profile():
     data = request.json
-    profile_id = soil_profiles_collection.count_documents({}) + 1
-    data['profile'] = {"id": profile_id}
-    h = data.get('h', 0.2)
-    layers = []
-    for i, layer_data in enumerate(data['layers'], start=1):
-        # Add ID for soil layer
-        layer_data['id'] = i
-        # Calculate diffusion coefficient
-        processed_layer = create_soil_layer(layer_data,h)
-        if "error" in processed_layer:
-            return jsonify(processed_layer), 400
-        layers.append(processed_layer)
+    layers, error = process_layers(data)
+    if error:
+        return jsonify(error), 400
     
     # Update layer data
     data['layers'] = layers
+    profile_id = profile_ids.next_id()
+    data['profile'] = {"id": profile_id}
     # Store in database
     soil_profiles_collection.insert_one(data)
 
     print(f"Profile {profile_id} has been updated.")
     return jsonify({"id": profile_id}), 201
 
-def create_soil_layer(layer_data,h):
-    required_fields = ['id', 'depth', 'initial_conc', 'earthworm_density', 'beta']
-    if not all(field in layer_data for field in required_fields):
-        return {"error": "Missing required fields"}
-    
-    diffusion_coefficient = (layer_data['earthworm_density'] * layer_data['beta']) * h
-    
-    # Return the processed layer data
-    return {
-        "id": layer_data['id'],
-        "depth": layer_data['depth'],
-        "conc": layer_data['initial_conc'],
-        "earthworm_density": layer_data['earthworm_density'],
-        "beta": layer_data['beta'],
-        "diffusion_coefficient": diffusion_coefficient,
-    }
-
 # Get soil profile by ID
 @app.route('/soil-profile/<int:profile_id>', methods=['GET'])
 def get_soil_profile(profile_id):
@@ -81,7 +83,7 @@ def update_soil_profile(profile_id):
     data = request.json
 
     # Find profile
-    profile = soil_profiles_collection.find_one({"profile.id": profile_id})
+    profile = soil_profiles_collection.find_one({"profile.id": profile_id}, EXISTS_PROJECTION)
     if not profile:
         return jsonify({"error": "Profile not found"}), 404
 
@@ -112,81 +114,77 @@ def update_soil_profile(profile_id):
 @app.route('/bioturbation/run', methods=['POST'])
 def run_bioturbation():
     data = request.json
+    if data.get("stream"):
+        # Send NDJSON rows while the run goes on, the last line holds the result
+        return Response(stream_run(simulate_bioturbation, data), mimetype=NDJSON)
+    if data.get("async"):
+        # Queue the run and let the client poll /jobs/<job_id>
+        job_id = jobs.submit(simulate_bioturbation, data)
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+    body, status = simulate_bioturbation(data)
+    return jsonify(body), status
+
+
+def simulate_bioturbation(data, progress=None):
+    """
+    Run and store the simulation for a run request. Returns (body, status).
+    A streamed run passes progress(step, values) and runs in this process.
+    """
     profile_id = data["profile_id"]
-    dt = data.get("dt",86400)/86400
-    tol = data.get("steady_state_tol", 1e-12)
-    max_iter = data.get("max_iter", 10000)
 
-    profile = soil_profiles_collection.find_one({"profile.id": profile_id})
+    profile = soil_profiles_collection.find_one({"profile.id": profile_id}, PROFILE_RUN_PROJECTION)
     if not profile:
-        return jsonify({"error": "Soil profile not found"}), 404
-    
-    layers = profile['layers']
-    depths = [layer['depth'] for layer in layers]
-    initial_conc = [layer['conc'] for layer in layers]
-    diffusion_coeffs = [layer['diffusion_coefficient'] for layer in layers]
-    Nx = 10  # Number of spatial grid points
-    Dx = sum(depths) / Nx
-    Nt = max_iter
-
-    total_depth = sum(depths)
-    grid_points = np.linspace(0, total_depth, Nx)
-    C = np.zeros(Nx)
-
-    # Assign initial concentrations to grid
-    start_idx = 0
-    for i, depth in enumerate(depths):
-        layer_points = int(depth / Dx)
-        C[start_idx:start_idx + layer_points] = initial_conc[i]
-        start_idx += layer_points
-
-    # Assign spatially varying diffusion coefficients
-    D = np.zeros(Nx)
-    start_idx = 0
-    for i, depth in enumerate(depths):
-        layer_points = int(depth / Dx)
-        D[start_idx:start_idx + layer_points] = diffusion_coeffs[i]
-        start_idx += layer_points
-
-    # Perform simulation
-    concentration_history = np.zeros((len(depths), Nt))
-    for n in range(Nt):
-        C_new = C.copy()
-        for i in range(1, Nx - 1):
-            D_ip = (D[i] + D[i + 1]) / 2
-            D_im = (D[i] + D[i - 1]) / 2
-            C_new[i] = C[i] + (dt / Dx**2) * (D_ip * (C[i + 1] - C[i]) - D_im * (C[i] - C[i - 1]))
-        C[:] = C_new[:]
-
-        # Record concentrations for each layer
-        start_idx = 0
-        for i, depth in enumerate(depths):
-            layer_points = int(depth / Dx)
-            concentration_history[i, n] = np.mean(C[start_idx:start_idx + layer_points])
-            start_idx += layer_points
-
-        # Check steady-state
-        if np.max(concentration_history[:, n]) - np.min(concentration_history[:, n]) <= tol:
-            concentration_history = concentration_history[:, :n + 1]
-            print(f"Steady state reached at iteration: {n + 1}")
-            break
+        return {"error": "Soil profile not found"}, 404
+
+    # Only the compact layer parameters are sent to the worker process
+    try:
+        params = model_2_run_params(profile['layers'], data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    mode = params["mode"]
+
+    # Identical runs return the simulation stored by the first one
+    key = cache_key("model_2_kernel", profile.get("model", "Unknown"), params)
+    use_cache = data.get("cache", True)
+    cached = result_cache.get(key) if use_cache and progress is None else None
+    if cached:
+        return {"message": "Simulation found in the result cache",
+                "simulation_id": cached["simulation_id"], "cached": True}, 201
+
+    try:
+        with timed("simulation"):
+            if progress is None:
+                result = run_kernel(model_2_kernel, params)
+            else:
+                result = model_2_kernel(dict(params, stream_every=data.get("stream_every", 1)), progress)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    SIMULATION_ITERATIONS.observe(result["iterations"], "run", mode)
+    body, status = store_simulation(profile, profile_id, result["time_steps"], result["history"])
+    if mode == "adaptive":
+        body.update(solver_steps=result["solver_steps"], evaluations=result["evaluations"])
+    if use_cache:
+        result_cache.put(key, {"simulation_id": body["simulation_id"]})
+    return body, status
+
+
+def store_simulation(profile, profile_id, time_steps, concentration_history):
+    """Store the layer concentration history in the plotting database."""
     # Format results for insertion
-    simulation_id = plotting_collection.count_documents({}) + 1
+    simulation_id = simulation_ids.next_id()
     plotting_data = {
         "simulation_id": simulation_id,
         "model": profile.get("model", "Unknown"),
         "profile_id": profile_id,
-        "time_steps": list(range(concentration_history.shape[1])),
-        "layers": [
-            {"id": i + 1, "conc": concentration_history[i, :].tolist()}
-            for i in range(len(depths))
-        ]
     }
 
     # Insert into MongoDB
-    plotting_collection.insert_one(plotting_data)
+    store_history(
+        plotting_db, plotting_collection, plotting_data, time_steps,
+        list(range(1, concentration_history.shape[0] + 1)), concentration_history,
+    )
 
-    return jsonify({"message": "Simulation completed", "simulation_id": simulation_id}), 201
+    return {"message": "Simulation completed", "simulation_id": simulation_id}, 201
 
 if __name__ == '__main__':
     app.run(debug=True,port=port)
\ No newline at end of file
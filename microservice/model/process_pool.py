@@ -0,0 +1,61 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import threading
+
+# Worker processes for the simulation kernels, 0 runs them in the request thread
+SIMULATION_PROCESSES = int(os.getenv("SIMULATION_PROCESSES", os.cpu_count() or 1))
+
+_pool = None
+_lock = threading.Lock()
+
+
+def _context():
+    """Forkserver workers are forked from a clean process with the kernels preloaded."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["simulation.kernels"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def get_pool():
+    """Return the shared process pool, starting it on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SIMULATION_PROCESSES, mp_context=_context())
+        return _pool
+
+
+def _reset(pool):
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def run_kernel(fn, *args):
+    """
+    Run a module-level kernel function in a worker process and return its result.
+    Only the arguments and the result are pickled, so the kernel should take
+    compact parameters and return arrays. Exceptions raised by the kernel are
+    re-raised here.
+    """
+    return map_kernel(fn, [args])[0]
+
+
+def map_kernel(fn, items):
+    """Run fn(*args) for every args tuple in items across the pool, in order."""
+    if SIMULATION_PROCESSES <= 0:
+        return [fn(*args) for args in items]
+    pool = get_pool()
+    try:
+        futures = [pool.submit(fn, *args) for args in items]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory), start a fresh pool next time
+        _reset(pool)
+        raise
@@ -1,19 +1,25 @@
 import datetime
 from pymongo import MongoClient
 import numpy as np
-import pandas as pd
-import plotly.express as px
 from flask import Flask, request, jsonify, send_file
 import io
 import os
-import boto3
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from simulation.plots import as_df, create_plot, png_buffer
+from history_store import read_history_window, window_from_request
+from mongo_schema import bootstrap_indexes
+from metrics import MongoCommandTimer, instrument_app, timed
 import uuid
 import traceback
 
 app = Flask(__name__)
+instrument_app(app)
 port = int(os.getenv("PORT", 5003))# Read port dynamically 
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-client = MongoClient(mongo_uri)
+client = MongoClient(mongo_uri, connect=False, event_listeners=[MongoCommandTimer()])  # Connects on first use
+bootstrap_indexes(app, client)  # Indexes are created before the first request
 #client = MongoClient("mongodb://localhost:27017/")
 soil_db = client['soil_database']
 plotting_db = client['plotting_database']
@@ -21,7 +27,7 @@ plotting_db = client['plotting_database']
 soil_profiles_collection = soil_db['soil_profiles']
 plotting_collection = plotting_db['plotting']
 
-s3 = boto3.client('s3') 
+_s3 = None
 BUCKET_NAME = os.getenv("BUCKET_NAME", "plotting-bucket")
 
 
@@ -29,8 +35,17 @@ BUCKET_NAME = os.getenv("BUCKET_NAME", "plotting-bucket")
 PLOTS_DIR = os.path.join(os.getcwd(), "plots")
 os.makedirs(PLOTS_DIR, exist_ok=True)
 
+def get_s3():
+    """Return the S3 client, importing boto3 and creating it on first use."""
+    global _s3
+    if _s3 is None:
+        import boto3
+        _s3 = boto3.client('s3')
+    return _s3
+
 def upload_plot_to_s3(buffer, simulation_id):
     """Upload plot image to S3 and return a presigned URL."""
+    s3 = get_s3()
     filename = f"plots/bioturbation_plot_{simulation_id}_{uuid.uuid4().hex}.png"
 
     # Upload the buffer to S3
@@ -49,53 +64,39 @@ def upload_plot_to_s3(buffer, simulation_id):
     )
     return url
 
-def get_data_by_simulation_id(simulation_id):
-    """Retrieve data from the database by simulation_id."""
-    record = plotting_collection.find_one({"simulation_id": simulation_id})
-    if not record:
-        raise ValueError(f"No data found for simulation_id: {simulation_id}")
-    return record
-
-def as_df(data, time_steps):
-    """Convert data to a DataFrame."""
-    concentrations = [layer['conc'] for layer in data]
-    df = pd.DataFrame(
-        np.swapaxes(np.array(concentrations), 0, 1),
-        columns=[f'soil_layer_{layer["id"]}' for layer in data]
-    )
-    df['time'] = time_steps
-    return df
-
-def create_plot(data):
-    fig = px.line(
-        data.melt(id_vars='time', var_name='Layer', value_name='Concentration'),
-        x='time',
-        y='Concentration',
-        color='Layer',
-        labels={'time': 'Time Steps', 'Concentration': 'Concentration'}
+def get_data_by_simulation_id(simulation_id, layers=None, start=None, stop=None, stride=1):
+    """
+    Retrieve the history of a simulation from the database, optionally only
+    some layers over a time window. Returns (time_steps, layer_ids, conc).
+    """
+    window = read_history_window(
+        plotting_db, plotting_collection, {"simulation_id": simulation_id},
+        layers=layers, start=start, stop=stop, stride=stride,
     )
-    return fig
+    if window is None:
+        raise LookupError(f"No data found for simulation_id: {simulation_id}")
+    return window
+
 @app.route('/plotting', methods=['GET'])
 def health_check():
     return jsonify({"status": "Plotting Microservice is running"}), 200
 
 @app.route('/plotting/plot', methods=['POST'])
 def plot():
-    #print(f"[Server] /plot received at {datetime.utcnow().isoformat()}Z")
     data = request.json
     simulation_id = data.get('simulation_id')
     if not simulation_id:
         return jsonify({"error": "simulation_id parameter is required"}), 400
 
     try:
-        # Retrieve data
-        record = get_data_by_simulation_id(simulation_id)
-        time_steps = record['time_steps']
-        layers = record['layers']
+        # Retrieve data, optionally only "layers" between "start" and "stop" every "stride" steps
+        time_steps, layer_ids, conc = get_data_by_simulation_id(simulation_id, **window_from_request(data))
 
         # Convert to DataFrame and create plot
-        df = as_df(layers, time_steps)
-        fig = create_plot(df)
+        with timed("as_df"):
+            df = as_df(conc, layer_ids, time_steps)
+        with timed("create_plot"):
+            fig = create_plot(df)
 
         # Generate the plot as a PNG image
         # buffer = io.BytesIO()
@@ -109,12 +110,12 @@ def plot():
         # print("Plot generated and saved")
         # return jsonify({"message": "Plot generated and saved", "file_path": file_path}), 200
         # Generate the plot as a PNG image
-        buffer = io.BytesIO()
-        fig.write_image(buffer, format='png')
-        buffer.seek(0)
+        with timed("png_export"):
+            buffer = png_buffer(fig)
 
         # Upload to S3 and get download link
-        download_url = upload_plot_to_s3(buffer, simulation_id)
+        with timed("s3_upload"):
+            download_url = upload_plot_to_s3(buffer, simulation_id)
         print("Plot generated and uploaded to S3")
 
         return jsonify({
@@ -123,9 +124,12 @@ def plot():
         }), 200
 
     
-    except ValueError as e:
+    except LookupError as e:
         return jsonify({"error": str(e)}), 404
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     except Exception as e:
         print("🔥 Exception:", traceback.format_exc())
         return jsonify({"error": str(e)}), 500 
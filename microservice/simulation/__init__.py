@@ -0,0 +1,13 @@
+"""
+Simulation core of both models: NumPy kernels, profile processing and
+history recording, with no Flask or Mongo imports. SciPy, pandas and plotly
+are only imported by the functions that use them.
+"""
+from .kernels import (
+    model_1_kernel, model_1_batch_kernel, model_1_sweep_kernel,
+    model_2_kernel, model_2_batch_kernel, model_2_sweep_kernel,
+)
+from .profiles import (
+    process_model_1_layers, model_1_run_params, process_model_2_layers, model_2_run_params,
+)
+from .cli import run_config
@@ -0,0 +1,120 @@
+"""
+Run a profile config such as client/config1.json in this process, without the
+services or a database:
+
+    python -m simulation client/config1.json --set mode=fast-forward --output history.csv
+
+from the microservice directory, or python -m microservice.simulation from the
+repository root. Prints a JSON summary of the run.
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from .kernels import model_1_kernel, model_2_kernel
+from .profiles import process_model_1_layers, model_1_run_params, process_model_2_layers, model_2_run_params
+
+# Layer processing, run parameters and kernel of each model
+MODELS = {
+    "Model1": (process_model_1_layers, model_1_run_params, model_1_kernel),
+    "Model2": (process_model_2_layers, model_2_run_params, model_2_kernel),
+}
+
+
+def run_config(config, model=None):
+    """
+    Run a profile config with its run options (model from config["model"]
+    unless given). Returns the kernel result plus "model" and "layer_ids";
+    raises ValueError for a bad config.
+    """
+    model = model or config.get("model", "Model1")
+    if model not in MODELS:
+        raise ValueError(f"model must be one of {', '.join(MODELS)}")
+    process, run_params, kernel = MODELS[model]
+    layers, error = process(config)
+    if error:
+        raise ValueError(error["error"])
+    result = kernel(run_params(layers, config))
+    result.update(model=model, layer_ids=[layer["id"] for layer in layers])
+    return result
+
+
+def parse_value(text):
+    """JSON value of a --set option, or the plain string."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def save_history(path, result):
+    """Write the history as CSV (a time column plus one per layer) or JSON."""
+    history = np.asarray(result["history"])
+    if path.endswith(".csv"):
+        header = ",".join(["time"] + [f"soil_layer_{layer_id}" for layer_id in result["layer_ids"]])
+        table = np.column_stack([result["time_steps"], history.T])
+        np.savetxt(path, table, delimiter=",", header=header, comments="")
+    else:
+        with open(path, "w") as f:
+            json.dump({"time_steps": result["time_steps"], "layer_ids": result["layer_ids"],
+                       "history": history.tolist()}, f)
+
+
+def save_plot(path, result):
+    """Write the history plot as HTML, or as an image for other extensions (needs kaleido)."""
+    from .plots import history_plot
+    fig = history_plot(result["time_steps"], result["layer_ids"], result["history"])
+    if path.endswith(".html"):
+        fig.write_html(path)
+    else:
+        fig.write_image(path)
+
+
+def summary(result, elapsed):
+    history = np.asarray(result["history"])
+    body = {
+        "model": result["model"],
+        "iterations": int(result["iterations"]),
+        "samples": len(result["time_steps"]),
+        "final_conc": history[:, -1].tolist() if history.size else [],
+        "elapsed": round(elapsed, 6),
+    }
+    for key in ("solver_steps", "evaluations"):
+        if key in result:
+            body[key] = int(result[key])
+    return body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m simulation", description="Run a soil profile config in-process.")
+    parser.add_argument("config", help="profile config JSON, e.g. client/config1.json")
+    parser.add_argument("--model", choices=sorted(MODELS), help="model to run (default: the config's \"model\")")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a run option, VALUE is parsed as JSON (repeatable)")
+    parser.add_argument("--output", help="write the history to a .csv or .json file")
+    parser.add_argument("--plot", help="write the history plot to an .html or image file")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    for option in args.set:
+        key, sep, value = option.partition("=")
+        if not sep:
+            parser.error(f"--set expects KEY=VALUE, got {option!r}")
+        config[key] = parse_value(value)
+
+    start = time.perf_counter()
+    try:
+        result = run_config(config, args.model)
+    except ValueError as e:
+        print(json.dumps({"error": str(e)}), file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        save_history(args.output, result)
+    if args.plot:
+        save_plot(args.plot, result)
+    print(json.dumps(summary(result, elapsed), indent=2))
+    return 0
@@ -0,0 +1,549 @@
+"""
+Numerical engines of both models. SciPy submodules are imported by the
+functions that need them, so importing the engine only costs NumPy.
+"""
+import math
+import numpy as np
+
+# Implicit weight theta of the Model 2 time-stepping schemes, None for the explicit one
+MODEL_2_SOLVERS = {"explicit": None, "backward-euler": 1.0, "crank-nicolson": 0.5}
+# scipy.integrate solvers of the adaptive mode; the implicit ones get the exact Jacobian
+ODE_METHODS = ("RK45", "RK23", "DOP853", "Radau", "BDF", "LSODA")
+
+
+def model_1_step_operator(rates, dt):
+    """
+    Build the matrix A such that one Model 1 time step is conc_new = A @ conc.
+    The layer sweep in bioturbation() is a product of 2x2 mixing blocks applied
+    top-down, so A is assembled once by pushing the identity through the sweep.
+    """
+    return model_1_step_operators(np.asarray(rates, dtype=np.float64)[None, :], dt)[0]
+
+
+def model_1_step_operators(rates, dt):
+    """Stacked model_1_step_operator for a (profiles, layers) array of rates."""
+    rates = np.asarray(rates, dtype=np.float64)
+    P, n = rates.shape
+    A = np.broadcast_to(np.eye(n), (P, n, n)).copy()
+    for l in range(n - 1):  # Skip the last layer
+        f = rates[:, l, None] * dt
+        delta = f * (A[:, l + 1] - A[:, l])
+        A[:, l] += delta
+        A[:, l + 1] -= delta
+    return A
+
+
+def model_1_rate_operator(rates, dt):
+    """
+    Continuous form of the Model 1 mixing, the matrix K of dc/dt = K @ c with
+    t counted in time steps of length dt: layer l exchanges rates[l] * dt of
+    the concentration difference per step with the layer below it.
+    """
+    f = np.asarray(rates, dtype=np.float64)[:-1] * dt  # Skip the last layer
+    l = np.arange(f.size)
+    K = np.zeros((f.size + 1, f.size + 1))
+    K[l, l + 1] = K[l + 1, l] = f
+    K[l, l] -= f
+    K[l + 1, l + 1] -= f
+    return K
+
+
+def model_1_generator(rates, dt):
+    """
+    Matrix K of dc/dt = K @ c with expm(K) equal to the Model 1 step operator,
+    so the solution passes through the stepped states at every whole time step
+    and reaches steady state at the same iteration as step mode. When the step
+    operator has eigenvalues that are not positive (very fast mixing) it has no
+    real logarithm, and the continuous limit model_1_rate_operator is used.
+    """
+    from scipy import linalg
+    A = model_1_step_operator(rates, dt)
+    lam = np.linalg.eigvals(A)
+    if np.all(np.abs(lam.imag) < 1e-12) and lam.real.min() > 1e-12:
+        K = linalg.logm(A)
+        if np.all(np.isfinite(K)) and np.abs(np.imag(K)).max() < 1e-12:
+            return np.real(K)
+    return model_1_rate_operator(rates, dt)
+
+
+def run_linear(A, conc, tol, max_iter, recorder):
+    """
+    Advance conc with the step operator A until the layers are equal within tol
+    or max_iter + 1 steps have been taken, mirroring run_bioturbation's loop.
+    Every state is offered to recorder; returns the number of iterations.
+    """
+    A = np.ascontiguousarray(A, dtype=np.float64)
+    state = np.array(conc, dtype=np.float64)
+    buffer = np.empty_like(state)
+    recorder.record(0, state)
+    t = 0
+    while t < max_iter + 1 and not abs(state.max() - state.min()) < tol:
+        np.dot(A, state, out=buffer)
+        state, buffer = buffer, state
+        t += 1
+        recorder.record(t, state)
+    recorder.finish()
+    return t
+
+
+def run_linear_batch(A, conc, tol, max_iter, recorder):
+    """
+    run_linear for a stack of profiles sharing a layer count: A is
+    (profiles, layers, layers) and conc (profiles, layers). The flattened
+    state is offered to recorder every step; profiles that reached steady
+    state are no longer stepped and hold their values from then on.
+    Returns the iterations per profile and the state each one stopped at.
+    """
+    A = np.asarray(A, dtype=np.float64)
+    state = np.array(conc, dtype=np.float64)
+    n = state.shape[1]
+    converged = np.abs(state.max(axis=1) - state.min(axis=1)) < tol
+    iterations = np.where(converged, 0, max_iter + 1)
+    active = np.flatnonzero(~converged)
+    recorder.record(0, state.ravel())
+    # The active profiles are stepped layer-major, (layers, profiles), so the
+    # matrix-vector products and the steady-state check run over contiguous rows
+    A_active = np.ascontiguousarray(A[active].transpose(1, 2, 0))
+    x = np.ascontiguousarray(state[active].T)
+    t = 0
+    while t < max_iter + 1 and active.size:
+        new = A_active[:, 0] * x[0]
+        for j in range(1, n):
+            new += A_active[:, j] * x[j]
+        x = new
+        t += 1
+        state[active] = x.T
+        recorder.record(t, state.ravel())
+        done = np.abs(x.max(axis=0) - x.min(axis=0)) < tol
+        if done.any():
+            iterations[active[done]] = t
+            keep = ~done
+            active, A_active, x = active[keep], np.ascontiguousarray(A_active[:, :, keep]), x[:, keep]
+    recorder.finish()
+    return iterations, state
+
+
+def model_2_grid_size(total_depth, Nx=None, dx=None):
+    """
+    Number of grid cells of a Model 2 profile: Nx itself, or the fewest cells
+    no wider than the target spacing dx. Raises ValueError for a bad request.
+    """
+    if dx is not None:
+        if Nx is not None:
+            raise ValueError("Give either Nx or dx, not both")
+        if not isinstance(dx, (int, float)) or not dx > 0:
+            raise ValueError("dx must be a positive number")
+        Nx = max(math.ceil(total_depth / dx - 1e-9), 3)
+    if Nx is None:
+        Nx = 10
+    if not isinstance(Nx, int) or isinstance(Nx, bool) or Nx < 3:
+        raise ValueError("Nx must be an integer of at least 3")
+    return Nx
+
+
+def model_2_overlaps(depths, Nx):
+    """
+    Overlap of every layer with every one of the Nx equal grid cells spanning
+    its profile. depths is a (layers,) or (profiles, layers) array. A cell on
+    a layer boundary is shared by the layers in proportion to their part of
+    it. Built from the merged layer and cell edges in O(layers + Nx) per
+    profile. Returns the (profile, layer, cell, length) arrays of the nonzero
+    overlaps and the cell width Dx of every profile.
+    """
+    depths = np.atleast_2d(np.asarray(depths, dtype=np.float64))
+    if not np.all(depths > 0):
+        raise ValueError("Layer depths must be positive")
+    P, layers = depths.shape
+    layer_edges = np.zeros((P, layers + 1))
+    np.cumsum(depths, axis=1, out=layer_edges[:, 1:])
+    total = layer_edges[:, -1]
+    Dx = total / Nx
+    cell_edges = np.arange(Nx + 1) * Dx[:, None]
+    # Merge the edges; counting the layer and cell edges up to the start of
+    # every segment gives the layer and the cell it lies in
+    merged = np.concatenate((layer_edges, cell_edges), axis=1)
+    order = np.argsort(merged, axis=1, kind="stable")
+    edges = np.minimum(np.take_along_axis(merged, order, axis=1), total[:, None])
+    is_layer_edge = order <= layers
+    layer = np.minimum(np.cumsum(is_layer_edge, axis=1)[:, :-1] - 1, layers - 1)
+    cell = np.minimum(np.cumsum(~is_layer_edge, axis=1)[:, :-1] - 1, Nx - 1)
+    lengths = np.diff(edges, axis=1)
+    profile = np.broadcast_to(np.arange(P)[:, None], lengths.shape)
+    keep = lengths > 0
+    profile, layer, cell, lengths = profile[keep], layer[keep], cell[keep], lengths[keep]
+    return (profile, layer, cell, lengths), Dx
+
+
+def model_2_grid(depths, values, Nx):
+    """
+    Spread per-layer values onto the Nx-cell grid. Each cell holds the
+    thickness-weighted mean of the layers it overlaps. depths and values are
+    (layers,) arrays, or (profiles, layers) for a stack of profiles.
+    Returns the grid array(s) and Dx.
+    """
+    (profile, layer, cell, lengths), Dx = model_2_overlaps(depths, Nx)
+    values = np.broadcast_to(np.asarray(values, dtype=np.float64), (Dx.size, np.shape(depths)[-1]))
+    grid = np.bincount(profile * Nx + cell, weights=lengths * values[profile, layer], minlength=Dx.size * Nx)
+    grid = grid.reshape(Dx.size, Nx) / Dx[:, None]
+    if np.ndim(depths) == 1:
+        return grid[0], Dx[0]
+    return grid, Dx
+
+
+def model_2_layer_operator(depths, Nx):
+    """
+    Build the sparse (layers, Nx) matrix that averages the grid cells of each
+    layer, weighted by the part of each cell inside the layer.
+    """
+    from scipy import sparse
+    (_, layer, cell, lengths), _ = model_2_overlaps(depths, Nx)
+    weights = lengths / np.asarray(depths, dtype=np.float64)[layer]
+    return sparse.csr_matrix((weights, (layer, cell)), shape=(len(depths), Nx))
+
+
+def model_2_batch_layer_operator(depths, Nx):
+    """model_2_layer_operator for a (profiles, layers) array of depths, see BatchLayerOperator."""
+    depths = np.asarray(depths, dtype=np.float64)
+    (profile, layer, cell, lengths), _ = model_2_overlaps(depths, Nx)
+    weights = lengths / depths[profile, layer]
+    return BatchLayerOperator(profile, layer, cell, weights, depths.shape, Nx)
+
+
+def model_2_stencil(D):
+    """
+    Sparse tridiagonal matrix L of the finite-difference stencil on the grid
+    diffusivities D, so that an explicit step is C_new = C + dt / Dx**2 * L @ C.
+    The rows of the two fixed boundary points are zero.
+    """
+    from scipy import sparse
+    D = np.asarray(D, dtype=np.float64)
+    D_face = (D[:-1] + D[1:]) / 2
+    lower = np.append(D_face[:-1], 0.0)
+    upper = np.insert(D_face[1:], 0, 0.0)
+    diag = np.zeros(D.size)
+    diag[1:-1] = -(D_face[:-1] + D_face[1:])
+    return sparse.diags((lower, diag, upper), (-1, 0, 1), format="csr")
+
+
+def model_2_stable_dt(D, Dx):
+    """
+    Largest time step for which the explicit Model 2 scheme on the grid
+    diffusivities D (last axis) is stable, dt / Dx**2 * max(D) <= 1/2.
+    Infinite where every diffusivity is zero.
+    """
+    D_max = np.max(np.asarray(D, dtype=np.float64), axis=-1)
+    with np.errstate(divide="ignore"):
+        return 0.5 * np.asarray(Dx, dtype=np.float64)**2 / D_max
+
+
+def model_2_step_operator(D, dt, Dx, solver="explicit"):
+    """
+    Build the dense matrix B such that one Model 2 step is C_new = B @ C.
+    Interior points follow the finite-difference stencil, the two boundary
+    points are left unchanged. For the implicit solvers B is
+    (I - theta r L)^-1 (I + (1 - theta) r L), L being the stencil.
+    """
+    L = model_2_stencil(D).toarray()
+    identity = np.eye(L.shape[0])
+    r = dt / Dx**2
+    theta = MODEL_2_SOLVERS[solver]
+    if theta is None:
+        return identity + r * L
+    return np.linalg.solve(identity - theta * r * L, identity + (1 - theta) * r * L)
+
+
+def model_2_implicit_factors(D_face, r, theta):
+    """
+    LU-factor the tridiagonal matrix I - theta r L of an implicit Model 2 step
+    once with LAPACK dgttrf; pass the factors to dgttrs for every step.
+    """
+    from scipy.linalg import lapack
+    Nx = D_face.size + 1
+    lower = np.zeros(Nx - 1)
+    diag = np.ones(Nx)
+    upper = np.zeros(Nx - 1)
+    # Interior rows only, the boundary rows stay identity rows
+    lower[:-1] = -theta * r * D_face[:-1]
+    diag[1:-1] = 1 + theta * r * (D_face[:-1] + D_face[1:])
+    upper[1:] = -theta * r * D_face[1:]
+    *factors, info = lapack.dgttrf(lower, diag, upper)
+    if info != 0:
+        raise ValueError("Implicit Model 2 system is singular")
+    return factors
+
+
+def eigendecompose(A, cond_limit=1e8):
+    """
+    Eigendecompose the step operator A = V diag(lam) V^-1 once per profile.
+    Returns (lam, V, V^-1), or None when A is too close to defective for the
+    powers lam**t to be trusted.
+    """
+    lam, V = np.linalg.eig(A)
+    if not np.isfinite(lam).all() or np.linalg.cond(V) > cond_limit:
+        return None
+    # Complex dtype so negative eigenvalues can be raised to any power
+    return lam.astype(np.complex128), V, np.linalg.inv(V)
+
+
+def spectral_observe(decomposition, state, steps, observe=None):
+    """
+    Evaluate observe @ A**t @ state for every t in steps without stepping.
+    Returns an array of shape (observed values, len(steps)).
+    """
+    lam, V, V_inv = decomposition
+    weights = V_inv @ np.asarray(state, dtype=np.float64)
+    left = V if observe is None else observe @ V
+    powers = lam[:, None] ** np.asarray(steps, dtype=np.float64)[None, :]
+    return (left @ (powers * weights[:, None])).real
+
+
+def spectral_first_equal(decomposition, state, tol, first, last, observe=None,
+                         inclusive=False, block=2048):
+    """
+    Find the first step t in [first, last] at which the observed values are
+    equal within tol (spread < tol, or <= tol when inclusive).
+    Returns None if the tolerance is not reached by step last.
+    """
+    for start in range(first, last + 1, block):
+        steps = np.arange(start, min(start + block, last + 1))
+        values = spectral_observe(decomposition, state, steps, observe)
+        spread = values.max(axis=0) - values.min(axis=0)
+        hit = spread <= tol if inclusive else np.abs(spread) < tol
+        if hit.any():
+            return int(steps[np.argmax(hit)])
+    return None
+
+
+def spectral_record(decomposition, state, first, last, recorder, observe=None, offset=0,
+                    block=2048):
+    """
+    Evaluate steps first..last in blocks and offer them to recorder, so only
+    the sampled states are kept. Step t is recorded as A**(t + offset) @ state.
+    """
+    for start in range(first, last + 1, block):
+        steps = np.arange(start, min(start + block, last + 1))
+        values = spectral_observe(decomposition, state, steps + offset, observe)
+        recorder.record_block(steps, values)
+    recorder.finish()
+
+
+def run_model_2(C, D, M, dt, Dx, tol, Nt, recorder, solver="explicit"):
+    """
+    Model 2 for one profile: C and D are the Nx-point grids and M the
+    (layers, Nx) layer averaging operator, dense or sparse. The face
+    diffusivities are computed once and every step updates C through
+    preallocated buffers. The implicit
+    solvers (see MODEL_2_SOLVERS) factor their tridiagonal system once and
+    reuse it for every step. The layer means after step n + 1 are offered to
+    recorder as step n. Returns the iteration at which the means were equal
+    within tol, or None.
+    """
+    from scipy import sparse
+    from scipy.linalg import lapack
+    C = np.array(C, dtype=np.float64)
+    D = np.asarray(D, dtype=np.float64)
+    if sparse.issparse(M) and M.shape[0] * M.shape[1] <= 4096:
+        # Small operators are cheaper as a dense product
+        M = M.toarray()
+    r = dt / Dx**2
+    D_face = (D[:-1] + D[1:]) / 2  # between grid points i and i + 1
+    theta = MODEL_2_SOLVERS[solver]
+    factors = None
+    explicit = r
+    if theta is not None:
+        factors = model_2_implicit_factors(D_face, r, theta)
+        explicit = (1 - theta) * r
+    flux = np.empty(C.size - 1)
+    change = np.empty(C.size - 2)
+    steady = None
+    for n in range(Nt):
+        if explicit:
+            np.subtract(C[1:], C[:-1], out=flux)
+            flux *= D_face
+            np.subtract(flux[1:], flux[:-1], out=change)
+            change *= explicit
+            C[1:-1] += change
+        if factors is not None:
+            C, info = lapack.dgttrs(*factors, C, overwrite_b=1)
+        layer_conc = M @ C
+        recorder.record(n, layer_conc)
+        if layer_conc.max() - layer_conc.min() <= tol:
+            steady = n + 1
+            break
+    recorder.finish()
+    return steady
+
+
+def run_model_2_batch(C, D, M, dt, Dx, tol, Nt, recorder):
+    """
+    Explicit Model 2 stencil for a stack of profiles sharing a layer count and
+    grid size. C and D are (profiles, Nx) grids, M their BatchLayerOperator
+    (see model_2_batch_layer_operator) and dt and Dx the time step
+    and grid spacing, scalar or per profile. The layer means after step n + 1
+    are offered to recorder as step n, flattened; profiles that reached steady
+    state are no longer stepped and hold their values from then on.
+    Returns the number of recorded steps per profile and its final layer means.
+    """
+    D = np.asarray(D, dtype=np.float64)
+    P, Nx = D.shape
+    layers = M.layers
+    r = np.array(np.broadcast_to(dt / np.asarray(Dx, dtype=np.float64)**2, (P,)))
+    # Grid-major (Nx, profiles) arrays of the active profiles; the face
+    # diffusivities D_face[i] sit between grid points i and i + 1
+    active = np.arange(P)
+    C_active = np.array(np.asarray(C, dtype=np.float64).T)
+    D_face = (D[:, :-1] + D[:, 1:]).T / 2
+    averaging = M
+    flux = np.empty((Nx - 1, P))
+    iterations = np.full(P, Nt)
+    means = np.full((P, layers), np.nan)
+    for n in range(Nt):
+        np.subtract(C_active[1:], C_active[:-1], out=flux)
+        flux *= D_face
+        change = flux[1:] - flux[:-1]
+        change *= r
+        C_active[1:-1] += change
+        layer_means = averaging.apply(C_active)
+        if active.size == P:
+            means[:] = layer_means.T
+        else:
+            means[active] = layer_means.T
+        recorder.record(n, means.ravel())
+        done = layer_means.max(axis=0) - layer_means.min(axis=0) <= tol
+        if done.any():
+            iterations[active[done]] = n + 1
+            keep = ~done
+            if not keep.any():
+                break
+            active, C_active, D_face, r = active[keep], C_active[:, keep], D_face[:, keep], r[keep]
+            averaging.restrict(keep)
+            flux = flux[:, keep]
+    recorder.finish()
+    return iterations, means
+
+
+class BatchLayerOperator:
+    """
+    The layer averaging operators of a stack of profiles as one sparse matrix
+    acting on the grid-major (Nx, profiles) state, so the layer means of every
+    profile cost one sparse product proportional to the number of grid cells.
+    Built from the (profile, layer, cell, weight) entries of the operators;
+    restrict() drops the profiles that are no longer stepped.
+    """
+
+    def __init__(self, owner, rows, cols, weights, shape, Nx):
+        self.owner, self.rows, self.cols, self.weights = owner, rows, cols, weights
+        self.profiles, self.layers = shape
+        self.Nx = Nx
+        self._build()
+
+    def _build(self):
+        from scipy import sparse
+        P = self.profiles
+        self.matrix = sparse.csr_matrix(
+            (self.weights, (self.rows * P + self.owner, self.cols * P + self.owner)),
+            shape=(self.layers * P, self.Nx * P),
+        )
+
+    def apply(self, state):
+        """Layer means of a (Nx, profiles) state as a (layers, profiles) array."""
+        return (self.matrix @ state.ravel()).reshape(self.layers, self.profiles)
+
+    def restrict(self, keep):
+        """Keep only the profiles where the boolean mask keep is set."""
+        entries = keep[self.owner]
+        position = np.cumsum(keep) - 1
+        self.rows, self.cols, self.weights = self.rows[entries], self.cols[entries], self.weights[entries]
+        self.owner = position[self.owner[entries]]
+        self.profiles = int(keep.sum())
+        self._build()
+
+
+def run_adaptive(K, y0, tol, horizon, recorder, observe=None, offset=0, output_steps=None,
+                 method="BDF", rtol=1e-6, atol=None):
+    """
+    Integrate the linear system dy/dt = K @ y with an adaptive scipy solver,
+    t counted in model time steps, from 0 up to horizon. observe maps y to
+    the recorded layer values (identity if None). The state after every
+    accepted solver step is offered to recorder as step round(t) - offset,
+    keeping the one nearest to each step; with output_steps only those steps
+    are evaluated, from the solver's dense output. A terminal event stops the
+    run in the step where the spread of the layer values drops to tol, and
+    the state at that point is recorded last.
+    Returns (iterations, accepted solver steps, right-hand side evaluations),
+    iterations being the steady-state time rounded up, or horizon.
+    """
+    from scipy import integrate, optimize, sparse
+    if method not in ODE_METHODS:
+        raise ValueError(f"ode_method must be one of {', '.join(ODE_METHODS)}")
+    y0 = np.array(y0, dtype=np.float64)
+
+    def values(y):
+        return y if observe is None else observe @ y
+
+    def spread(y):
+        v = values(y)
+        return v.max() - v.min()
+
+    if spread(y0) <= tol or horizon <= 0:
+        recorder.record(0, values(y0))
+        recorder.finish()
+        return max(offset, 0), 0, 0
+
+    # The solution error has to stay well below tol for the spread to reach it
+    options = {"rtol": rtol, "atol": tol / 100 if atol is None else atol}
+    if method in ("Radau", "BDF"):
+        options["jac"] = K
+    elif method == "LSODA":
+        dense_K = K.toarray() if sparse.issparse(K) else K
+        options["jac"] = lambda t, y: dense_K
+    solver = getattr(integrate, method)(lambda t, y: K @ y, 0.0, y0, horizon, **options)
+    requested = None if output_steps is None else np.sort(np.asarray(output_steps, dtype=np.float64)) + offset
+    pending = None  # (step, distance to it, values) not yet recorded
+
+    def offer(t, y, final=False):
+        nonlocal pending
+        step = int(np.rint(t)) - offset
+        if step < 0:
+            return
+        distance = -1.0 if final else abs(t - np.rint(t))
+        if pending is not None and pending[0] != step:
+            recorder.record(pending[0], pending[2])
+            pending = None
+        if pending is None or distance < pending[1]:
+            pending = (step, distance, np.array(values(y)))
+
+    if requested is None:
+        offer(0.0, y0)
+    elif requested.size and requested[0] == 0:
+        recorder.record(0, values(y0))
+    steady, accepted = None, 0
+    while solver.status == "running":
+        t_old = solver.t
+        message = solver.step()
+        if solver.status == "failed":
+            raise ValueError(f"ODE solver failed: {message}")
+        accepted += 1
+        dense = None
+        end, y_end = solver.t, solver.y
+        if spread(y_end) <= tol:
+            # Locate the crossing inside the step from the dense output
+            dense = solver.dense_output()
+            end = optimize.brentq(lambda t: spread(dense(t)) - tol, t_old, solver.t)
+            y_end = dense(end)
+            steady = end
+        if requested is None:
+            offer(end, y_end, final=steady is not None)
+        else:
+            inside = requested[(requested > t_old) & (requested <= end)]
+            if inside.size:
+                dense = dense or solver.dense_output()
+                for t in inside:
+                    recorder.record(int(t) - offset, values(dense(t)))
+        if steady is not None:
+            break
+    if pending is not None:
+        recorder.record(pending[0], pending[2])
+    recorder.finish()
+    iterations = horizon if steady is None else max(int(np.ceil(steady - 1e-9)), offset)
+    return iterations, accepted, solver.nfev
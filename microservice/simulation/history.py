@@ -0,0 +1,226 @@
+"""
+Bounded recording of a simulation's layer concentrations over time, shared by
+every kernel: the sampling policies of a run request's "history" object, the
+HISTORY_MAX_SAMPLES default cap and the split of a stacked batch history.
+"""
+import os
+import numpy as np
+
+# Samples a run request keeps unless its "history" object sets max_samples
+HISTORY_MAX_SAMPLES = int(os.getenv("HISTORY_MAX_SAMPLES", 2000))
+POLICIES = ("all", "every", "log", "threshold", "final", "steps")
+
+
+class HistoryRecorder:
+    """
+    Keep a bounded sample of a simulation's layer concentrations over time.
+
+    Policies:
+        all        every step (the original behaviour)
+        every      every k-th step
+        log        about `points` log-spaced steps up to `horizon`
+        threshold  steps where some layer moved by more than `threshold`
+                   times the largest initial concentration since the last sample
+        final      the first and the last step only
+        steps      exactly the listed steps
+
+    The first and the last recorded step are always kept (except for "steps").
+    When max_samples is set and the buffer fills up, every other sample is
+    dropped, so memory stays bounded however many iterations a run takes; the
+    history never holds more than max_samples samples, the last step included.
+    The listed "steps" are never dropped, so max_samples must cover them all.
+    """
+
+    def __init__(self, n_layers, policy="all", every=1, points=200, threshold=0.01,
+                 steps=None, horizon=None, max_samples=None):
+        if policy not in POLICIES:
+            raise ValueError(f"history policy must be one of {', '.join(POLICIES)}")
+        if max_samples is not None and max_samples < 2:
+            raise ValueError("history max_samples must be at least 2")
+        self.policy = policy
+        self.every = 1 if policy == "all" else int(every)
+        if self.every < 1:
+            raise ValueError("history every must be a positive integer")
+        self.threshold = threshold
+        self.max_samples = max_samples
+        self.targets = None
+        if policy == "log":
+            if horizon is None:
+                raise ValueError("log-spaced history needs a horizon")
+            self.targets = np.unique(np.concatenate(
+                ([0], np.rint(np.geomspace(1, max(horizon, 1), points)).astype(np.int64))
+            ))
+        elif policy == "steps":
+            if steps is None:
+                raise ValueError("history policy 'steps' needs a list of steps")
+            self.targets = np.unique(np.asarray(steps, dtype=np.int64))
+            if max_samples is not None and max_samples < self.targets.size:
+                raise ValueError(f"history max_samples must be at least the {self.targets.size} listed steps")
+
+        # The buffer grows by doubling, up to max_samples
+        capacity = 64 if max_samples is None else min(max_samples, 64)
+        self._steps = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty((n_layers, capacity))
+        self._count = 0
+        self._scale = None
+        self._last_step = None
+
+    @property
+    def time_steps(self):
+        return self._steps[:self._count].tolist()
+
+    @property
+    def history(self):
+        """Recorded concentrations as a (layers, samples) array."""
+        return self._values[:, :self._count]
+
+    def _wanted(self, steps):
+        """Vectorised keep test for the index-based policies."""
+        if self.targets is not None:
+            return np.isin(steps, self.targets)
+        if self.policy == "final":
+            return np.zeros(np.shape(steps), dtype=bool)
+        return np.asarray(steps) % self.every == 0
+
+    def record(self, step, values):
+        """Offer the concentrations at one time step to the recorder."""
+        self._last_step = (step, values)
+        if self._count == 0 and self.policy != "steps":
+            self._scale = float(np.max(np.abs(values))) or 1.0
+            self._append(step, values)
+        elif self.policy == "threshold":
+            moved = np.max(np.abs(np.asarray(values) - self._values[:, self._count - 1]))
+            if moved > self.threshold * self._scale:
+                self._append(step, values)
+        elif self._wanted(step):
+            self._append(step, values)
+
+    def record_block(self, steps, values):
+        """Offer a (layers, len(steps)) block of consecutive time steps."""
+        start = 0
+        if self._count == 0 and self.policy != "steps":
+            self.record(int(steps[0]), values[:, 0])
+            start = 1
+        if self.policy == "threshold":
+            candidates = range(start, len(steps))
+        else:
+            candidates = np.flatnonzero(self._wanted(steps[start:])) + start
+        for j in candidates:
+            # Re-checked by record() in case the buffer was thinned meanwhile
+            self.record(int(steps[j]), values[:, j])
+        self._last_step = (int(steps[-1]), values[:, -1])
+
+    def finish(self):
+        """Make sure the last offered step is part of the recorded history."""
+        if self.policy == "steps" or self._last_step is None:
+            return
+        step, values = self._last_step
+        if self._count == 0 or self._steps[self._count - 1] != step:
+            self._append(step, values, final=True)
+
+    def _append(self, step, values, final=False):
+        if self._count == self._steps.size:
+            if self.max_samples is None or self._count < self.max_samples:
+                grow = self._count if self.max_samples is None else min(self._count, self.max_samples - self._count)
+                self._steps = np.concatenate((self._steps, np.empty(grow, dtype=np.int64)))
+                self._values = np.concatenate((self._values, np.empty((self._values.shape[0], grow))), axis=1)
+            elif final:
+                # The last step takes the place of the latest intermediate sample
+                self._count -= 1
+            else:
+                self._thin()
+        self._steps[self._count] = step
+        self._values[:, self._count] = values
+        self._count += 1
+
+    def _thin(self):
+        """Drop every other sample and double the stride of the 'every' and 'log' policies."""
+        keep = (self._count + 1) // 2
+        self._steps[:keep] = self._steps[:self._count:2]
+        self._values[:, :keep] = self._values[:, :self._count:2]
+        self._count = keep
+        self.every *= 2
+        if self.policy == "log":
+            self.targets = self.targets[::2]
+
+
+class ProgressRecorder:
+    """
+    Wrap a HistoryRecorder and also hand every `every`-th offered step, and the
+    last one, to callback(step, values) as it happens, e.g. to stream a run
+    while it is still going. values may be reused by the caller afterwards.
+    """
+
+    def __init__(self, recorder, callback, every=1):
+        if int(every) < 1:
+            raise ValueError("stream_every must be a positive integer")
+        self.recorder = recorder
+        self.callback = callback
+        self.every = int(every)
+        self._last_step = None
+        self._last_sent = None
+
+    def __getattr__(self, name):
+        return getattr(self.recorder, name)
+
+    def _send(self, step, values):
+        self.callback(step, values)
+        self._last_sent = step
+
+    def record(self, step, values):
+        if step % self.every == 0:
+            self._send(step, values)
+        self._last_step = (step, values)
+        self.recorder.record(step, values)
+
+    def record_block(self, steps, values):
+        for j in np.flatnonzero(np.asarray(steps) % self.every == 0):
+            self._send(int(steps[j]), values[:, j])
+        self._last_step = (int(steps[-1]), values[:, -1])
+        self.recorder.record_block(steps, values)
+
+    def finish(self):
+        if self._last_step is not None and self._last_step[0] != self._last_sent:
+            self._send(*self._last_step)
+        self.recorder.finish()
+
+
+def recorder_from_request(spec, n_layers, horizon):
+    """
+    Build a HistoryRecorder from the optional "history" object of a run request,
+    e.g. {"policy": "log", "points": 200, "max_samples": 1000}. max_samples
+    defaults to HISTORY_MAX_SAMPLES, so a request without one still keeps a
+    bounded history however many iterations it runs; "steps" keeps its list.
+    """
+    spec = dict(spec or {})
+    policy = spec.pop("policy", "all")
+    allowed = {"every", "points", "threshold", "steps", "max_samples"}
+    unknown = set(spec) - allowed
+    if unknown:
+        raise ValueError(f"Unknown history options: {', '.join(sorted(unknown))}")
+    if policy != "steps" and spec.get("max_samples") is None:
+        spec["max_samples"] = HISTORY_MAX_SAMPLES
+    try:
+        return HistoryRecorder(n_layers, policy=policy, horizon=horizon, **spec)
+    except TypeError as e:
+        raise ValueError(f"Invalid history options: {e}")
+
+
+def split_history(recorder, layers, last_steps, final_values):
+    """
+    Cut the history of a batch recorder, fed the flattened (profiles * layers)
+    state, into one (time_steps, history) pair per profile. Each profile keeps
+    the samples up to its own last step and ends with its final values.
+    """
+    steps = np.asarray(recorder.time_steps)
+    history = recorder.history
+    results = []
+    for p, last in enumerate(last_steps):
+        keep = steps <= last
+        time_steps = steps[keep].tolist()
+        values = history[p * layers:(p + 1) * layers, keep]
+        if recorder.policy != "steps" and (not time_steps or time_steps[-1] != last):
+            time_steps.append(int(last))
+            values = np.column_stack((values, final_values[p]))
+        results.append((time_steps, values))
+    return results
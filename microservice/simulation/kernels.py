@@ -0,0 +1,294 @@
+"""
+Simulation kernels for both models. They take only compact layer parameters
+and return the recorded history as arrays, so they can run in a worker
+process without Flask or Mongo (see model/process_pool.py).
+"""
+import numpy as np
+from .engine import (
+    model_1_step_operator, model_1_step_operators, run_linear, run_linear_batch,
+    model_2_grid, model_2_layer_operator, model_2_batch_layer_operator, model_2_step_operator,
+    run_model_2, run_model_2_batch,
+    eigendecompose, spectral_observe, spectral_first_equal, spectral_record,
+    model_1_generator, model_2_stencil, model_2_stable_dt, run_adaptive,
+)
+from .history import recorder_from_request, split_history, ProgressRecorder
+from .sweep import expand_sweep
+
+# Fast-forward mode eigendecomposes a dense (Nx, Nx) step operator
+FAST_FORWARD_GRID_POINTS = 2000
+
+
+# Model 1 implementation
+def bioturbation(soil_layers, dt):
+    """
+    Perform bioturbation for the soil layers for the given time step.
+    Modifies the concentrations of the layers in-place.
+    """
+    for l, layer in enumerate(soil_layers):
+        fraction_of_layer_to_mix = layer["bioturbation_rate"] * dt
+        if l < len(soil_layers) - 1:  # Skip the last layer
+            delta = fraction_of_layer_to_mix * (soil_layers[l + 1]["conc"] - layer["conc"])
+            layer["conc"] += delta
+            soil_layers[l + 1]["conc"] -= delta
+
+
+def equal(lst, tol=1e-10):
+    """
+    Check if the concentrations in the list are equal within the specified tolerance.
+    """
+    return abs(max(lst) - min(lst)) < tol
+
+
+def model_1_kernel(params, progress=None):
+    """
+    Run Model 1 for one profile. params holds the layer "conc" and "rates" lists,
+    "dt", "tol", "max_iter", "engine", "mode", "history" and "output_steps",
+    plus "ode_method", "rtol" and "atol" in adaptive mode. Returns
+    {"time_steps", "history", "iterations"}, and the accepted "solver_steps"
+    and "evaluations" in adaptive mode; raises ValueError for a bad request.
+    progress(step, values) is called for every "stream_every"-th step while
+    the run goes on.
+    """
+    conc, rates = params["conc"], params["rates"]
+    dt, tol, max_iter = params["dt"], params["tol"], params["max_iter"]
+    engine, mode, output_steps = params["engine"], params["mode"], params["output_steps"]
+
+    history_spec = params["history"]
+    if mode in ("fast-forward", "adaptive") and output_steps is not None:
+        history_spec = {"policy": "steps", "steps": output_steps}
+    recorder = recorder_from_request(history_spec, len(conc), max_iter + 1)
+    if progress is not None:
+        recorder = ProgressRecorder(recorder, progress, params.get("stream_every", 1))
+
+    if mode == "adaptive":
+        t, steps, evaluations = run_adaptive(
+            model_1_generator(rates, dt), conc, tol, max_iter + 1, recorder,
+            output_steps=output_steps, **ode_options(params),
+        )
+        return {"time_steps": recorder.time_steps, "history": recorder.history, "iterations": t,
+                "solver_steps": steps, "evaluations": evaluations}
+
+    decomposition = None
+    if mode == "fast-forward":
+        decomposition = eigendecompose(model_1_step_operator(rates, dt))
+        if decomposition is None:
+            # Operator is close to defective, step it with the matrix engine instead
+            engine = "matrix"
+    if decomposition is not None:
+        # Predict the steady-state iteration and evaluate the sampled steps directly
+        t = spectral_first_equal(decomposition, conc, tol, 0, max_iter + 1)
+        if t is None:
+            t = max_iter + 1
+        if output_steps is not None:
+            history = spectral_observe(decomposition, conc, output_steps)
+            stream_steps(progress, output_steps, history)
+            return {"time_steps": list(output_steps), "history": history, "iterations": t}
+        spectral_record(decomposition, conc, 0, t, recorder)
+    elif engine == "matrix":
+        # Build the step operator once and advance a float64 state array
+        t = run_linear(model_1_step_operator(rates, dt), conc, tol, max_iter, recorder)
+    else:
+        soil_layers = [{"conc": c, "bioturbation_rate": r} for c, r in zip(conc, rates)]
+        data_t = [layer["conc"] for layer in soil_layers]
+        recorder.record(0, data_t)
+        t = 0
+        # Perform bioturbation until concentrations are equal
+        while t < max_iter + 1 and not equal(data_t, tol=tol):
+            bioturbation(soil_layers, dt)
+            data_t = [layer["conc"] for layer in soil_layers]
+            t += 1
+            recorder.record(t, data_t)
+        recorder.finish()
+    return {"time_steps": recorder.time_steps, "history": recorder.history, "iterations": t}
+
+
+def ode_options(params):
+    """Adaptive solver settings of a kernel's params."""
+    return {"method": params.get("ode_method", "BDF"), "rtol": params.get("rtol", 1e-6),
+            "atol": params.get("atol")}
+
+
+def stream_steps(progress, steps, history):
+    """Hand precomputed (layers, len(steps)) output steps to progress, if given."""
+    if progress is not None:
+        for j, step in enumerate(steps):
+            progress(step, history[:, j])
+
+
+def model_1_batch_kernel(params):
+    """
+    Run Model 1 for a group of profiles with the same layer count. params holds
+    (profiles, layers) "conc" and "rates" arrays, "dt", "tol", "max_iter" and
+    "history". Returns {"histories": [(time_steps, history)], "iterations"}.
+    """
+    conc = np.asarray(params["conc"], dtype=np.float64)
+    P, n = conc.shape
+    max_iter = params["max_iter"]
+    recorder = recorder_from_request(params["history"], P * n, max_iter + 1)
+    A = model_1_step_operators(params["rates"], params["dt"])
+    iterations, final = run_linear_batch(A, conc, params["tol"], max_iter, recorder)
+    return {"histories": split_history(recorder, n, iterations, final),
+            "iterations": iterations.tolist()}
+
+
+def model_1_sweep_kernel(params):
+    """
+    Run every point of a parameter sweep over a base profile as one stacked
+    Model 1 computation. params holds the processed base "layers", the swept
+    "parameters", "dt", "tol", "max_iter", an optional "history" spec and
+    an optional "chunk" of the points to run. Returns the sweep summaries,
+    see sweep_summary().
+    """
+    points, fields, dt = expand_sweep(params["layers"], params["parameters"], params["dt"], params.get("chunk"))
+    P, n = fields["depth"].shape
+    if P == 0:
+        return empty_sweep_summary(points, n)
+    conc = np.tile([layer["conc"] for layer in params["layers"]], (P, 1))
+    rates = fields["earthworm_density"] * fields["beta"] / fields["depth"]
+    max_iter = params["max_iter"]
+    recorder = recorder_from_request(params["history"] or {"policy": "final"}, P * n, max_iter + 1)
+    A = model_1_step_operators(rates, dt[:, None])
+    iterations, final = run_linear_batch(A, conc, params["tol"], max_iter, recorder)
+    # Steady state as the run loop tests it: a point that got there on the
+    # last allowed step (max_iter + 1) converged as well
+    converged = np.abs(final.max(axis=1) - final.min(axis=1)) < params["tol"]
+    return sweep_summary(points, iterations, converged, final, recorder, params["history"])
+
+
+def sweep_summary(points, iterations, converged, final, recorder, history_spec):
+    """
+    Per-point results of a sweep: the swept parameter values, iterations to
+    steady state, whether it was reached, the final layer concentrations and,
+    if a history spec was given, the shared (time_steps, (points, layers,
+    samples)) history. Samples past a point's own iteration are kept as is.
+    """
+    P, n = final.shape
+    history = None
+    if history_spec:
+        history = (recorder.time_steps, recorder.history.reshape(P, n, -1))
+    return {
+        "points": {name: values.tolist() for name, values in points.items()},
+        "iterations": iterations.tolist(),
+        "converged": converged.tolist(),
+        "final": final,
+        "history": history,
+    }
+
+
+def empty_sweep_summary(points, layers):
+    """Summary of a sweep chunk without points, nothing is run or recorded."""
+    return sweep_summary(points, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool),
+                         np.empty((0, layers)), None, None)
+
+
+# Model 2 implementation
+def model_2_kernel(params, progress=None):
+    """
+    Run Model 2 for one profile. params holds the layer "depths", "conc" and
+    "diffusion_coeffs" lists, "dt" (days), "tol", "max_iter", "Nx", "mode",
+    "solver", "history" and "output_steps", plus "ode_method", "rtol" and "atol"
+    in adaptive mode. Returns {"time_steps", "history", "iterations"} where
+    iterations is the number of steps taken, and the accepted "solver_steps"
+    and "evaluations" in adaptive mode. progress(step, values) is called for
+    every "stream_every"-th step while the run goes on.
+    """
+    depths = params["depths"]
+    dt, tol, Nx, Nt = params["dt"], params["tol"], params["Nx"], params["max_iter"]
+    mode, output_steps = params["mode"], params["output_steps"]
+    solver = params.get("solver", "explicit")
+
+    # Assign initial concentrations and spatially varying diffusion coefficients to grid
+    C, Dx = model_2_grid(depths, params["conc"], Nx)
+    D, _ = model_2_grid(depths, params["diffusion_coeffs"], Nx)
+
+    history_spec = params["history"]
+    if mode in ("fast-forward", "adaptive") and output_steps is not None:
+        history_spec = {"policy": "steps", "steps": output_steps}
+    recorder = recorder_from_request(history_spec, len(depths), Nt)
+    if progress is not None:
+        recorder = ProgressRecorder(recorder, progress, params.get("stream_every", 1))
+
+    if mode == "adaptive":
+        # History column n holds the layer means at time n + 1
+        iterations, steps, evaluations = run_adaptive(
+            model_2_stencil(D) * (dt / Dx**2), C, tol, Nt, recorder, observe=model_2_layer_operator(depths, Nx),
+            offset=1, output_steps=output_steps, **ode_options(params),
+        )
+        if iterations < Nt:
+            print(f"Steady state reached at iteration: {iterations}")
+        return {"time_steps": recorder.time_steps, "history": recorder.history, "iterations": iterations,
+                "solver_steps": steps, "evaluations": evaluations}
+
+    decomposition = None
+    if mode == "fast-forward":
+        if Nx > FAST_FORWARD_GRID_POINTS:
+            raise ValueError(f"fast-forward mode supports at most {FAST_FORWARD_GRID_POINTS} grid points")
+        B = model_2_step_operator(D, dt, Dx, solver)
+        M = model_2_layer_operator(depths, Nx)
+        decomposition = eigendecompose(B)
+    if decomposition is not None:
+        # History column n holds the layer means after n + 1 steps
+        n = spectral_first_equal(decomposition, C, tol, 1, Nt, observe=M, inclusive=True)
+        iterations = Nt if n is None else n
+        if n is not None:
+            print(f"Steady state reached at iteration: {n}")
+        if output_steps is not None:
+            history = spectral_observe(decomposition, C, np.asarray(output_steps) + 1, observe=M)
+            stream_steps(progress, output_steps, history)
+            return {"time_steps": list(output_steps), "history": history, "iterations": iterations}
+        spectral_record(decomposition, C, 0, iterations - 1, recorder, observe=M, offset=1)
+        return {"time_steps": recorder.time_steps, "history": recorder.history, "iterations": iterations}
+
+    # Perform simulation
+    n = run_model_2(C, D, model_2_layer_operator(depths, Nx), dt, Dx, tol, Nt, recorder, solver)
+    iterations = Nt if n is None else n
+    if n is not None:
+        print(f"Steady state reached at iteration: {n}")
+    return {"time_steps": recorder.time_steps, "history": recorder.history, "iterations": iterations}
+
+
+def model_2_batch_kernel(params):
+    """
+    Run Model 2 for a group of profiles with the same layer count and grid
+    size. params holds per-profile "depths", "conc" and "diffusion_coeffs"
+    lists, "dt" (days), "tol", "max_iter", "Nx" and "history". Returns {"histories": [(time_steps, history)],
+    "iterations"}.
+    """
+    Nx, Nt = params["Nx"], params["max_iter"]
+    depths = np.asarray(params["depths"], dtype=np.float64)
+    C, Dx = model_2_grid(depths, params["conc"], Nx)
+    D, _ = model_2_grid(depths, params["diffusion_coeffs"], Nx)
+    M = model_2_batch_layer_operator(depths, Nx)
+    n = depths.shape[1]
+    recorder = recorder_from_request(params["history"], len(C) * n, Nt)
+    iterations, final = run_model_2_batch(C, D, M, params["dt"], Dx, params["tol"], Nt, recorder)
+    return {"histories": split_history(recorder, n, iterations - 1, final),
+            "iterations": iterations.tolist()}
+
+
+def model_2_sweep_kernel(params):
+    """
+    Run every point of a parameter sweep over a base profile as one stacked
+    Model 2 computation. params holds the processed base "layers", the swept
+    "parameters", "dt" (seconds, like the run requests), "h", "tol",
+    "max_iter", "Nx", an optional "history" spec and an optional "chunk" of
+    the points to run. Returns the sweep summaries, see sweep_summary().
+    """
+    points, fields, dt = expand_sweep(params["layers"], params["parameters"], params["dt"], params.get("chunk"))
+    P, n = fields["depth"].shape
+    if P == 0:
+        return empty_sweep_summary(points, n)
+    Nx, Nt = params["Nx"], params["max_iter"]
+    coeffs = fields["earthworm_density"] * fields["beta"] * params["h"]
+    conc = [layer["conc"] for layer in params["layers"]]
+    C, Dx = model_2_grid(fields["depth"], conc, Nx)
+    D, _ = model_2_grid(fields["depth"], coeffs, Nx)
+    unstable = np.flatnonzero(dt / 86400 > model_2_stable_dt(D, Dx) * (1 + 1e-9))
+    if unstable.size:
+        raise ValueError(f"The explicit solver is unstable for {unstable.size} of the {P} sweep points "
+                         f"(the first at dt = {dt[unstable[0]]:g} s): use a smaller dt or fewer grid points")
+    M = model_2_batch_layer_operator(fields["depth"], Nx)
+    recorder = recorder_from_request(params["history"] or {"policy": "final"}, P * n, Nt)
+    iterations, final = run_model_2_batch(C, D, M, dt / 86400, Dx, params["tol"], Nt, recorder)
+    converged = final.max(axis=1) - final.min(axis=1) <= params["tol"]
+    return sweep_summary(points, iterations, converged, final, recorder, params["history"])
@@ -0,0 +1,43 @@
+"""
+Plots of a simulation history. pandas and plotly are imported on first use,
+so the rest of the package and the services start without them.
+"""
+import io
+import numpy as np
+
+
+def as_df(conc, layer_ids, time_steps):
+    """Convert a (layers, time steps) concentration array to a DataFrame."""
+    import pandas as pd
+    df = pd.DataFrame(
+        np.asarray(conc).T,
+        columns=[f'soil_layer_{layer_id}' for layer_id in layer_ids]
+    )
+    df['time'] = time_steps
+    return df
+
+
+def create_plot(data):
+    """Line plot of the concentration of every layer over time from an as_df frame."""
+    import plotly.express as px
+    fig = px.line(
+        data.melt(id_vars='time', var_name='Layer', value_name='Concentration'),
+        x='time',
+        y='Concentration',
+        color='Layer',
+        labels={'time': 'Time Steps', 'Concentration': 'Concentration'}
+    )
+    return fig
+
+
+def history_plot(time_steps, layer_ids, conc):
+    """Plot a (time_steps, layer_ids, conc) history."""
+    return create_plot(as_df(conc, layer_ids, time_steps))
+
+
+def png_buffer(fig):
+    """Render a figure as PNG into a rewound BytesIO buffer."""
+    buffer = io.BytesIO()
+    fig.write_image(buffer, format='png')
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,251 @@
+"""
+Profile configs and run requests of both models turned into kernel
+parameters, shared by the model services and the command line runner.
+"""
+import math
+import os
+from .engine import MODEL_2_SOLVERS, model_2_grid, model_2_grid_size, model_2_stable_dt
+
+MAX_GRID_POINTS = int(os.getenv("MAX_GRID_POINTS", 100000))
+MODES = ("step", "fast-forward", "adaptive")
+
+
+def process_layers(data, create_layer):
+    """
+    Number and validate the layers of a profile config with create_layer.
+    Returns (processed layers, None) or (None, error dict).
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('layers'), list):
+        return None, {"error": "Missing layers"}
+    layers = []
+    for i, layer_data in enumerate(data['layers'], start=1):
+        if not isinstance(layer_data, dict):
+            return None, {"error": "Each layer must be an object"}
+        # Add ID for soil layer
+        layer_data['id'] = i
+        try:
+            processed_layer = create_layer(layer_data)
+        except TypeError:
+            return None, {"error": "Layer values must be numbers"}
+        if "error" in processed_layer:
+            return None, processed_layer
+        layers.append(processed_layer)
+    return layers, None
+
+
+# Model 1 profiles
+def process_model_1_layers(data):
+    """Number and validate the layers of a Model 1 profile config."""
+    return process_layers(data, create_model_1_layer)
+
+
+def create_model_1_layer(layer_data):
+    required_fields = ['id', 'depth', 'initial_conc', 'earthworm_density', 'beta']
+    if not all(field in layer_data for field in required_fields):
+        return {"error": "Missing required fields"}
+    try:
+        bioturbation_rate = (layer_data['earthworm_density'] * layer_data['beta']) / layer_data['depth']
+    except ZeroDivisionError:
+        return {"error": "Depth cannot be zero"}
+    # Return the processed layer data
+    return {
+        "id": layer_data['id'],
+        "depth": layer_data['depth'],
+        "conc": layer_data['initial_conc'],
+        "earthworm_density": layer_data['earthworm_density'],
+        "beta": layer_data['beta'],
+        "bioturbation_rate": bioturbation_rate
+    }
+
+
+def model_1_run_params(layers, data):
+    """
+    Kernel parameters of a Model 1 run request over processed layers.
+    Raises ValueError for bad run options.
+    """
+    engine = data.get("engine", "loop")
+    if engine not in ("loop", "matrix"):
+        raise ValueError("engine must be 'loop' or 'matrix'")
+    mode = run_mode(data)
+    params = {
+        "conc": [layer["conc"] for layer in layers],
+        "rates": [layer["bioturbation_rate"] for layer in layers],
+        "dt": data.get("dt", 86400), "tol": data.get("steady_state_tol", 1e-10),
+        "max_iter": data.get("max_iter", 10000), "engine": engine, "mode": mode,
+        "history": data.get("history"), "output_steps": data.get("output_steps"),
+    }
+    if mode == "adaptive":
+        params.update(ode_options(data))
+    return params
+
+
+def model_1_batch_key(layers, data):
+    """Profiles of a Model 1 batch are stacked by layer count."""
+    return len(layers)
+
+
+def model_1_batch_params(profiles, data):
+    """
+    Kernel parameters of a Model 1 batch run over the processed layers of
+    profiles sharing a layer count. Raises ValueError for unsupported options.
+    """
+    batch_mode(data)
+    return {
+        "conc": [[layer["conc"] for layer in layers] for layers in profiles],
+        "rates": [[layer["bioturbation_rate"] for layer in layers] for layers in profiles],
+        "dt": data.get("dt", 86400), "tol": data.get("steady_state_tol", 1e-10),
+        "max_iter": data.get("max_iter", 10000), "history": data.get("history"),
+    }
+
+
+def model_1_sweep_params(profile, data):
+    """Kernel parameters of a Model 1 sweep request over a profile with processed layers."""
+    return {
+        "layers": profile["layers"], "parameters": data.get("parameters"),
+        "dt": data.get("dt", 86400), "tol": data.get("steady_state_tol", 1e-10),
+        "max_iter": data.get("max_iter", 10000), "history": data.get("history"),
+    }
+
+
+# Model 2 profiles
+def process_model_2_layers(data):
+    """Number and validate the layers of a Model 2 profile config using its h (default 0.2)."""
+    h = data.get('h', 0.2) if isinstance(data, dict) else 0.2
+    return process_layers(data, lambda layer_data: create_model_2_layer(layer_data, h))
+
+
+def create_model_2_layer(layer_data, h=0.2):
+    required_fields = ['id', 'depth', 'initial_conc', 'earthworm_density', 'beta']
+    if not all(field in layer_data for field in required_fields):
+        return {"error": "Missing required fields"}
+
+    diffusion_coefficient = (layer_data['earthworm_density'] * layer_data['beta']) * h
+
+    # Return the processed layer data
+    return {
+        "id": layer_data['id'],
+        "depth": layer_data['depth'],
+        "conc": layer_data['initial_conc'],
+        "earthworm_density": layer_data['earthworm_density'],
+        "beta": layer_data['beta'],
+        "diffusion_coefficient": diffusion_coefficient,
+    }
+
+
+def grid_points(data, layers):
+    """
+    Number of spatial grid cells of a Model 2 request: "Nx" (default 10) or
+    the cells needed for a target spacing "dx" over the profile depth.
+    Raises ValueError for a bad or too large grid.
+    """
+    Nx = model_2_grid_size(sum(layer['depth'] for layer in layers), data.get("Nx"), data.get("dx"))
+    if Nx > MAX_GRID_POINTS:
+        raise ValueError(f"Grid has {Nx} points, at most {MAX_GRID_POINTS} are allowed")
+    return Nx
+
+
+def check_explicit_stability(layers, dt, Nx):
+    """
+    Raise ValueError if explicit Model 2 steps of dt days on the Nx-cell grid
+    of the processed layers would blow up, naming the largest stable dt.
+    """
+    D, Dx = model_2_grid([layer['depth'] for layer in layers],
+                         [layer['diffusion_coefficient'] for layer in layers], Nx)
+    limit = float(model_2_stable_dt(D, Dx))
+    if dt > limit * (1 + 1e-9):
+        raise ValueError(
+            f"The explicit solver is unstable for dt = {dt * 86400:g} s with Nx = {Nx}: use dt <= "
+            f"{round_down(limit * 86400):g} s, fewer grid points or an implicit solver"
+        )
+
+
+def round_down(value, digits=5):
+    """value rounded down to digits significant digits."""
+    scale = 10 ** (math.floor(math.log10(value)) - digits + 1)
+    return math.floor(value / scale) * scale
+
+
+def model_2_run_params(layers, data):
+    """
+    Kernel parameters of a Model 2 run request over processed layers; dt is
+    given in seconds and converted to days. Raises ValueError for bad run options.
+    """
+    mode = run_mode(data)
+    solver = data.get("solver", "explicit")
+    if solver not in MODEL_2_SOLVERS:
+        raise ValueError(f"solver must be one of {', '.join(MODEL_2_SOLVERS)}")
+    params = {
+        "depths": [layer['depth'] for layer in layers],
+        "conc": [layer['conc'] for layer in layers],
+        "diffusion_coeffs": [layer['diffusion_coefficient'] for layer in layers],
+        "dt": data.get("dt", 86400) / 86400, "tol": data.get("steady_state_tol", 1e-12),
+        "max_iter": data.get("max_iter", 10000), "Nx": grid_points(data, layers),
+        "mode": mode, "solver": solver, "history": data.get("history"),
+        "output_steps": data.get("output_steps"),
+    }
+    if mode == "adaptive":
+        params.update(ode_options(data))
+    elif solver == "explicit":
+        check_explicit_stability(layers, params["dt"], params["Nx"])
+    return params
+
+
+def model_2_batch_key(layers, data):
+    """
+    Profiles of a Model 2 batch are stacked by layer count and grid size.
+    Raises ValueError for a bad grid or one the explicit steps are unstable on.
+    """
+    Nx = grid_points(data, layers)
+    check_explicit_stability(layers, data.get("dt", 86400) / 86400, Nx)
+    return len(layers), Nx
+
+
+def model_2_batch_params(profiles, data):
+    """
+    Kernel parameters of a Model 2 batch run over the processed layers of
+    profiles sharing a layer count and grid size; dt is given in seconds and
+    converted to days. Raises ValueError for unsupported options.
+    """
+    batch_mode(data)
+    if data.get("solver", "explicit") != "explicit":
+        raise ValueError("Batch runs only support the explicit solver")
+    return {
+        "depths": [[layer['depth'] for layer in layers] for layers in profiles],
+        "conc": [[layer['conc'] for layer in layers] for layers in profiles],
+        "diffusion_coeffs": [[layer['diffusion_coefficient'] for layer in layers] for layers in profiles],
+        "dt": data.get("dt", 86400) / 86400, "tol": data.get("steady_state_tol", 1e-12),
+        "max_iter": data.get("max_iter", 10000), "Nx": grid_points(data, profiles[0]),
+        "history": data.get("history"),
+    }
+
+
+def model_2_sweep_params(profile, data):
+    """
+    Kernel parameters of a Model 2 sweep request over a profile with processed
+    layers and its h (default 0.2); dt stays in seconds. Raises ValueError.
+    """
+    return {
+        "layers": profile["layers"], "parameters": data.get("parameters"), "h": profile.get("h", 0.2),
+        "dt": data.get("dt", 86400), "tol": data.get("steady_state_tol", 1e-12),
+        "max_iter": data.get("max_iter", 10000), "Nx": grid_points(data, profile["layers"]),
+        "history": data.get("history"),
+    }
+
+
+def run_mode(data):
+    mode = data.get("mode", "step")
+    if mode not in MODES:
+        raise ValueError("mode must be 'step', 'fast-forward' or 'adaptive'")
+    return mode
+
+
+def batch_mode(data):
+    """Batch runs step every profile, other modes are rejected with ValueError."""
+    if run_mode(data) != "step":
+        raise ValueError("Batch runs only support mode 'step'")
+
+
+def ode_options(data):
+    """Adaptive solver options of a run request."""
+    return {"ode_method": data.get("ode_method", "BDF"), "rtol": data.get("rtol", 1e-6),
+            "atol": data.get("atol")}
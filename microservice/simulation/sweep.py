@@ -0,0 +1,129 @@
+"""
+Parameter sweeps over a base profile: the swept values of a request expanded
+into per-point layer fields, the split of the points into chunks for the
+worker processes and the merge of the chunk summaries.
+"""
+import os
+import numpy as np
+
+LAYER_PARAMETERS = ("earthworm_density", "beta", "depth")
+RUN_PARAMETERS = ("dt",)
+MAX_SWEEP_POINTS = int(os.getenv("MAX_SWEEP_POINTS", 100000))
+
+
+def sweep_values(name, spec):
+    """
+    Values of one swept parameter. spec is a list of numbers, or an object with
+    "values", or with "start", "stop" and "num" (plus "scale": "log" for
+    log-spaced values). Returns (values, layer ids or None for every layer).
+    """
+    layers = None
+    if isinstance(spec, dict):
+        layers = spec.get("layers")
+        if "values" in spec:
+            values = spec["values"]
+        elif all(k in spec for k in ("start", "stop", "num")):
+            space = np.geomspace if spec.get("scale") == "log" else np.linspace
+            try:
+                values = space(spec["start"], spec["stop"], int(spec["num"]))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid range for {name}: {e}")
+        else:
+            raise ValueError(f"{name} needs a list of values or start, stop and num")
+    else:
+        values = spec
+    try:
+        values = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"Values of {name} must be numbers")
+    if values.ndim != 1 or values.size == 0:
+        raise ValueError(f"{name} needs at least one value")
+    if not np.all(np.isfinite(values)):
+        raise ValueError(f"Values of {name} must be finite")
+    return values, layers
+
+
+def sweep_size(parameters):
+    """Number of points of a sweep: the product of the value counts of its parameters."""
+    if not isinstance(parameters, dict) or not parameters:
+        raise ValueError("parameters must map parameter names to ranges")
+    return int(np.prod([sweep_values(name, spec)[0].size for name, spec in parameters.items()]))
+
+
+def sweep_chunks(parameters, processes):
+    """Chunks to split a sweep into: one per worker process, but never more than its points."""
+    return max(min(processes, sweep_size(parameters)), 1)
+
+
+def expand_sweep(base_layers, parameters, dt, chunk=None):
+    """
+    Expand the Cartesian product of the swept parameters over a base profile.
+    base_layers are the processed layers of the profile, parameters maps a
+    parameter name to its sweep_values spec and dt is the run's default dt.
+    Returns (points, fields, dt): points maps each swept parameter to its
+    value per point, fields maps every layer parameter to a (points, layers)
+    array and dt holds the time step of each point. With chunk = (k, K) only
+    the k-th of K nearly equal, consecutive pieces of the points is returned,
+    which is empty when K exceeds the number of points.
+    """
+    if not isinstance(parameters, dict) or not parameters:
+        raise ValueError("parameters must map parameter names to ranges")
+    unknown = set(parameters) - set(LAYER_PARAMETERS + RUN_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    names = sorted(parameters)
+    axes, targets = [], []
+    for name in names:
+        values, layers = sweep_values(name, parameters[name])
+        axes.append(values)
+        targets.append(layers)
+    P = int(np.prod([axis.size for axis in axes]))
+    if P > MAX_SWEEP_POINTS:
+        raise ValueError(f"Sweep has {P} points, at most {MAX_SWEEP_POINTS} are allowed")
+
+    # Parameter values of every point, the last parameter varying fastest
+    grids = np.meshgrid(*axes, indexing="ij")
+    points = {name: grid.ravel() for name, grid in zip(names, grids)}
+
+    n = len(base_layers)
+    fields = {
+        field: np.tile(np.array([layer[field] for layer in base_layers], dtype=np.float64), (P, 1))
+        for field in LAYER_PARAMETERS
+    }
+    for name, layers in zip(names, targets):
+        if name in RUN_PARAMETERS:
+            continue
+        columns = slice(None)
+        if layers is not None:
+            columns = np.asarray(layers, dtype=np.int64) - 1
+            if columns.size == 0 or columns.min() < 0 or columns.max() >= n:
+                raise ValueError(f"Layers of {name} must be layer IDs between 1 and {n}")
+        fields[name][:, columns] = points[name][:, None]
+    if np.any(fields["depth"] <= 0):
+        raise ValueError("Depth must be positive")
+
+    dt = points["dt"] if "dt" in points else np.full(P, float(dt))
+    if chunk is not None:
+        k, K = chunk
+        select = np.array_split(np.arange(P), K)[k]
+        points = {name: values[select] for name, values in points.items()}
+        fields = {field: values[select] for field, values in fields.items()}
+        dt = dt[select]
+    return points, fields, dt
+
+
+def merge_sweep_summaries(parts):
+    """Concatenate the summaries of the chunks of a sweep, in chunk order."""
+    if len(parts) == 1:
+        return parts[0]
+    return {
+        "points": {
+            name: [value for part in parts for value in part["points"][name]]
+            for name in parts[0]["points"]
+        },
+        "iterations": [value for part in parts for value in part["iterations"]],
+        "converged": [value for part in parts for value in part["converged"]],
+        "final": np.concatenate([part["final"] for part in parts]),
+        "history": None,
+    }
@@ -12,6 +12,16 @@ PORT_SERVICE_MAP = {
 }
 
 DEFAULT_OUT = "msa_metrics.csv"  
+CSV_HEADER = [
+    "timestamp",
+    "cpu_total_percent",
+    "mem_total_percent",
+    "port",
+    "service",
+    "pid",
+    "proc_cpu_percent",
+    "proc_mem_mb"
+]
 
 def find_pids_by_port(port):
     """Find PIDs listening on a given port (macOS-safe, no sudo needed)."""
@@ -50,6 +60,208 @@ def find_processes_by_pid_or_children(root_pids):
     return list(seen.values())
 
 
+def service_for_port(port):
+    for service, ports in PORT_SERVICE_MAP.items():
+        if port in ports:
+            return service
+    return f"port{port}"
+
+
+def parse_pid_port_map(text):
+    """Parse --pid-port-map "5001:1234,5003:5678" (several PIDs per port as 5001:1234:1235) into {port: [pids]}."""
+    mapping = {}
+    for pair in text.split(','):
+        parts = pair.split(':')
+        port = int(parts[0])
+        # Handle multiple PIDs - split by both : and newlines
+        pid_str = ':'.join(parts[1:])
+        pids = [int(p.strip()) for p in pid_str.replace('\n', ':').split(':') if p.strip()]
+        mapping.setdefault(port, []).extend(pids)
+    return mapping
+
+
+def open_outputs(out, ports=None):
+    """
+    Open the CSV output(s) with their header: one file per port, named
+    <base>_<port>.<ext> after out, or out itself for ports=None. A None
+    among the ports is the file <base>_pid.<ext> of --pid processes that
+    have no port. Returns ({port or None: file}, {port or None: writer}).
+    """
+    if ports is None:
+        names = {None: out}
+    else:
+        base_name = out.rsplit('.', 1)[0] if '.' in out else out
+        extension = out.rsplit('.', 1)[1] if '.' in out else 'csv'
+        names = {port: f"{base_name}_{'pid' if port is None else port}.{extension}"
+                 for port in sorted(ports, key=str)}
+    files, writers = {}, {}
+    for port, filename in names.items():
+        files[port] = open(filename, "w", newline="")
+        writers[port] = csv.writer(files[port])
+        writers[port].writerow(CSV_HEADER)
+        if ports is not None:
+            print(f"[INFO] Writing {'unmapped PID' if port is None else f'port {port}'} metrics to: {filename}")
+    return files, writers
+
+
+def find_listeners(ports):
+    """
+    PIDs listening on each port, from one read of the system-wide connection
+    table instead of one per process. Falls back to the per-process scan where
+    the table needs root (macOS).
+    """
+    listeners = {port: set() for port in ports}
+    try:
+        connections = psutil.net_connections(kind="inet")
+    except psutil.AccessDenied:
+        return {port: set(find_pids_by_port(port)) for port in ports}
+    for conn in connections:
+        if (
+            conn.status == psutil.CONN_LISTEN
+            and conn.laddr
+            and conn.laddr.port in listeners
+            and conn.pid
+        ):
+            listeners[conn.laddr.port].add(conn.pid)
+    return listeners
+
+
+def discover(roots_by_port, known):
+    """
+    Current process trees of the root PIDs of every port, as {pid: (port, Process)}.
+    Processes already in known keep their Process object, so their CPU
+    baseline carries over; is_running() rejects reused PIDs.
+    """
+    found = {}
+    for port, roots in roots_by_port.items():
+        for pid in roots:
+            try:
+                root = psutil.Process(pid)
+                tree = [root] + root.children(recursive=True)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            for p in tree:
+                if p.pid in found:
+                    continue
+                previous = known.get(p.pid)
+                if previous is not None and previous[1].is_running():
+                    p = previous[1]
+                found[p.pid] = (port, p)
+    return found
+
+
+def run_efficient(args):
+    """
+    Low-overhead sampling: every process is read inside oneshot(), the process
+    trees of the ports (default: every port in PORT_SERVICE_MAP) and PIDs are
+    re-discovered every --rediscover seconds so workers started later are
+    picked up, and rows are buffered and written every --flush-interval seconds.
+    With --aggregate, each tick also gets one row per port with pid "all"
+    summing its processes. --pid-port-map assigns --pid PIDs (and their
+    children) to ports and, as in the default mode, writes one CSV per port
+    when it names several ports; PIDs it does not map, and ports given with
+    --port, get their own file then.
+    """
+    ports = args.port if args.port else ([] if args.pid else
+                                          [port for ports in PORT_SERVICE_MAP.values() for port in ports])
+    pid_to_port = {}
+    if args.pid and args.pid_port_map:
+        pid_to_port = {pid: port for port, pids in parse_pid_port_map(args.pid_port_map).items() for pid in pids}
+    per_port_files = len(set(pid_to_port.values())) > 1
+    file_ports = set(pid_to_port.values()) | set(ports)
+    if any(pid not in pid_to_port for pid in args.pid):
+        file_ports.add(None)
+    known = {}
+
+    def rediscover():
+        roots = find_listeners(ports) if ports else {}
+        for pid in args.pid:
+            roots.setdefault(pid_to_port.get(pid), set()).add(pid)
+        found = discover(roots, known)
+        started = [pid for pid in found if pid not in known]
+        for pid in started:
+            try:
+                found[pid][1].cpu_percent(None)  # baseline, the first value comes next tick
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                del found[pid]
+        stopped = [pid for pid in known if pid not in found]
+        if started or stopped:
+            print(f"[INFO] Monitoring {len(found)} process(es), new: {sorted(started)}, gone: {sorted(stopped)}")
+        known.clear()
+        known.update(found)
+
+    files, writers = open_outputs(args.out, file_ports if per_port_files else None)
+    buffer = []  # (port, row)
+
+    def flush():
+        for port, row in buffer:
+            if not per_port_files:
+                writers[None].writerow(row)
+            elif port in writers:
+                writers[port].writerow(row)
+            elif port == "":
+                # System-wide rows go to every file
+                for writer in writers.values():
+                    writer.writerow(row)
+        buffer.clear()
+        for f in files.values():
+            f.flush()
+
+    # SIGTERM unwinds like Ctrl+C, so the buffered rows are written below
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    psutil.cpu_percent(None)
+    rediscover()
+    if not known:
+        print(f"[WARN] No process found yet. Monitoring system-wide metrics until one appears.")
+    tick = next_flush = next_discovery = time.monotonic()
+    next_flush += args.flush_interval
+    next_discovery += args.rediscover
+    try:
+        while True:
+            tick += args.interval
+            time.sleep(max(0.0, tick - time.monotonic()))
+            ts = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            total_cpu = psutil.cpu_percent(None)
+            total_mem = psutil.virtual_memory().percent
+
+            per_port = {}
+            for pid, (port, p) in list(known.items()):
+                try:
+                    with p.oneshot():
+                        proc_cpu = p.cpu_percent(None)
+                        proc_mem = p.memory_info().rss / (1024 * 1024)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    del known[pid]
+                    continue
+                service = service_for_port(port) if port is not None else "pid_input"
+                buffer.append((port, [ts, total_cpu, total_mem, "" if port is None else port, service, pid,
+                                       proc_cpu, proc_mem]))
+                if args.aggregate:
+                    totals = per_port.setdefault(port, [0.0, 0.0])
+                    totals[0] += proc_cpu
+                    totals[1] += proc_mem
+            for port, (proc_cpu, proc_mem) in per_port.items():
+                service = service_for_port(port) if port is not None else "pid_input"
+                buffer.append((port, [ts, total_cpu, total_mem, "" if port is None else port, service, "all",
+                                      proc_cpu, proc_mem]))
+            if not known:
+                buffer.append(("", [ts, total_cpu, total_mem, "", "", "", "", ""]))
+
+            now = time.monotonic()
+            if now >= next_flush:
+                flush()
+                next_flush = now + args.flush_interval
+            if args.rediscover > 0 and now >= next_discovery:
+                rediscover()
+                next_discovery = now + args.rediscover
+    except KeyboardInterrupt:
+        print("\n[INFO] Monitoring stopped.")
+    finally:
+        flush()
+        for f in files.values():
+            f.close()
+
+
 def main():
     parser = argparse.ArgumentParser(description="Monitor CPU and memory usage.")
     parser.add_argument("--pid", type=int, nargs="*", default=[], help="One or more root PIDs to monitor")
@@ -59,8 +271,20 @@ def main():
     parser.add_argument("--out", type=str, default=DEFAULT_OUT,
                         help="Output CSV filename (base name when using multiple ports)")
     parser.add_argument("--pid-port-map", type=str, help="Comma-separated port:pid pairs, e.g., '5001:1234,5003:5678'")
+    parser.add_argument("--efficient", action="store_true",
+                        help="Low-overhead mode: oneshot() sampling, process re-discovery and buffered writes")
+    parser.add_argument("--rediscover", type=float, default=5.0,
+                        help="Seconds between process tree re-discoveries in efficient mode (0 disables)")
+    parser.add_argument("--flush-interval", type=float, default=5.0,
+                        help="Seconds between CSV writes in efficient mode")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="Also write one row per port summing its processes (efficient mode)")
     args = parser.parse_args()
 
+    if args.efficient:
+        run_efficient(args)
+        return
+
     targets = []
     pid_to_port = {}
     pid_to_service = {}
@@ -69,20 +293,8 @@ def main():
     if args.pid:
         # NEW: Parse pid-port mapping if provided
         if args.pid_port_map:
-            for pair in args.pid_port_map.split(','):
-                parts = pair.split(':')
-                port = int(parts[0])
-                # Handle multiple PIDs - split by both : and newlines
-                pid_str = ':'.join(parts[1:])
-                pids = [int(p.strip()) for p in pid_str.replace('\n', ':').split(':') if p.strip()]
-                
-                service = None
-                for svc_name, ports in PORT_SERVICE_MAP.items():
-                    if port in ports:
-                        service = svc_name
-                        break
-                if service is None:
-                    service = f"port{port}"
+            for port, pids in parse_pid_port_map(args.pid_port_map).items():
+                service = service_for_port(port)
                 
                 if port not in port_to_processes:
                     port_to_processes[port] = []
@@ -128,44 +340,12 @@ def main():
 
     # NEW: Determine if we need multiple CSV files
     use_multiple_files = args.pid_port_map and len(port_to_processes) > 1
-    
-    if use_multiple_files:
-        # Create one CSV file per port
-        base_name = args.out.rsplit('.', 1)[0] if '.' in args.out else args.out
-        extension = args.out.rsplit('.', 1)[1] if '.' in args.out else 'csv'
-        
-        csv_files = {}
-        csv_writers = {}
-        
-        for port in sorted(port_to_processes.keys()):
-            filename = f"{base_name}_{port}.{extension}"
-            csv_files[port] = open(filename, "w", newline="")
-            csv_writers[port] = csv.writer(csv_files[port])
-            csv_writers[port].writerow([
-                "timestamp",
-                "cpu_total_percent",
-                "mem_total_percent",
-                "port",
-                "service",
-                "pid",
-                "proc_cpu_percent",
-                "proc_mem_mb"
-            ])
-            print(f"[INFO] Writing port {port} metrics to: {filename}")
-    else:
-        # Single CSV file (original behavior)
-        csv_files = {None: open(args.out, "w", newline="")}
-        csv_writers = {None: csv.writer(csv_files[None])}
-        csv_writers[None].writerow([
-            "timestamp",
-            "cpu_total_percent",
-            "mem_total_percent",
-            "port",
-            "service",
-            "pid",
-            "proc_cpu_percent",
-            "proc_mem_mb"
-        ])
+    file_ports = set(port_to_processes)
+    if args.pid and any(pid not in pid_to_port for pid in args.pid):
+        file_ports.add(None)  # --pid processes without a port go to <base>_pid.csv
+
+    # One CSV file per port, or a single one (original behavior)
+    csv_files, csv_writers = open_outputs(args.out, file_ports if use_multiple_files else None)
 
     # Initialize
     psutil.cpu_percent(None)
@@ -201,9 +381,8 @@ def main():
                         
                         # NEW: Write to appropriate CSV file
                         if use_multiple_files:
-                            writer = csv_writers.get(port)
-                            if writer:
-                                writer.writerow([ts, total_cpu, total_mem, port, service, p.pid, proc_cpu, proc_mem])
+                            writer = csv_writers[pid_to_port.get(p.pid)]
+                            writer.writerow([ts, total_cpu, total_mem, port, service, p.pid, proc_cpu, proc_mem])
                         else:
                             csv_writers[None].writerow([ts, total_cpu, total_mem, port, service, p.pid, proc_cpu, proc_mem])
                     except psutil.NoSuchProcess:
@@ -2,6 +2,7 @@ import requests
 import json
 import sys
 import os
+from job_polling import run_simulation
 
 # URLs for the services
 MODEL1_SERVICE_URL = os.getenv("MODEL1_SERVICE_URL", "http://localhost:5001/")
@@ -44,14 +45,13 @@ def main(config_file):
             "steady_state_tol": config.get("steady_state_tol", 1e-12),
             "max_iter": config.get("max_iter", 10000)
         }
-        bioturbation_response = requests.post(f"{model_service_url}/bioturbation/run", json=bioturbation_data)
+        simulation_id, error = run_simulation(model_service_url, bioturbation_data, config)
         
-        if bioturbation_response.status_code != 201:
+        if error is not None:
             print("Error: Failed to run bioturbation simulation.")
-            print("Details:", bioturbation_response.json())
+            print("Details:", error)
             sys.exit(1)
         
-        simulation_id = bioturbation_response.json().get("simulation_id")
         print(f"Bioturbation simulation completed. Simulation ID: {simulation_id}")
 
         print("Running plotting service...")
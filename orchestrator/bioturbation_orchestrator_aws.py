@@ -4,6 +4,7 @@ import sys
 import os
 import uuid
 import time
+from job_polling import run_simulation
 
 # URLs for the services
 #MODEL1_SERVICE_URL = os.getenv("MODEL1_SERVICE_URL", "http://localhost:5001/")
@@ -55,16 +56,16 @@ def main(config_file):
             "max_iter": config.get("max_iter", 10000)
         }
         #start_send = time.time()
-        bioturbation_response = requests.post(f"{model_service_url}/bioturbation/run", json=bioturbation_data)
+        # With "async": true in the config the run is polled instead of held open behind the ALB
+        simulation_id, error = run_simulation(model_service_url, bioturbation_data, config)
         #end_receive = time.time()
         #print(f"[Orchestrator] Bioturbation request: Sent at {start_send:.6f}, Received at {end_receive:.6f}")
         
-        if bioturbation_response.status_code != 201:
+        if error is not None:
             print("Error: Failed to run bioturbation simulation.")
-            print("Details:", bioturbation_response.json())
+            print("Details:", error)
             sys.exit(1)
         
-        simulation_id = bioturbation_response.json().get("simulation_id")
         print(f"Bioturbation simulation completed. Simulation ID: {simulation_id}")
 
         #print("Running plotting service...")
@@ -2,96 +2,159 @@ import requests
 import json
 import sys
 import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from job_polling import run_simulation
 
 # URLs for the services
 MODEL1_SERVICE_URL = os.getenv("MODEL1_SERVICE_URL", "http://localhost:5001/")
 MODEL2_SERVICE_URL = os.getenv("MODEL2_SERVICE_URL", "http://localhost:5002/")
 PLOTTING_SERVICE_URL = os.getenv("PLOTTING_SERVICE_URL", "http://localhost:5003/plot")
 
-def process_input(config):
-    """process a single input configuration"""
+
+class ServiceLimiter:
+    """
+    post/get like the requests module, but with at most max_in_flight requests
+    open per service (scheme, host and port of the URL) across all threads.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def _slot(self, url):
+        service = "/".join(url.split("/")[:3])
+        with self.lock:
+            if service not in self.slots:
+                self.slots[service] = threading.BoundedSemaphore(self.max_in_flight)
+            return self.slots[service]
+
+    def post(self, url, **kwargs):
+        with self._slot(url):
+            return requests.post(url, **kwargs)
+
+    def get(self, url, **kwargs):
+        with self._slot(url):
+            return requests.get(url, **kwargs)
+
+
+def process_input(index, config, http=requests):
+    """
+    Create the profile, run and plot a single input configuration.
+    Returns its result: "status" is "done" or "failed", with the failed
+    "stage" and "error" details, the IDs created and the elapsed seconds.
+    """
+    start = time.perf_counter()
+    result = {"input": index, "model": config.get("model"), "status": "failed"}
+
+    def failed(stage, error):
+        print(f"[input {index}] Error: {stage} failed. Details: {error}")
+        return dict(result, stage=stage, error=error, elapsed=time.perf_counter() - start)
+
     model = config.get("model", "").lower()
     if model == "model1":
         model_service_url = MODEL1_SERVICE_URL
     elif model == "model2":
         model_service_url = MODEL2_SERVICE_URL
     else:
-        print("Error: Invalid model")
-        return
-    
-    print("Creating soil profile...")
-    profile_response = requests.post(f"{model_service_url}/soil-profile", json=config)
-    if profile_response.status_code != 201:
-        print("Error: Failed to create soil profile.")
-        print("Details:", profile_response.json())
-        return 
-    
-    profile_id = profile_response.json().get("id")
-    print(f"Successfully created soil profile. Profile ID: {profile_id}")  
-
-    print("Running bioturbation...")
-    bioturbation_data = {
-            "profile_id": profile_id,
-            "dt": config.get("dt", 86400),
-            "steady_state_tol": config.get("steady_state_tol", 1e-12),
-            "max_iter": config.get("max_iter", 10000)
-        }
-    bioturbation_response = requests.post(f"{model_service_url}/bioturbation/run", json=bioturbation_data) 
-
-    if bioturbation_response.status_code != 201:
-        print("Error: Failed to run bioturbation simulation.")
-        print("Details:", bioturbation_response.json())
-        return
-    
-    simulation_id = bioturbation_response.json().get("simulation_id")
-    print(f"Bioturbation simulation completed. Simulation ID: {simulation_id}")
-
-    print("Running plotting service...")
-    plotting_response = requests.post(PLOTTING_SERVICE_URL, json={"simulation_id": simulation_id})
-    if plotting_response.status_code != 200:
-        print("Error: Failed to trigger plotting service.")
-        print("Details:", plotting_response.json())
-        return
-
-    print("Plotting completed successfully.")
-
-def main(config_file):
+        return failed("config", "Invalid model")
+
+    try:
+        print(f"[input {index}] Creating soil profile...")
+        profile_response = http.post(f"{model_service_url}/soil-profile", json=config)
+        if profile_response.status_code != 201:
+            return failed("soil-profile", profile_response.json())
+
+        profile_id = profile_response.json().get("id")
+        result["profile_id"] = profile_id
+        print(f"[input {index}] Successfully created soil profile. Profile ID: {profile_id}")
+
+        print(f"[input {index}] Running bioturbation...")
+        bioturbation_data = {
+                "profile_id": profile_id,
+                "dt": config.get("dt", 86400),
+                "steady_state_tol": config.get("steady_state_tol", 1e-12),
+                "max_iter": config.get("max_iter", 10000)
+            }
+        simulation_id, error = run_simulation(model_service_url, bioturbation_data, config, http=http)
+        if error is not None:
+            return failed("bioturbation", error)
+
+        result["simulation_id"] = simulation_id
+        print(f"[input {index}] Bioturbation simulation completed. Simulation ID: {simulation_id}")
+
+        print(f"[input {index}] Running plotting service...")
+        plotting_response = http.post(PLOTTING_SERVICE_URL, json={"simulation_id": simulation_id})
+        if plotting_response.status_code != 200:
+            return failed("plotting", plotting_response.json())
+    except (requests.RequestException, ValueError) as e:
+        # ValueError: a service answered with a body that is not JSON
+        return failed("request", f"Failed to communicate with services: {e}")
+
+    print(f"[input {index}] Plotting completed successfully.")
+    return dict(result, status="done", elapsed=time.perf_counter() - start)
+
+
+def print_summary(results, wall_time, concurrency):
+    done = [r for r in results if r["status"] == "done"]
+    print("\nSummary")
+    for r in results:
+        ids = f"profile {r.get('profile_id', '-')}, simulation {r.get('simulation_id', '-')}"
+        outcome = "done" if r["status"] == "done" else f"failed at {r['stage']}"
+        print(f"  input {r['input']}: {outcome} in {r['elapsed']:.2f} s ({ids})")
+    print(f"{len(done)}/{len(results)} inputs completed, {len(results) - len(done)} failed, "
+          f"concurrency {concurrency}")
+    print(f"Wall-clock time: {wall_time:.2f} s, throughput: {len(done) / wall_time if wall_time else 0:.2f} inputs/s")
+
+
+def main(config_file, concurrency=None, max_in_flight=None):
     """
     Orchestrator script for running bioturbation and triggering plotting.
+    Up to "concurrency" inputs run at once (default 1, one after another) with
+    at most "max_in_flight" requests open per service (default: concurrency).
     """
     try:
         # Read configuration file
         with open(config_file, 'r') as f:
             config = json.load(f)
-        
-        inputs = config.get("inputs", [])
-        if not inputs:
-            print("Error: No inputs found in the configuration file.")
-            sys.exit(1)
-
-        for i, input_config in enumerate(inputs, start=1):
-            print(f"\nProcessing input {i}/{len(inputs)}...\n")
-            process_input(input_config)
-
-        print("\nAll inputs processed successfully.")
-
     except FileNotFoundError:
         print(f"Error: Config file '{config_file}' not found.")
         sys.exit(1)
     except json.JSONDecodeError:
         print(f"Error: Failed to parse JSON from config file '{config_file}'.")
         sys.exit(1)
-    except requests.RequestException as e:
-        print(f"Error: Failed to communicate with services. Details: {e}")
+
+    inputs = config.get("inputs", [])
+    if not inputs:
+        print("Error: No inputs found in the configuration file.")
         sys.exit(1)
-    
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python orchestrator.py <config_file>")
+    concurrency = max(1, concurrency or config.get("concurrency", 1))
+    max_in_flight = max(1, max_in_flight or config.get("max_in_flight", concurrency))
+    http = ServiceLimiter(max_in_flight)
+    print(f"Processing {len(inputs)} inputs, {concurrency} at a time, "
+          f"at most {max_in_flight} requests in flight per service.\n")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(process_input, i, input_config, http)
+                   for i, input_config in enumerate(inputs, start=1)]
+        results = [future.result() for future in futures]
+    wall_time = time.perf_counter() - start
+
+    print_summary(results, wall_time, concurrency)
+    if any(r["status"] != "done" for r in results):
         sys.exit(1)
 
-    # Pass the config file as a command-line argument
-    config_file = sys.argv[1]
-    main(config_file)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run every input of a config file through the services.")
+    parser.add_argument("config_file", help="config with an \"inputs\" list, e.g. client/config_multiple.json")
+    parser.add_argument("--concurrency", type=int, help="inputs processed at once (default: the config's, or 1)")
+    parser.add_argument("--max-in-flight", type=int,
+                        help="requests open at once per service (default: the config's, or the concurrency)")
+    args = parser.parse_args()
+    main(args.config_file, args.concurrency, args.max_in_flight)
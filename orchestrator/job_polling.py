@@ -0,0 +1,48 @@
+import time
+import requests
+
+
+def wait_for_job(model_service_url, job_id, poll_interval=1.0, timeout=3600, http=requests):
+    """
+    Poll an asynchronous simulation job until it is done or failed.
+    Returns the final job status, or a failed status if timeout seconds pass.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = http.get(f"{model_service_url}/jobs/{job_id}")
+        if response.status_code != 200:
+            return {"job_id": job_id, "status": "failed", "error": response.json()}
+        job = response.json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(poll_interval)
+    return {"job_id": job_id, "status": "failed", "error": f"Timed out after {timeout} s"}
+
+
+def run_simulation(model_service_url, bioturbation_data, config, http=requests):
+    """
+    Start a bioturbation run and return (simulation_id, error details).
+    With "async": true in the config the run is submitted as a job and polled
+    every "poll_interval" seconds, so no HTTP connection stays open while it runs.
+    http is the module or object whose post/get send the requests.
+    """
+    use_async = config.get("async", False)
+    if use_async:
+        bioturbation_data = dict(bioturbation_data, **{"async": True})
+    response = http.post(f"{model_service_url}/bioturbation/run", json=bioturbation_data)
+
+    if use_async and response.status_code == 202:
+        job = wait_for_job(
+            model_service_url,
+            response.json()["job_id"],
+            poll_interval=config.get("poll_interval", 1.0),
+            timeout=config.get("poll_timeout", 3600),
+            http=http,
+        )
+        if job["status"] != "done":
+            return None, job.get("error", job)
+        return job["simulation_id"], None
+
+    if response.status_code != 201:
+        return None, response.json()
+    return response.json().get("simulation_id"), None
@@ -0,0 +1,264 @@
+"""
+Benchmarks of the simulation and plotting hot paths, run offline against the
+in-memory Mongo stand-in:
+
+    python testing/benchmark.py                          # writes benchmark_<commit>.json
+    python testing/benchmark.py --quick --only model_2_run service_run
+    python testing/benchmark.py --compare benchmark_<old commit>.json
+
+Every case runs on synthetic profiles (seeded) that scale the number of
+layers, grid points and iterations. Each timing is the best-calibrated number
+of calls per repeat (timeit autorange), reported as seconds per call.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "microservice"))
+sys.path.append(os.path.join(ROOT, "microservice", "model"))
+sys.path.append(os.path.join(ROOT, "microservice", "common"))
+# Kernels run in the request thread so the service timings are not pool round trips
+os.environ.setdefault("SIMULATION_PROCESSES", "0")
+
+from mongo_standin import install
+from simulation.kernels import bioturbation, model_1_kernel, model_2_kernel
+from simulation.profiles import (
+    process_model_1_layers, model_1_run_params, process_model_2_layers, model_2_run_params,
+)
+from simulation.plots import as_df, create_plot, png_buffer
+
+
+def synthetic_profile(layers, model="Model1", seed=0):
+    """A profile config of `layers` 0.1 m layers with seeded parameters, all the mass in the top layer."""
+    rng = np.random.default_rng(seed)
+    return {
+        "model": model,
+        "layers": [
+            {"depth": 0.1, "initial_conc": 4e-9 if i == 0 else 0.0,
+             "earthworm_density": float(rng.uniform(10, 25)), "beta": float(rng.uniform(0.5e-8, 1e-8))}
+            for i in range(layers)
+        ],
+        "h": 0.2,
+    }
+
+
+def synthetic_history(layers, samples, seed=0):
+    """A (layers, samples) history decaying towards a uniform concentration."""
+    rng = np.random.default_rng(seed)
+    decay = np.exp(-np.arange(samples) / (samples / 5))
+    return 1e-9 + rng.uniform(0, 3e-9, (layers, 1)) * decay
+
+
+class Skip(Exception):
+    """Raised by a case setup that cannot run here."""
+
+
+# Cases: name -> (parameter grid, setup(**params) returning the timed callable).
+# The first value of every parameter is the --quick size.
+def bench_bioturbation(layers):
+    soil_layers, _ = process_model_1_layers(synthetic_profile(layers))
+    return lambda: bioturbation(soil_layers, 86400)
+
+
+def bench_model_1_run(engine, layers, iterations):
+    layers_, _ = process_model_1_layers(synthetic_profile(layers))
+    # tol 0 never reaches the steady state, so every run takes all the iterations
+    params = model_1_run_params(layers_, {"engine": engine, "max_iter": iterations, "steady_state_tol": 0})
+    return lambda: model_1_kernel(params)
+
+
+def bench_model_2_run(solver, Nx, iterations):
+    layers_, _ = process_model_2_layers(synthetic_profile(4, "Model2"))
+    params = model_2_run_params(layers_, {"solver": solver, "Nx": Nx, "max_iter": iterations, "steady_state_tol": 0})
+    return lambda: model_2_kernel(params)
+
+
+def bench_create_soil_layer(model, layers):
+    process = process_model_1_layers if model == "Model1" else process_model_2_layers
+    config = synthetic_profile(layers, model)
+    return lambda: process(config)
+
+
+def bench_plot_figure(layers, samples):
+    history = synthetic_history(layers, samples)
+    time_steps, layer_ids = list(range(samples)), list(range(1, layers + 1))
+    return lambda: create_plot(as_df(history, layer_ids, time_steps))
+
+
+def bench_png_export(layers, samples):
+    try:
+        import kaleido  # noqa: F401
+    except ImportError:
+        raise Skip("kaleido is not installed")
+    fig = create_plot(as_df(synthetic_history(layers, samples), list(range(1, layers + 1)), list(range(samples))))
+    return lambda: png_buffer(fig)
+
+
+def bench_service_run(model, layers, iterations):
+    app, prefix = service(model)
+    client = app.test_client()
+    profile_id = client.post(prefix + "/soil-profile", json=synthetic_profile(layers, model)).json["id"]
+    body = {"profile_id": profile_id, "max_iter": iterations, "steady_state_tol": 0, "cache": False}
+
+    def run():
+        response = client.post(prefix + "/bioturbation/run", json=body)
+        if response.status_code != 201:
+            raise RuntimeError(f"{model} run failed: {response.status_code} {response.json}")
+    return run
+
+
+def bench_history_read(layers, samples):
+    from history_store import store_history, read_history_window
+    db = install()["plotting_database"]
+    collection = db["benchmark_histories"]
+    simulation_id = collection.count_documents({}) + 1
+    store_history(db, collection, {"simulation_id": simulation_id}, list(range(samples)),
+                  list(range(1, layers + 1)), synthetic_history(layers, samples))
+    return lambda: read_history_window(db, collection, {"simulation_id": simulation_id})
+
+
+_services = {}
+
+
+def service(model):
+    """The Flask app and route prefix of a model service, imported against the stand-in."""
+    if model not in _services:
+        install()
+        if model == "Model1":
+            import model_1
+            _services[model] = (model_1.app, "/model")
+        else:
+            import model_2
+            _services[model] = (model_2.app, "")
+    return _services[model]
+
+
+CASES = {
+    "bioturbation": ({"layers": [4, 16, 64]}, bench_bioturbation),
+    "model_1_run": ({"engine": ["loop", "matrix"], "layers": [4, 64], "iterations": [1000, 10000]},
+                    bench_model_1_run),
+    "model_2_run": ({"solver": ["explicit", "crank-nicolson"], "Nx": [10, 100, 1000], "iterations": [1000, 10000]},
+                    bench_model_2_run),
+    "create_soil_layer": ({"model": ["Model1", "Model2"], "layers": [10, 1000]}, bench_create_soil_layer),
+    "plot_figure": ({"layers": [4, 16], "samples": [1000, 10000]}, bench_plot_figure),
+    "png_export": ({"layers": [4, 16], "samples": [1000, 10000]}, bench_png_export),
+    "service_run": ({"model": ["Model1", "Model2"], "layers": [4, 16], "iterations": [1000, 10000]},
+                    bench_service_run),
+    "history_read": ({"layers": [4, 16], "samples": [1000, 100000]}, bench_history_read),
+}
+
+
+def case_params(grid, quick):
+    """Every combination of the grid's values, or only the first values when quick."""
+    combos = [{}]
+    for name, values in grid.items():
+        combos = [dict(combo, **{name: value}) for combo in combos for value in (values[:1] if quick else values)]
+    return combos
+
+
+def time_case(fn, repeat):
+    """Seconds per call of fn over repeat calibrated batches."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return number, [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+
+def run_benchmarks(names, quick=False, repeat=5):
+    results = []
+    for name in names:
+        grid, setup = CASES[name]
+        for params in case_params(grid, quick):
+            label = name + " " + " ".join(f"{k}={v}" for k, v in params.items())
+            result = {"name": name, "params": params}
+            try:
+                number, times = time_case(setup(**params), repeat)
+            except Skip as e:
+                result["skipped"] = str(e)
+                print(f"{label}: skipped, {e}", file=sys.stderr)
+            else:
+                result.update(number=number, repeat=repeat, min=min(times), median=statistics.median(times),
+                              mean=statistics.fmean(times), stdev=statistics.stdev(times) if repeat > 1 else 0.0)
+                print(f"{label}: {result['median'] * 1e3:.4f} ms (min {result['min'] * 1e3:.4f} ms, {number} calls x {repeat})",
+                      file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(baseline, results, threshold):
+    """Print the median ratio of every case against a baseline run; returns the regressed cases."""
+    old = {case_key(r): r for r in baseline["results"] if "median" in r}
+    regressions = []
+    print(f"{'case':60} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for result in results:
+        before = old.get(case_key(result))
+        if before is None or "median" not in result:
+            continue
+        ratio = result["median"] / before["median"]
+        label = result["name"] + " " + " ".join(f"{k}={v}" for k, v in result["params"].items())
+        flag = " slower" if ratio > threshold else (" faster" if ratio < 1 / threshold else "")
+        print(f"{label:60} {before['median'] * 1e3:12.4f} {result['median'] * 1e3:12.4f} {ratio:7.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(label)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and plotting hot paths.")
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), help="cases to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="only the smallest size of every case")
+    parser.add_argument("--repeat", type=int, default=5, help="timed batches per case (default 5)")
+    parser.add_argument("--output", help="results JSON file (default benchmark_<commit>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.1,
+                        help="median ratio above which a case counts as a regression (default 1.1)")
+    args = parser.parse_args(argv)
+
+    commit = git_commit()
+    started = time.time()
+    results = run_benchmarks(args.only or list(CASES), args.quick, args.repeat)
+    report = {
+        "commit": commit,
+        "timestamp": started,
+        "quick": args.quick,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "results": results,
+    }
+    output = args.output or f"benchmark_{commit or 'local'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than {args.threshold}x the baseline", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
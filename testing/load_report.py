@@ -0,0 +1,250 @@
+"""
+Join the resource samples of monitor_v1.py with the request log of a load test
+(JMeter's results.jtl, or the --jtl of load_test.py) and report, per load
+window and over the whole test:
+
+- per service: CPU-seconds, cores in use, CPU-seconds per request and the
+  memory high-water mark (sum of its processes' RSS)
+- throughput, throughput per core (requests per CPU-second of all services)
+  and latency percentiles, overall and per request label
+
+    python testing/load_report.py --monitor msa_metrics*.csv --jtl results.jtl --window 10 \\
+        --name msa --output report.json --html report.html --png report.png
+
+Requests are attributed to a service by the port of their URL (using the
+port/service pairs in the monitor CSVs) or by --label-service; requests that
+match no service, like the orchestrator samples of the JMeter plan, are
+reported as their own "unattributed" row and count for no service. Monitor timestamps are UTC; --clock-offset shifts them when the
+monitor ran on a host with a different clock.
+"""
+import argparse
+import glob
+import json
+import sys
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+
+PERCENTILES = (50, 95, 99)
+
+
+def expand(patterns):
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+def read_monitor(patterns, clock_offset=0.0):
+    """
+    Per-process monitor rows with "time" (epoch s) and "cpu_seconds": the CPU
+    used since the previous tick of the same file. Aggregate ("all") and
+    system-only rows are dropped.
+    """
+    frames = []
+    for path in expand(patterns):
+        df = pd.read_csv(path, dtype={"pid": str, "port": str, "service": str})
+        times = pd.to_datetime(df["timestamp"], utc=True, format="ISO8601")
+        df["time"] = (times - pd.Timestamp(0, tz="UTC")).dt.total_seconds() + clock_offset
+        ticks = np.sort(df["time"].unique())
+        # cpu_percent(None) is the usage since the previous call, one tick earlier
+        intervals = dict(zip(ticks, np.diff(ticks, prepend=ticks[0]) if len(ticks) else []))
+        df["cpu_seconds"] = df["proc_cpu_percent"].fillna(0) / 100 * df["time"].map(intervals)
+        df["file"] = path
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    return df[df["pid"].notna() & (df["pid"] != "all")]
+
+
+def read_jtl(patterns):
+    """Request rows (JMeter CSV format) with "start"/"end" (epoch s), "latency_ms" and "ok"."""
+    df = pd.concat([pd.read_csv(path) for path in expand(patterns)], ignore_index=True)
+    df["start"] = df["timeStamp"] / 1000
+    df["end"] = df["start"] + df["elapsed"] / 1000
+    df["latency_ms"] = df["elapsed"].astype(float)
+    df["ok"] = df["success"].astype(str).str.lower() == "true"
+    df["label"] = df["label"].astype(str)
+    return df
+
+
+def attribute(requests, monitor, label_service):
+    """Service of every request from its URL port, else its label, else None."""
+    port_service = dict(monitor[["port", "service"]].dropna().drop_duplicates().itertuples(index=False))
+
+    def service(row):
+        url = getattr(row, "URL", None)
+        if isinstance(url, str):
+            try:
+                port = urlsplit(url).port
+            except ValueError:
+                port = None
+            if port is not None and str(port) in port_service:
+                return port_service[str(port)]
+        return label_service.get(row.label)
+
+    return [service(row) for row in requests.itertuples(index=False)]
+
+
+def latency_summary(latencies):
+    if len(latencies) == 0:
+        return {}
+    values = np.percentile(latencies, PERCENTILES)
+    summary = {f"p{p}_ms": float(v) for p, v in zip(PERCENTILES, values)}
+    summary["mean_ms"] = float(np.mean(latencies))
+    return summary
+
+
+def period_summary(requests, monitor, services, start, end):
+    """Request and resource figures of the requests completed and samples taken in [start, end)."""
+    duration = end - start
+    done = requests[(requests["end"] >= start) & (requests["end"] < end)]
+    samples = monitor[(monitor["time"] >= start) & (monitor["time"] < end)]
+    cpu_seconds = float(samples["cpu_seconds"].sum())
+    summary = {
+        "start_s": start, "end_s": end, "duration_s": duration,
+        "requests": int(len(done)), "errors": int((~done["ok"]).sum()),
+        "throughput_rps": len(done) / duration if duration else 0.0,
+        "cpu_seconds": cpu_seconds,
+        "cores": cpu_seconds / duration if duration else 0.0,
+        # Requests per CPU-second: the throughput one fully busy core sustains
+        "throughput_per_core": len(done) / cpu_seconds if cpu_seconds else None,
+        "latency": latency_summary(done.loc[done["ok"], "latency_ms"]),
+        "labels": {label: dict(requests=int(len(rows)), errors=int((~rows["ok"]).sum()),
+                               **latency_summary(rows.loc[rows["ok"], "latency_ms"]))
+                   for label, rows in done.groupby("label")},
+        "services": {},
+    }
+    # Requests of no monitored service have no CPU to be charged with
+    unattributed = done[done["service"].isna()]
+    summary["unattributed"] = dict(requests=int(len(unattributed)), errors=int((~unattributed["ok"]).sum()),
+                                   **latency_summary(unattributed.loc[unattributed["ok"], "latency_ms"]))
+    for service in services:
+        rows = samples[samples["service"] == service]
+        service_cpu = float(rows["cpu_seconds"].sum())
+        served = int((done["service"] == service).sum())
+        memory = rows.groupby(["file", "time"])["proc_mem_mb"].sum()
+        summary["services"][service] = {
+            "cpu_seconds": service_cpu,
+            "cores": service_cpu / duration if duration else 0.0,
+            "requests": served,
+            "cpu_seconds_per_request": service_cpu / served if served else None,
+            "mem_high_water_mb": float(memory.max()) if len(memory) else None,
+            "processes": int(rows["pid"].nunique()),
+        }
+    return summary
+
+
+def build_report(requests, monitor, window, name=None):
+    """Summary of the whole test and of every window of `window` seconds, times relative to the first request."""
+    t0 = float(requests["start"].min())
+    t1 = float(requests["end"].max())
+    requests = requests.assign(start=requests["start"] - t0, end=requests["end"] - t0)
+    monitor = monitor.assign(time=monitor["time"] - t0)
+    services = sorted(monitor["service"].dropna().unique())
+    span = t1 - t0
+    edges = np.arange(0.0, span + window, window) if window else np.array([0.0, span])
+    edges[-1] = max(edges[-1], span + 1e-9)  # the last request ends inside the last window
+    return {
+        "name": name,
+        "test_start": pd.Timestamp(t0, unit="s", tz="UTC").isoformat(),
+        "window_s": window,
+        "services": services,
+        "overall": period_summary(requests, monitor, services, 0.0, float(edges[-1])),
+        "windows": [period_summary(requests, monitor, services, float(a), float(b))
+                    for a, b in zip(edges[:-1], edges[1:])],
+    }
+
+
+def report_figure(report):
+    """Per-window throughput, latency, cores and memory of every service as one plotly figure."""
+    from plotly.subplots import make_subplots
+    import plotly.graph_objects as go
+    windows = report["windows"]
+    x = [w["start_s"] for w in windows]
+    fig = make_subplots(rows=4, cols=1, shared_xaxes=True, vertical_spacing=0.05, subplot_titles=(
+        "Throughput (requests/s)", "Latency (ms)", "CPU (cores)", "Memory high-water (MB)"))
+    fig.add_trace(go.Scatter(x=x, y=[w["throughput_rps"] for w in windows], name="throughput"), row=1, col=1)
+    for p in PERCENTILES:
+        fig.add_trace(go.Scatter(x=x, y=[w["latency"].get(f"p{p}_ms") for w in windows], name=f"p{p}"), row=2, col=1)
+    for service in report["services"]:
+        fig.add_trace(go.Scatter(x=x, y=[w["services"][service]["cores"] for w in windows],
+                                 name=f"{service} cores"), row=3, col=1)
+        fig.add_trace(go.Scatter(x=x, y=[w["services"][service]["mem_high_water_mb"] for w in windows],
+                                 name=f"{service} memory"), row=4, col=1)
+    fig.update_xaxes(title_text="Seconds since test start", row=4, col=1)
+    fig.update_layout(height=1100, title=f"Load test {report['name'] or ''}".strip())
+    return fig
+
+
+def window_table(report):
+    rows = []
+    for w in report["windows"]:
+        row = {"start_s": w["start_s"], "requests": w["requests"], "errors": w["errors"],
+               "throughput_rps": w["throughput_rps"], "throughput_per_core": w["throughput_per_core"],
+               **{f"latency_{k}": v for k, v in w["latency"].items()}}
+        for service, s in w["services"].items():
+            row[f"{service}_cores"] = s["cores"]
+            row[f"{service}_cpu_s_per_request"] = s["cpu_seconds_per_request"]
+            row[f"{service}_mem_high_water_mb"] = s["mem_high_water_mb"]
+        row["unattributed_requests"] = w["unattributed"]["requests"]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_html(report, fig, path):
+    overall = report["overall"]
+    services = pd.DataFrame(dict(overall["services"], unattributed=overall["unattributed"])).T
+    html = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>Load test report {report['name'] or ''}</title></head><body>",
+        f"<h1>Load test report {report['name'] or ''}</h1>",
+        f"<p>Start {report['test_start']}, {overall['duration_s']:.1f} s, {overall['requests']} requests, "
+        f"{overall['errors']} errors, {overall['throughput_rps']:.2f} requests/s, "
+        f"{overall['throughput_per_core'] or 0:.2f} requests per CPU-second.</p>",
+        "<h2>Services</h2>", services.to_html(float_format=lambda v: f"{v:.4g}"),
+        "<h2>Latency by label</h2>", pd.DataFrame(overall["labels"]).T.to_html(float_format=lambda v: f"{v:.4g}"),
+        "<h2>Windows</h2>", window_table(report).to_html(index=False, float_format=lambda v: f"{v:.4g}"),
+        fig.to_html(full_html=False, include_plotlyjs=True),
+        "</body></html>",
+    ]
+    with open(path, "w") as f:
+        f.write("\n".join(html))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Correlate monitor_v1.py samples with a load test's request log.")
+    parser.add_argument("--monitor", nargs="+", required=True, help="monitor CSV files or globs (msa_metrics*.csv)")
+    parser.add_argument("--jtl", nargs="+", required=True, help="request logs in JMeter CSV format (results.jtl)")
+    parser.add_argument("--window", type=float, default=10.0, help="load window in seconds (0: the whole test)")
+    parser.add_argument("--label-service", nargs="*", default=[], metavar="LABEL=SERVICE",
+                        help="service of requests whose URL port is not monitored, e.g. plot=plotting")
+    parser.add_argument("--clock-offset", type=float, default=0.0, help="seconds added to the monitor timestamps")
+    parser.add_argument("--name", help="name of the setup, e.g. msa or monolith")
+    parser.add_argument("--output", help="write the summary as JSON (default: print it)")
+    parser.add_argument("--html", help="write a static HTML report")
+    parser.add_argument("--png", help="write the report figure as PNG (needs kaleido)")
+    args = parser.parse_args(argv)
+
+    monitor = read_monitor(args.monitor, args.clock_offset)
+    requests = read_jtl(args.jtl)
+    label_service = dict(pair.split("=", 1) for pair in args.label_service)
+    requests["service"] = attribute(requests, monitor, label_service)
+    report = build_report(requests, monitor, args.window, args.name)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.html or args.png:
+        fig = report_figure(report)
+        if args.html:
+            write_html(report, fig, args.html)
+        if args.png:
+            fig.write_image(args.png)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
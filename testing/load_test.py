@@ -0,0 +1,410 @@
+"""
+Load test of the orchestrator workflow (create profile, run, plot) on asyncio,
+the Python replacement for MSA_testing_plan.jmx:
+
+    python testing/load_test.py --local --concurrency 10 --duration 60
+    python testing/load_test.py --rate 5 --workflows 500 --configs client/config1.json=3 client/config2.json
+    python testing/load_test.py --model1-url http://<alb>/model --plotting-url http://<alb>/plotting
+
+--local serves the model and plotting services in this process against the
+in-memory Mongo stand-in, so capacity tests run offline. Without --rate, each
+of the --concurrency workers starts its next workflow when the last one ends
+(like a JMeter thread group); with --rate, workflows arrive as a Poisson
+process and at most --concurrency run at once. Prints per-stage latency
+percentiles, throughput and error rates, and writes them as JSON (--output)
+and every request as a JMeter-style CSV (--jtl).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("create", "run", "plot")
+# Upper bounds (ms) of the latency histogram buckets, the last one is open
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class HttpClient:
+    """Minimal asyncio HTTP/1.1 JSON client keeping connections alive per host."""
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._idle = defaultdict(list)
+
+    async def request(self, method, url, body=None):
+        """Send a JSON request; returns (status, response bytes)."""
+        parts = urlsplit(url)
+        https = parts.scheme == "https"
+        key = (parts.hostname, parts.port or (443 if https else 80), https)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        payload = b"" if body is None else json.dumps(body).encode()
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n").encode()
+        for attempt in range(2):
+            reused = bool(self._idle[key])
+            if reused:
+                reader, writer = self._idle[key].pop()
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(key[0], key[1], ssl=https or None), self.timeout)
+            try:
+                writer.write(head + payload)
+                await writer.drain()
+                status, headers, data = await asyncio.wait_for(self._read_response(reader), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused and attempt == 0:
+                    # The server closed an idle keep-alive connection, retry on a new one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+            else:
+                self._idle[key].append((reader, writer))
+            return status, data
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        version, status = status_line.split()[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            headers["connection"] = "close"
+        if version == b"HTTP/1.0" and headers.get("connection", "").lower() != "keep-alive":
+            headers["connection"] = "close"
+        return int(status), headers, data
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+def load_config_mix(specs):
+    """
+    Configs and weights from PATH[=WEIGHT] specs. A .csv spec lists config
+    paths one per line (like client/config_files.csv); paths that do not exist
+    are looked up by file name next to the list.
+    """
+    mix = []
+    for spec in specs:
+        path, _, weight = spec.partition("=")
+        weight = float(weight) if weight else 1.0
+        if path.endswith(".csv"):
+            with open(path) as f:
+                paths = [row[0].strip() for row in csv.reader(f) if row and row[0].strip()]
+            paths = [p if os.path.exists(p) else os.path.join(os.path.dirname(path), os.path.basename(p))
+                     for p in paths]
+        else:
+            paths = [path]
+        for p in paths:
+            with open(p) as f:
+                mix.append((os.path.basename(p), json.load(f), weight))
+    return mix
+
+
+def latency_summary(latencies):
+    """Percentiles, mean, max (ms) and histogram of a list of latencies in seconds."""
+    if not latencies:
+        return {}
+    ms = np.asarray(latencies) * 1e3
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    counts = np.bincount(np.searchsorted(HISTOGRAM_BUCKETS_MS, ms), minlength=len(HISTOGRAM_BUCKETS_MS) + 1)
+    return {
+        "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+        "mean_ms": float(ms.mean()), "max_ms": float(ms.max()),
+        "histogram": [{"le_ms": le, "count": int(c)} for le, c in zip(HISTOGRAM_BUCKETS_MS + ("inf",), counts)],
+    }
+
+
+class LoadTest:
+    """Runs workflows against the services and records every request."""
+
+    def __init__(self, urls, mix, stages, run_options, seed=0, timeout=60):
+        self.urls = urls
+        self.mix = mix
+        self.stages = stages
+        self.run_options = run_options
+        self.rng = random.Random(seed)
+        self.http = HttpClient(timeout)
+        self.samples = []  # (timestamp, elapsed s, stage, config, status, ok, bytes, worker, active, url)
+        self.workflows = Counter()
+        self.workflow_latencies = []
+        self.active = 0
+
+    def pick_config(self):
+        names, configs, weights = zip(*self.mix)
+        i = self.rng.choices(range(len(names)), weights)[0]
+        return names[i], configs[i]
+
+    async def request(self, stage, name, worker, method, url, body, expected):
+        """Time one request; returns the JSON body, or None if it failed."""
+        timestamp, start = time.time(), time.perf_counter()
+        try:
+            status, data = await self.http.request(method, url, body)
+            result = json.loads(data) if data else {}
+            ok = status in expected
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            status, data, result, ok = type(e).__name__, b"", None, False
+        self.samples.append((timestamp, time.perf_counter() - start, stage, name, status, ok,
+                             len(data), worker, self.active, url))
+        return result if ok else None
+
+    async def run_stage(self, name, worker, model_url, profile_id, config):
+        """Run request as the orchestrator sends it; async configs poll the job until it is done."""
+        body = {"profile_id": profile_id, "dt": config.get("dt", 86400),
+                "steady_state_tol": config.get("steady_state_tol", 1e-12), "max_iter": config.get("max_iter", 10000)}
+        body.update(self.run_options)
+        if config.get("async"):
+            body["async"] = True
+        timestamp, start = time.time(), time.perf_counter()
+        result = await self.request("run", name, worker, "POST", f"{model_url}/bioturbation/run", body, (201, 202))
+        if result is None or "job_id" not in result:
+            return result
+        deadline = start + config.get("poll_timeout", 3600)
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(config.get("poll_interval", 1.0))
+            job = await self.request("poll", name, worker, "GET", f"{model_url}/jobs/{result['job_id']}", None, (200,))
+            if job is None or job["status"] == "failed":
+                break
+            if job["status"] == "done":
+                # The run stage of an async workflow spans submission to job completion
+                self.samples.append((timestamp, time.perf_counter() - start, "run_job", name, 200, True,
+                                     0, worker, self.active, f"{model_url}/jobs/{result['job_id']}"))
+                return job
+        return None
+
+    async def workflow(self, worker, arrived=None):
+        name, config = self.pick_config()
+        start = arrived or time.perf_counter()
+        self.active += 1
+        try:
+            ok = await self._workflow(name, config, worker)
+        finally:
+            self.active -= 1
+        self.workflows["completed" if ok else "failed"] += 1
+        if ok:
+            self.workflow_latencies.append(time.perf_counter() - start)
+
+    async def _workflow(self, name, config, worker):
+        model_url = self.urls.get(config.get("model", "").lower())
+        if model_url is None:
+            return False
+        profile_id, simulation_id = config.get("profile_id"), config.get("simulation_id")
+        if "create" in self.stages:
+            profile = await self.request("create", name, worker, "POST", f"{model_url}/soil-profile", config, (201,))
+            if profile is None:
+                return False
+            profile_id = profile.get("id")
+        if "run" in self.stages:
+            result = await self.run_stage(name, worker, model_url, profile_id, config)
+            if result is None:
+                return False
+            simulation_id = result.get("simulation_id")
+        if "plot" in self.stages:
+            plot = await self.request("plot", name, worker, "POST", f"{self.urls['plotting']}/plot",
+                                      {"simulation_id": simulation_id}, (200,))
+            if plot is None:
+                return False
+        return True
+
+    async def closed_loop(self, concurrency, stop, ramp_up=0.0):
+        """concurrency workers, each starting its next workflow when the last one ends."""
+        async def worker(i):
+            await asyncio.sleep(ramp_up * i / concurrency)
+            while not stop():
+                await self.workflow(f"worker-{i + 1}")
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    async def open_loop(self, rate, concurrency, stop):
+        """Poisson arrivals at rate workflows/s, at most concurrency in flight (the rest queue)."""
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+        arrivals = 0
+
+        async def admitted(arrived, n):
+            async with slots:
+                await self.workflow(f"arrival-{n}", arrived)
+
+        while not stop():
+            arrivals += 1
+            task = asyncio.ensure_future(admitted(time.perf_counter(), arrivals))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            await asyncio.sleep(self.rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+
+    def report(self, elapsed):
+        stages = {}
+        for stage in dict.fromkeys(s[2] for s in self.samples):
+            rows = [s for s in self.samples if s[2] == stage]
+            errors = sum(not s[5] for s in rows)
+            stages[stage] = {
+                "requests": len(rows), "errors": errors, "error_rate": errors / len(rows),
+                "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+                "status_codes": dict(Counter(str(s[4]) for s in rows)),
+                **latency_summary([s[1] for s in rows if s[5]]),
+            }
+        total = self.workflows["completed"] + self.workflows["failed"]
+        report = {
+            "duration_s": elapsed,
+            "workflows": {"started": total, "completed": self.workflows["completed"],
+                          "failed": self.workflows["failed"],
+                          "error_rate": self.workflows["failed"] / total if total else 0.0,
+                          "throughput_per_s": self.workflows["completed"] / elapsed if elapsed else 0.0,
+                          **latency_summary(self.workflow_latencies)},
+            "stages": stages,
+            "configs": dict(Counter(s[3] for s in self.samples if s[2] == "create")),
+        }
+        return report
+
+    def write_jtl(self, path):
+        """Every request in JMeter's CSV result format, for tools that read .jtl files."""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["timeStamp", "elapsed", "label", "responseCode", "responseMessage", "threadName",
+                             "success", "bytes", "allThreads", "URL"])
+            for timestamp, elapsed, stage, name, status, ok, size, worker, active, url in self.samples:
+                writer.writerow([int(timestamp * 1000), round(elapsed * 1000), stage, status, name, worker,
+                                 str(ok).lower(), size, active, url])
+
+
+def start_local_services():
+    """
+    Serve the model and plotting services in background threads against the
+    Mongo stand-in on free local ports. Returns the URLs by model name.
+    """
+    import logging
+    from werkzeug.serving import make_server
+    from mongo_standin import install
+    install()
+    for path in (("microservice",), ("microservice", "model"), ("microservice", "plotting")):
+        sys.path.append(os.path.join(ROOT, *path))
+    import model_1
+    import model_2
+    import plotting
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    urls = {}
+    for name, app, prefix in (("model1", model_1.app, "/model"), ("model2", model_2.app, ""),
+                              ("plotting", plotting.app, "/plotting")):
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls[name] = f"http://127.0.0.1:{server.server_port}{prefix}"
+    return urls
+
+
+def print_report(report):
+    print(f"{'stage':10} {'requests':>9} {'errors':>7} {'err %':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:10} {s['requests']:9d} {s['errors']:7d} {s['error_rate'] * 100:6.1f} "
+              f"{s.get('p50_ms', float('nan')):9.1f} {s.get('p95_ms', float('nan')):9.1f} "
+              f"{s.get('p99_ms', float('nan')):9.1f} {s['throughput_rps']:8.2f}")
+    w = report["workflows"]
+    print(f"Workflows: {w['completed']} completed, {w['failed']} failed in {report['duration_s']:.1f} s "
+          f"({w['throughput_per_s']:.2f}/s, p50 {w.get('p50_ms', float('nan')):.1f} ms, "
+          f"p99 {w.get('p99_ms', float('nan')):.1f} ms)")
+
+
+async def run(args, urls, mix):
+    test = LoadTest(urls, mix, args.stages, json.loads(args.run_options), args.seed, args.timeout)
+    start = time.perf_counter()
+    started = 0
+
+    def stop():
+        nonlocal started
+        if args.duration is not None and time.perf_counter() - start >= args.duration:
+            return True
+        if args.workflows is not None and started >= args.workflows:
+            return True
+        started += 1
+        return False
+
+    try:
+        if args.rate:
+            await test.open_loop(args.rate, args.concurrency, stop)
+        else:
+            await test.closed_loop(args.concurrency, stop, args.ramp_up)
+    finally:
+        test.http.close()
+    return test, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the create profile, run and plot workflow.")
+    parser.add_argument("--configs", nargs="+", metavar="PATH[=WEIGHT]",
+                        default=[os.path.join(ROOT, "client", f"config{i}.json") for i in range(1, 6)],
+                        help="config mix, a .csv lists config paths (default client/config1-5.json, equal weights)")
+    parser.add_argument("--concurrency", type=int, default=10, help="workers, or workflows in flight with --rate")
+    parser.add_argument("--rate", type=float, help="Poisson arrival rate in workflows/s (default: closed loop)")
+    parser.add_argument("--duration", type=float, help="seconds to keep starting workflows")
+    parser.add_argument("--workflows", type=int, help="number of workflows to start")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which closed-loop workers start")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="workflow stages to run")
+    parser.add_argument("--run-options", default="{}", help="JSON merged into every run request, e.g. '{\"cache\": false}'")
+    parser.add_argument("--local", action="store_true", help="serve the services in-process against the Mongo stand-in")
+    parser.add_argument("--model1-url", default=os.getenv("MODEL1_SERVICE_URL", "http://localhost:5001/model"))
+    parser.add_argument("--model2-url", default=os.getenv("MODEL2_SERVICE_URL", "http://localhost:5002"))
+    parser.add_argument("--plotting-url", default=os.getenv("PLOTTING_SERVICE_URL", "http://localhost:5003/plotting"))
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per request (default 60)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the config choice and arrivals")
+    parser.add_argument("--output", help="write the report as JSON")
+    parser.add_argument("--jtl", help="write every request as a JMeter-style CSV")
+    args = parser.parse_args(argv)
+    if args.duration is None and args.workflows is None:
+        args.duration = 60.0
+
+    mix = load_config_mix(args.configs)
+    if args.local:
+        urls = start_local_services()
+    else:
+        urls = {"model1": args.model1_url.rstrip("/"), "model2": args.model2_url.rstrip("/"),
+                "plotting": args.plotting_url.rstrip("/")}
+
+    test, elapsed = asyncio.run(run(args, urls, mix))
+    report = dict(test.report(elapsed), concurrency=args.concurrency, rate=args.rate, stages_run=args.stages)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.jtl:
+        test.write_jtl(args.jtl)
+    return 0 if report["workflows"]["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+In-memory stand-in for MongoDB (mongomock with GridFS), so the services, the
+benchmarks and the load tests run offline. install() has to run before a
+service module is imported, because the services create their MongoClient at
+import time.
+"""
+import functools
+import threading
+import pymongo
+
+_client = None
+# mongomock applies an update by reading and then writing the document, so
+# concurrent requests could both read the same counter; Mongo writes are atomic
+# per document, the stand-in serialises them
+_WRITES = ("insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+           "find_one_and_update", "find_one_and_replace", "find_one_and_delete", "bulk_write")
+_write_lock = threading.RLock()
+
+
+def _serialised(method):
+    @functools.wraps(method)
+    def write(*args, **kwargs):
+        with _write_lock:
+            return method(*args, **kwargs)
+    return write
+
+
+def install():
+    """Make every pymongo.MongoClient(...) return one shared in-memory client, and return it."""
+    global _client
+    if _client is None:
+        try:
+            import mongomock
+            import mongomock.gridfs
+        except ImportError as e:
+            raise ImportError("The Mongo stand-in needs mongomock (pip install -r testing/requirements.txt)") from e
+        mongomock.gridfs.enable_gridfs_integration()
+        for name in _WRITES:
+            setattr(mongomock.Collection, name, _serialised(getattr(mongomock.Collection, name)))
+        _client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: _client
+    return _client
@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "microservice"))
+sys.path.append(os.path.join(ROOT, "microservice", "model"))
+sys.path.append(os.path.join(ROOT, "microservice", "common"))
+sys.path.append(os.path.join(ROOT, "testing"))
+sys.path.append(os.path.join(ROOT, "orchestrator"))
+# Kernels run in the test process, the services are imported against the Mongo stand-in
+os.environ.setdefault("SIMULATION_PROCESSES", "0")
+
+
+@pytest.fixture(scope="session")
+def mongo():
+    """The shared in-memory Mongo stand-in; install it before importing a service."""
+    from mongo_standin import install
+    return install()
+
+
+@pytest.fixture(scope="session")
+def model_1(mongo):
+    import model_1
+    return model_1
+
+
+@pytest.fixture(scope="session")
+def model_2(mongo):
+    import model_2
+    return model_2
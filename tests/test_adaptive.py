@@ -0,0 +1,69 @@
+"""Adaptive mode against step mode on the shipped client configs and a converging Model 2 profile."""
+import json
+from pathlib import Path
+import numpy as np
+import pytest
+from simulation.cli import run_config
+
+CLIENT = Path(__file__).resolve().parents[1] / "client"
+# Model 2 layers with equal boundary values, so the profile reaches steady state
+MODEL_2_CONVERGING = {"model": "Model2", "h": 0.2, "dt": 500 * 86400, "steady_state_tol": 1e-12, "max_iter": 100000,
+                      "layers": [
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 4e-9, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+]}
+
+
+def config(name, **options):
+    return dict(json.loads((CLIENT / f"{name}.json").read_text()), **options)
+
+
+def final(result):
+    return np.asarray(result["history"])[:, -1]
+
+
+def step_and_adaptive(profile, model):
+    return run_config(dict(profile), model), run_config(dict(profile, mode="adaptive"), model)
+
+
+# The step operators of these profiles have a real logarithm, so the adaptive
+# solution passes through the stepped states and converges at the same iteration
+@pytest.mark.parametrize("name", ["config1", "config3", "config5"])
+def test_model_1_adaptive_steady_state_matches_step_mode(name):
+    step, adaptive = step_and_adaptive(config(name), "Model1")
+    tol = config(name)["steady_state_tol"]
+    assert abs(adaptive["iterations"] - step["iterations"]) <= max(1, 0.002 * step["iterations"])
+    np.testing.assert_allclose(final(adaptive), final(step), rtol=0, atol=2 * tol)
+    assert adaptive["solver_steps"] > 0 and adaptive["evaluations"] >= adaptive["solver_steps"]
+
+
+# Very fast mixing: the step operator has negative eigenvalues and the
+# continuous limit is followed, so only the steady state itself agrees
+@pytest.mark.parametrize("name", ["config2", "config4"])
+def test_model_1_fast_mixing_reaches_the_same_steady_state(name):
+    step, adaptive = step_and_adaptive(config(name), "Model1")
+    assert adaptive["iterations"] <= config(name)["max_iter"]
+    np.testing.assert_allclose(final(adaptive), final(step), rtol=0, atol=2 * config(name)["steady_state_tol"])
+
+
+def test_model_1_adaptive_saves_evaluations_on_slow_mixing():
+    step, adaptive = step_and_adaptive(config("config5"), "Model1")
+    assert adaptive["evaluations"] * 10 < step["iterations"]
+
+
+def test_model_2_adaptive_steady_state_matches_step_mode():
+    step, adaptive = step_and_adaptive(MODEL_2_CONVERGING, "Model2")
+    assert abs(adaptive["iterations"] - step["iterations"]) <= 0.005 * step["iterations"]
+    np.testing.assert_allclose(final(adaptive), final(step), rtol=0, atol=2 * MODEL_2_CONVERGING["steady_state_tol"])
+    assert adaptive["evaluations"] * 10 < step["iterations"]
+
+
+@pytest.mark.parametrize("name", ["config1", "config2", "config3", "config4", "config5"])
+def test_model_2_adaptive_saves_evaluations_on_shipped_configs(name):
+    step, adaptive = step_and_adaptive(config(name), "Model2")
+    assert adaptive["iterations"] == step["iterations"] == config(name)["max_iter"]
+    assert adaptive["evaluations"] * 100 < step["iterations"]
+    # Differences are time discretisation error, small against the profile scale
+    np.testing.assert_allclose(final(adaptive), final(step), rtol=0, atol=1e-4 * final(step).max())
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from simulation.history import HISTORY_MAX_SAMPLES, HistoryRecorder, recorder_from_request
+
+
+def feed(recorder, steps):
+    for t in range(steps):
+        recorder.record(t, np.array([float(t), -float(t)]))
+    recorder.finish()
+    return recorder
+
+
+@pytest.mark.parametrize("policy", ["all", "every", "log", "threshold"])
+@pytest.mark.parametrize("max_samples", [2, 3, 10, 64])
+@pytest.mark.parametrize("steps", [1, 2, 10, 11, 1000])
+def test_max_samples_includes_last_step(policy, max_samples, steps):
+    recorder = feed(HistoryRecorder(2, policy=policy, horizon=steps, threshold=0, max_samples=max_samples), steps)
+    assert len(recorder.time_steps) <= max_samples
+    assert recorder.time_steps[0] == 0
+    assert recorder.time_steps[-1] == steps - 1
+    assert recorder.history.shape == (2, len(recorder.time_steps))
+    np.testing.assert_array_equal(recorder.history[0], recorder.time_steps)
+
+
+def test_listed_steps_are_never_dropped():
+    steps = [0, 5, 50, 500, 999]
+    recorder = feed(HistoryRecorder(2, policy="steps", steps=steps, max_samples=len(steps)), 1000)
+    assert recorder.time_steps == steps
+
+
+def test_max_samples_below_listed_steps_is_rejected():
+    with pytest.raises(ValueError):
+        HistoryRecorder(2, policy="steps", steps=[1, 2, 3], max_samples=2)
+
+
+def test_request_history_is_bounded_by_default():
+    recorder = feed(recorder_from_request(None, 2, 10**5), 10**5)
+    assert len(recorder.time_steps) <= HISTORY_MAX_SAMPLES
+    assert recorder.time_steps[-1] == 10**5 - 1
+
+
+def test_buffer_grows_up_to_max_samples():
+    recorder = HistoryRecorder(2, max_samples=10**9)
+    assert recorder._steps.size == 64
+    feed(recorder, 1000)
+    assert recorder.time_steps == list(range(1000))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from pymongo.errors import DuplicateKeyError
+from history_store import (
+    GRIDFS_BUCKET, store_history, encode_history, read_history, read_history_window, read_history_chunks,
+)
+
+
+@pytest.fixture
+def db(mongo):
+    mongo.drop_database("history_store_test")
+    yield mongo["history_store_test"]
+    mongo.drop_database("history_store_test")
+
+
+def history(layers=3, samples=500):
+    return list(range(0, 2 * samples, 2)), np.random.default_rng(0).uniform(0, 1e-9, (layers, samples))
+
+
+def test_large_history_spills_both_arrays(db):
+    time_steps, conc = history()
+    store_history(db, db["plotting"], {"simulation_id": 1}, time_steps, [1, 2, 3], conc, gridfs_threshold=1024)
+    record = db["plotting"].find_one({"simulation_id": 1})
+    assert "time_steps_bin" not in record and "conc_bin" not in record
+    assert {"gridfs_id", "time_steps_gridfs_id"} <= set(record["storage"])
+
+    steps, layer_ids, values = read_history(db, record)
+    np.testing.assert_array_equal(steps, time_steps)
+    np.testing.assert_array_equal(values, conc)
+    steps, layer_ids, values = read_history_window(db, db["plotting"], {"simulation_id": 1},
+                                                   layers=[2], start=100, stop=200, stride=5)
+    np.testing.assert_array_equal(steps, time_steps[50:101:5])
+    np.testing.assert_array_equal(values, conc[1:2, 50:101:5])
+
+
+def test_threshold_counts_time_steps(db):
+    time_steps, conc = history(layers=1, samples=100)
+    # The concentrations alone fit, together with the time steps they do not
+    document = encode_history(db, {}, time_steps, [1], conc, storage="packed", gridfs_threshold=1000)
+    assert "time_steps_gridfs_id" in document["storage"]
+
+
+def test_failed_insert_removes_gridfs_files(db):
+    db["plotting"].create_index("simulation_id", unique=True)
+    time_steps, conc = history()
+    store_history(db, db["plotting"], {"simulation_id": 1}, time_steps, [1, 2, 3], conc, gridfs_threshold=1024)
+    files = db[f"{GRIDFS_BUCKET}.files"].count_documents({})
+    with pytest.raises(DuplicateKeyError):
+        store_history(db, db["plotting"], {"simulation_id": 1}, time_steps, [1, 2, 3], conc, gridfs_threshold=1024)
+    assert db[f"{GRIDFS_BUCKET}.files"].count_documents({}) == files
+
+
+@pytest.mark.parametrize("options", [
+    {"storage": "list"},
+    {"storage": "packed"},
+    {"storage": "packed", "gridfs_threshold": 1024},
+    {"storage": "packed", "compression": "zlib", "gridfs_threshold": 1024},
+])
+@pytest.mark.parametrize("every, chunk", [(1, 1000), (3, 7), (500, 2)])
+def test_chunks_cover_the_stored_history(db, options, every, chunk):
+    if options["storage"] == "list" and every > 1:
+        pytest.skip("mongomock does not implement $range")
+    time_steps, conc = history()
+    store_history(db, db["plotting"], {"simulation_id": 1, "model": "Model1"}, time_steps, [1, 2, 3], conc,
+                  **options)
+    meta, layer_ids, samples, chunks = read_history_chunks(db, db["plotting"], {"simulation_id": 1},
+                                                           every, chunk, fields={"model": 1})
+    chunks = list(chunks)
+    assert meta["model"] == "Model1" and layer_ids == [1, 2, 3]
+    assert samples == len(time_steps[::every])
+    assert len(chunks) == -(-samples // chunk)
+    assert all(len(steps) <= chunk for steps, _ in chunks)
+    np.testing.assert_array_equal(np.concatenate([steps for steps, _ in chunks]), time_steps[::every])
+    np.testing.assert_array_equal(np.concatenate([values for _, values in chunks], axis=1), conc[:, ::every])
+
+
+def test_chunks_of_unknown_simulation(db):
+    assert read_history_chunks(db, db["plotting"], {"simulation_id": 2}) is None
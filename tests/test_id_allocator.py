@@ -0,0 +1,72 @@
+import threading
+import pytest
+from pymongo.errors import DuplicateKeyError
+from id_allocator import IdAllocator
+
+
+@pytest.fixture
+def db(mongo):
+    db = mongo["id_allocator_test"]
+    for name in ("counters", "profiles"):
+        db[name].drop()
+    yield db
+    for name in ("counters", "profiles"):
+        db[name].drop()
+
+
+def allocator(db):
+    return IdAllocator(db["counters"], "profile_id", db["profiles"], "profile.id")
+
+
+def test_reserve_returns_consecutive_blocks(db):
+    ids = allocator(db)
+    assert ids.reserve(3) == 1
+    assert ids.next_id() == 4
+    assert ids.reserve(5) == 5
+    assert ids.next_id() == 10
+    with pytest.raises(ValueError):
+        ids.reserve(0)
+
+
+def test_counter_is_seeded_from_the_highest_stored_id(db):
+    db["profiles"].insert_many([{"profile": {"id": 7}}, {"profile": {"id": 41}}, {"other": 1}])
+    assert allocator(db).next_id() == 42
+    # A second allocator, e.g. another replica, continues from the shared counter
+    assert allocator(db).next_id() == 43
+
+
+def test_unique_index_rejects_duplicate_ids(db):
+    ids = allocator(db)
+    profile_id = ids.next_id()
+    db["profiles"].insert_one({"profile": {"id": profile_id}})
+    with pytest.raises(DuplicateKeyError):
+        db["profiles"].insert_one({"profile": {"id": profile_id}})
+
+
+def test_insert_many_reports_duplicates_per_document(db):
+    ids = allocator(db)
+    assert ids.next_id() == 1
+    db["profiles"].insert_one({"profile": {"id": 3}})  # written behind the counter's back
+    assigned, failures = ids.insert_many([{"name": "a"}, {"name": "b"}, {"name": "c"}])
+    assert assigned == [2, 3, 4]
+    assert list(failures) == [1]
+    assert db["profiles"].count_documents({}) == 3
+
+
+def test_concurrent_allocations_are_distinct(db):
+    ids = allocator(db)
+    allocated, lock = [], threading.Lock()
+
+    def allocate():
+        mine = [ids.next_id() for _ in range(50)] + [ids.reserve(3)]
+        with lock:
+            allocated.extend(mine)
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(allocated)) == len(allocated) == 8 * 51
+    # Every reserved block is used up: 50 single IDs and one block of 3 per thread
+    assert db["counters"].find_one({"_id": "profile_id"})["seq"] == 8 * 53
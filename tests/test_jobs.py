@@ -0,0 +1,155 @@
+"""The in-process job queue, the job routes and the orchestrator's polling."""
+import threading
+import time
+import pytest
+from jobs import JobQueue
+from job_polling import run_simulation, wait_for_job
+
+PROFILE = {"model": "Model1", "layers": [
+    {"depth": 0.1, "initial_conc": 4e-9, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+]}
+
+
+def wait_until_finished(jobs, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while jobs.status(job_id)["status"] not in ("done", "failed"):
+        assert time.monotonic() < deadline, jobs.status(job_id)
+        time.sleep(0.01)
+    return jobs.status(job_id)
+
+
+def test_job_moves_from_queued_to_running_to_done():
+    jobs = JobQueue(max_workers=1)
+    release_first, release_second, started = threading.Event(), threading.Event(), threading.Event()
+
+    def first():
+        release_first.wait(10)
+        return {"message": "first"}, 201
+
+    def second():
+        started.set()
+        release_second.wait(10)
+        return {"simulation_id": 7}, 201
+
+    first_id, second_id = jobs.submit(first), jobs.submit(second)
+    assert jobs.status(second_id) == {"job_id": second_id, "status": "queued"}
+    release_first.set()
+    assert started.wait(10)
+    assert jobs.status(second_id)["status"] == "running"
+    release_second.set()
+    done = wait_until_finished(jobs, second_id)
+    assert done["status"] == "done" and done["simulation_id"] == 7 and done["result"] == {"simulation_id": 7}
+    assert wait_until_finished(jobs, first_id)["result"] == {"message": "first"}
+
+
+def test_job_fails_on_error_status_and_on_exceptions():
+    jobs = JobQueue(max_workers=1)
+
+    def raises():
+        raise RuntimeError("worker lost")
+
+    rejected = jobs.submit(lambda: ({"error": "Soil profile not found"}, 404))
+    crashed = jobs.submit(raises)
+    assert wait_until_finished(jobs, rejected) == {
+        "job_id": rejected, "status": "failed", "error": "Soil profile not found"}
+    assert wait_until_finished(jobs, crashed)["error"] == "worker lost"
+
+
+def test_only_the_newest_finished_jobs_are_kept():
+    jobs = JobQueue(max_workers=1, max_finished=2)
+    ids = [jobs.submit(lambda: ({}, 201)) for _ in range(3)]
+    wait_until_finished(jobs, ids[-1])
+    assert jobs.status(ids[0]) is None
+    assert all(jobs.status(job_id)["status"] == "done" for job_id in ids[1:])
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_async_run_returns_a_job_to_poll(request, service, prefix):
+    module = request.getfixturevalue(service)
+    client = module.app.test_client()
+    profile_id = client.post(f"{prefix}/soil-profile", json=PROFILE).json["id"]
+    response = client.post(f"{prefix}/bioturbation/run",
+                           json={"profile_id": profile_id, "max_iter": 50, "async": True, "cache": False})
+    assert response.status_code == 202
+    assert response.json["status"] == "queued"
+    job = wait_until_finished(module.jobs, response.json["job_id"])
+    polled = client.get(f"{prefix}/jobs/{job['job_id']}")
+    assert polled.status_code == 200 and polled.json == job
+    assert job["status"] == "done"
+    assert client.get(f"{prefix}/bioturbation/history/{job['simulation_id']}").status_code == 200
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_unknown_job_is_not_found(request, service, prefix):
+    response = request.getfixturevalue(service).app.test_client().get(f"{prefix}/jobs/unknown")
+    assert response.status_code == 404
+    assert response.json == {"error": "Job not found"}
+
+
+class FlaskHttp:
+    """post/get like the requests module, sent to a Flask test client."""
+
+    def __init__(self, client, base_url):
+        self.client = client
+        self.base_url = base_url
+
+    def post(self, url, json):
+        return Response(self.client.post(url[len(self.base_url):], json=json))
+
+    def get(self, url):
+        return Response(self.client.get(url[len(self.base_url):]))
+
+
+class Response:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.body = response.json
+
+    def json(self):
+        return self.body
+
+
+def test_orchestrator_polls_an_async_run_to_its_simulation(model_1):
+    client = model_1.app.test_client()
+    profile_id = client.post("/model/soil-profile", json=PROFILE).json["id"]
+    http = FlaskHttp(client, "http://model-1")
+    simulation_id, error = run_simulation(
+        "http://model-1/model", {"profile_id": profile_id, "max_iter": 50, "cache": False},
+        {"async": True, "poll_interval": 0.01, "poll_timeout": 10}, http=http,
+    )
+    assert error is None
+    assert client.get(f"/model/bioturbation/history/{simulation_id}").status_code == 200
+
+
+def test_orchestrator_reports_a_failed_job(model_1):
+    http = FlaskHttp(model_1.app.test_client(), "http://model-1")
+    simulation_id, error = run_simulation(
+        "http://model-1/model", {"profile_id": 10**9}, {"async": True, "poll_interval": 0.01}, http=http,
+    )
+    assert simulation_id is None and error == "Soil profile not found"
+
+
+def test_orchestrator_poll_times_out():
+    class Queued:
+        status_code = 200
+
+        def json(self):
+            return {"job_id": "slow", "status": "running"}
+
+    class Http:
+        gets = 0
+
+        def get(self, url):
+            Http.gets += 1
+            return Queued()
+
+    job = wait_for_job("http://model-1/model", "slow", poll_interval=0.01, timeout=0.05, http=Http())
+    assert job == {"job_id": "slow", "status": "failed", "error": "Timed out after 0.05 s"}
+    assert Http.gets >= 2
+
+
+def test_orchestrator_poll_of_unknown_job_fails(model_1):
+    http = FlaskHttp(model_1.app.test_client(), "http://model-1")
+    job = wait_for_job("http://model-1/model", "unknown", poll_interval=0.01, timeout=1, http=http)
+    assert job == {"job_id": "unknown", "status": "failed", "error": {"error": "Job not found"}}
@@ -0,0 +1,117 @@
+"""testing/load_test.py's HttpClient against a scripted local HTTP server."""
+import asyncio
+import json
+from load_test import HttpClient
+
+
+async def serve(responses, close_after=()):
+    """
+    Start a server on a free port that answers the n-th request with responses[n]
+    (raw bytes), closing the connection after it for n in close_after, and return
+    (server, url, log), where log lists (connection number, request line, body)
+    for every request.
+    """
+    log, connections = [], []
+
+    async def handle(reader, writer):
+        connection = len(connections)
+        connections.append(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                log.append((connection, request_line.decode().strip(), body))
+                response = responses[len(log) - 1]
+                writer.write(response)
+                await writer.drain()
+                if b"Connection: close" in response or response.startswith(b"HTTP/1.0") or len(log) - 1 in close_after:
+                    break
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}", log
+
+
+def response(body, status="200 OK", headers=""):
+    return f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n{headers}\r\n".encode() + body
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+
+def test_json_body_is_sent_and_connections_are_reused():
+    async def scenario():
+        server, url, log = await serve([response(b'{"id": 1}', "201 CREATED"), response(b"[]"), response(b"{}")])
+        client = HttpClient(timeout=5)
+        first = await client.request("POST", f"{url}/model/soil-profile", {"layers": []})
+        second = await client.request("GET", f"{url}/model/soil-profile/1?full=1")
+        third = await client.request("GET", f"{url}/model")
+        client.close()
+        server.close()
+        return first, second, third, log
+
+    first, second, third, log = run(scenario())
+    assert first == (201, b'{"id": 1}') and second == (200, b"[]") and third == (200, b"{}")
+    assert [(connection, line) for connection, line, _ in log] == [
+        (0, "POST /model/soil-profile HTTP/1.1"), (0, "GET /model/soil-profile/1?full=1 HTTP/1.1"),
+        (0, "GET /model HTTP/1.1")]
+    assert json.loads(log[0][2]) == {"layers": []} and log[1][2] == b""
+
+
+def test_chunked_response_is_reassembled():
+    chunked = (b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+               b"5\r\n{\"a\":\r\n4;ext=1\r\n 12}\r\n0\r\nTrailer: x\r\n\r\n")
+
+    async def scenario():
+        server, url, log = await serve([chunked, response(b"ok")])
+        client = HttpClient(timeout=5)
+        results = [await client.request("GET", f"{url}/stream"), await client.request("GET", f"{url}/next")]
+        client.close()
+        server.close()
+        return results, log
+
+    results, log = run(scenario())
+    assert results == [(200, b'{"a": 12}'), (200, b"ok")]
+    # The trailer was consumed, so the connection stays usable
+    assert [connection for connection, _, _ in log] == [0, 0]
+
+
+def test_connection_close_and_unframed_responses_open_a_new_connection():
+    unframed = b"HTTP/1.0 200 OK\r\n\r\nuntil the end"
+
+    async def scenario():
+        server, url, log = await serve([response(b"a", headers="Connection: close\r\n"), unframed, response(b"c")])
+        client = HttpClient(timeout=5)
+        results = [await client.request("GET", f"{url}/{i}") for i in range(3)]
+        client.close()
+        server.close()
+        return results, log
+
+    results, log = run(scenario())
+    assert results == [(200, b"a"), (200, b"until the end"), (200, b"c")]
+    assert [connection for connection, _, _ in log] == [0, 1, 2]
+
+
+def test_idle_connection_closed_by_the_server_is_retried():
+    async def scenario():
+        # The server closes the kept-alive connection after the first answer, as on an idle timeout
+        server, url, log = await serve([response(b"a"), response(b"b")], close_after={0})
+        client = HttpClient(timeout=5)
+        first = await client.request("GET", f"{url}/a")
+        second = await client.request("GET", f"{url}/b")
+        client.close()
+        server.close()
+        return first, second, log
+
+    first, second, log = run(scenario())
+    assert first == (200, b"a") and second == (200, b"b")
+    assert [connection for connection, _, _ in log] == [0, 1]
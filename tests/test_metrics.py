@@ -0,0 +1,107 @@
+"""The /metrics endpoint in the Prometheus text exposition format."""
+import re
+import pytest
+import metrics
+from metrics import MongoCommandTimer, STAGE_SECONDS, timed
+
+SERIES = ("bioturbation_stage_seconds", "bioturbation_simulation_iterations",
+          "bioturbation_mongo_command_seconds", "bioturbation_http_request_seconds")
+NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+LABEL = rf'{NAME}="(?:[^"\\\n]|\\.)*"'
+SAMPLE = re.compile(rf"({NAME})(?:\{{((?:{LABEL})(?:,{LABEL})*)\}})? (\S+)")
+
+
+def parse(text):
+    """
+    Check text against the exposition format and return {family: {labels: {sample name: value}}},
+    with the le label kept in the sample name of bucket samples.
+    """
+    assert text.endswith("\n")
+    families, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name = line.split(" ")[2]
+            assert re.fullmatch(NAME, name) and name not in families
+            families[name] = {}
+        elif line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name in families and kind == "histogram"
+            types[name] = kind
+        else:
+            match = SAMPLE.fullmatch(line)
+            assert match, line
+            name, labels, value = match.groups()
+            family = re.sub(r"_(bucket|sum|count)$", "", name)
+            assert family in types, line
+            labels = dict(re.findall(rf'({NAME})="((?:[^"\\\n]|\\.)*)"', labels or ""))
+            le = labels.pop("le", None)
+            assert (le is not None) == name.endswith("_bucket"), line
+            key = tuple(sorted(labels.items()))
+            families[family].setdefault(key, {})[f"{name}:{le}" if le else name] = float(value)
+    return families
+
+
+def check_histograms(families):
+    for family, series in families.items():
+        for samples in series.values():
+            buckets = [(k.split(":", 1)[1], v) for k, v in samples.items() if k.startswith(family + "_bucket")]
+            bounds = [float(le) for le, _ in buckets]
+            counts = [count for _, count in buckets]
+            assert buckets[-1][0] == "+Inf" and bounds == sorted(bounds)
+            assert counts == sorted(counts), "buckets are cumulative"
+            assert samples[family + "_count"] == counts[-1]
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    for histogram in metrics.HISTOGRAMS:
+        monkeypatch.setattr(histogram, "_series", {})
+    return metrics
+
+
+def test_metrics_endpoint_renders_the_four_series(fresh_metrics, model_1):
+    client = model_1.app.test_client()
+    profile_id = client.post("/model/soil-profile", json={"model": "Model1", "layers": [
+        {"depth": 0.1, "initial_conc": 4e-9, "earthworm_density": 20, "beta": 1e-8},
+        {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+    ]}).json["id"]
+    client.post("/model/bioturbation/run", json={"profile_id": profile_id, "max_iter": 50, "cache": False})
+    # mongomock sends no command events, feed the listener as the driver would
+    timer = MongoCommandTimer()
+    timer.succeeded(type("Event", (), {"duration_micros": 1500, "command_name": "find"})())
+    timer.failed(type("Event", (), {"duration_micros": 20, "command_name": "insert"})())
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    families = parse(response.get_data(as_text=True))
+    assert set(SERIES) <= set(families)
+    check_histograms(families)
+
+    assert (("kind", "run"), ("mode", "step")) in families["bioturbation_simulation_iterations"]
+    assert (("stage", "simulation"),) in families["bioturbation_stage_seconds"]
+    mongo = families["bioturbation_mongo_command_seconds"]
+    assert mongo[(("command", "find"), ("outcome", "success"))]["bioturbation_mongo_command_seconds_sum"] == 0.0015
+    assert (("command", "insert"), ("outcome", "failure")) in mongo
+    requests = families["bioturbation_http_request_seconds"]
+    run = (("endpoint", "/model/bioturbation/run"), ("method", "POST"), ("status", "201"))
+    assert requests[run]["bioturbation_http_request_seconds_count"] == 1
+    assert not any(dict(key)["endpoint"] == "/metrics" for key in requests)
+
+
+def test_label_values_are_escaped(fresh_metrics):
+    STAGE_SECONDS.observe(0.1, 'quote " and \\ and \n')
+    families = parse(fresh_metrics.render())
+    assert (("stage", 'quote \\" and \\\\ and \\n'),) in families["bioturbation_stage_seconds"]
+
+
+def test_metrics_off_disables_recording(fresh_metrics, monkeypatch, model_1):
+    monkeypatch.setattr(fresh_metrics, "METRICS", "off")
+    with timed("simulation"):
+        pass
+    client = model_1.app.test_client()
+    client.get("/model")
+    MongoCommandTimer().succeeded(type("Event", (), {"duration_micros": 1500, "command_name": "find"})())
+    families = parse(client.get("/metrics").get_data(as_text=True))
+    assert set(families) == set(SERIES)
+    assert all(series == {} for series in families.values())
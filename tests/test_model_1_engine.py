@@ -0,0 +1,59 @@
+"""The matrix engine and the fast-forward mode of Model 1 against the reference layer loop."""
+import numpy as np
+import pytest
+from simulation.kernels import model_1_kernel
+from simulation.profiles import process_model_1_layers, model_1_run_params
+
+PROFILES = {
+    "top": [(0.1, 4e-9, 20, 1e-8)] + [(0.1, 0, 20, 1e-8)] * 3,
+    "mixed": [(0.2, 5e-9, 15, 5e-8), (0.2, 1e-9, 10, 4e-8), (0.3, 0, 25, 2e-8), (0.1, 2e-9, 5, 1e-8)],
+    "random": [tuple(row) for row in np.column_stack((
+        np.random.default_rng(1).uniform(0.05, 0.3, 12), np.r_[4e-9, np.zeros(11)],
+        np.random.default_rng(2).uniform(5, 25, 12), np.random.default_rng(3).uniform(0.5e-8, 5e-8, 12),
+    ))],
+}
+
+
+def run(profile, **options):
+    layers, error = process_model_1_layers({"layers": [
+        {"depth": depth, "initial_conc": conc, "earthworm_density": density, "beta": beta}
+        for depth, conc, density, beta in PROFILES[profile]
+    ]})
+    assert error is None
+    request = {"steady_state_tol": 1e-12, "max_iter": 5000, **options}
+    return model_1_kernel(model_1_run_params(layers, request))
+
+
+def assert_same_run(result, reference, rtol=1e-9):
+    assert result["iterations"] == reference["iterations"]
+    assert result["time_steps"] == reference["time_steps"]
+    scale = np.abs(reference["history"]).max()
+    np.testing.assert_allclose(result["history"], reference["history"], rtol=rtol, atol=rtol * scale)
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_matrix_engine_matches_loop(profile):
+    assert_same_run(run(profile, engine="matrix"), run(profile))
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_fast_forward_matches_loop(profile):
+    assert_same_run(run(profile, mode="fast-forward"), run(profile))
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_sampled_history_matches_loop(profile):
+    history = {"policy": "log", "points": 50}
+    reference = run(profile, history=history)
+    assert_same_run(run(profile, engine="matrix", history=history), reference)
+    assert_same_run(run(profile, mode="fast-forward", history=history), reference)
+
+
+def test_fast_forward_output_steps_match_loop():
+    reference = run("random")
+    t = reference["iterations"]
+    steps = [0, 1, t // 10, t // 2, t]
+    result = run("random", mode="fast-forward", output_steps=steps)
+    assert result["time_steps"] == steps
+    expected = reference["history"][:, [reference["time_steps"].index(step) for step in steps]]
+    np.testing.assert_allclose(result["history"], expected, rtol=1e-9, atol=1e-9 * np.abs(expected).max())
@@ -0,0 +1,103 @@
+"""The vectorized Model 2 stencil, the implicit solvers and the fast-forward mode against reference implementations."""
+import numpy as np
+import pytest
+from simulation.engine import MODEL_2_SOLVERS, model_2_grid, model_2_layer_operator, model_2_step_operator
+from simulation.kernels import model_2_kernel, model_2_batch_kernel
+from simulation.profiles import process_model_2_layers, model_2_run_params
+
+PROFILES = {
+    # Equal boundary values, so the layers reach steady state
+    "middle": [(0.1, 0, 20, 1e-8), (0.1, 4e-9, 20, 1e-8), (0.1, 0, 20, 1e-8), (0.1, 0, 20, 1e-8)],
+    # Layer boundaries inside grid cells and a layer thinner than a cell
+    "uneven": [(0.13, 5e-9, 15, 5e-8), (0.02, 1e-9, 10, 4e-8), (0.25, 0, 25, 2e-8), (0.1, 2e-9, 5, 1e-8)],
+}
+# dt of 5000 days keeps the explicit scheme stable on a 10-cell grid of these profiles
+REQUEST = {"dt": 5000 * 86400, "steady_state_tol": 1e-12, "max_iter": 3000, "Nx": 10,
+           "history": {"policy": "all", "max_samples": 3001}}
+
+
+def kernel_params(profile, **options):
+    layers, error = process_model_2_layers({"layers": [
+        {"depth": depth, "initial_conc": conc, "earthworm_density": density, "beta": beta}
+        for depth, conc, density, beta in PROFILES[profile]
+    ]})
+    assert error is None
+    return model_2_run_params(layers, dict(REQUEST, **options))
+
+
+def reference_run(params, stepper):
+    """Step the grid with stepper(D, r)(C) and record the dense layer means, as the original loop did."""
+    depths, Nx, Nt = params["depths"], params["Nx"], params["max_iter"]
+    C, Dx = model_2_grid(depths, params["conc"], Nx)
+    D, _ = model_2_grid(depths, params["diffusion_coeffs"], Nx)
+    M = model_2_layer_operator(depths, Nx).toarray()
+    step = stepper(D, params["dt"] / Dx**2)
+    history = []
+    for n in range(Nt):
+        C = step(C)
+        history.append(M @ C)
+        if history[-1].max() - history[-1].min() <= params["tol"]:
+            return n + 1, np.array(history).T
+    return Nt, np.array(history).T
+
+
+def loop_stepper(D, r):
+    """The original explicit point loop."""
+    def step(C):
+        C_new = C.copy()
+        for i in range(1, len(C) - 1):
+            D_ip = (D[i] + D[i + 1]) / 2
+            D_im = (D[i] + D[i - 1]) / 2
+            C_new[i] = C[i] + r * (D_ip * (C[i + 1] - C[i]) - D_im * (C[i] - C[i - 1]))
+        return C_new
+    return step
+
+
+def operator_stepper(solver):
+    """A step with the dense operator B of model_2_step_operator."""
+    def stepper(D, r):
+        B = model_2_step_operator(D, r, 1.0, solver)
+        return lambda C: B @ C
+    return stepper
+
+
+def assert_same_run(result, iterations, history, rtol=1e-9):
+    assert result["iterations"] == iterations
+    assert result["time_steps"] == list(range(history.shape[1]))
+    np.testing.assert_allclose(result["history"], history, rtol=rtol, atol=rtol * np.abs(history).max())
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_vectorized_stencil_matches_loop(profile):
+    params = kernel_params(profile)
+    assert_same_run(model_2_kernel(params), *reference_run(params, loop_stepper))
+
+
+@pytest.mark.parametrize("solver", sorted(MODEL_2_SOLVERS))
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_solvers_match_dense_operator(profile, solver):
+    params = kernel_params(profile, solver=solver)
+    assert_same_run(model_2_kernel(params), *reference_run(params, operator_stepper(solver)))
+
+
+@pytest.mark.parametrize("solver", sorted(MODEL_2_SOLVERS))
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_fast_forward_matches_stepping(profile, solver):
+    stepped = model_2_kernel(kernel_params(profile, solver=solver))
+    assert_same_run(model_2_kernel(kernel_params(profile, solver=solver, mode="fast-forward")),
+                    stepped["iterations"], stepped["history"])
+
+
+def test_batch_matches_single_runs():
+    singles = [kernel_params(profile) for profile in sorted(PROFILES)]
+    batch = model_2_batch_kernel({
+        "depths": [params["depths"] for params in singles], "conc": [params["conc"] for params in singles],
+        "diffusion_coeffs": [params["diffusion_coeffs"] for params in singles],
+        "dt": singles[0]["dt"], "tol": REQUEST["steady_state_tol"], "max_iter": REQUEST["max_iter"],
+        "Nx": REQUEST["Nx"], "history": REQUEST["history"],
+    })
+    for params, iterations, (time_steps, history) in zip(singles, batch["iterations"], batch["histories"]):
+        single = model_2_kernel(params)
+        assert iterations == single["iterations"]
+        assert time_steps == single["time_steps"]
+        np.testing.assert_allclose(history, single["history"], rtol=1e-9, atol=1e-9 * np.abs(history).max())
@@ -0,0 +1,211 @@
+"""Model services imported as modules and driven through Flask test clients, against the Mongo stand-in."""
+import math
+import re
+import flask
+import pytest
+from mongo_schema import INDEXES, bootstrap_indexes
+from result_cache import bump_cache_generation
+from simulation.history import HISTORY_MAX_SAMPLES
+
+
+def unique_keys(collection):
+    return {tuple(info["key"]) for info in collection.index_information().values() if info.get("unique")}
+
+
+def test_indexes_are_created_before_the_first_request(mongo):
+    for db_name, collection_name in INDEXES:
+        mongo[db_name][collection_name].drop_indexes()
+    app = flask.Flask(__name__)
+    app.add_url_rule("/", "index", lambda: "")
+    bootstrap_indexes(app, mongo)
+    app.test_client().get("/")
+    for (db_name, collection_name), indexes in INDEXES.items():
+        assert {tuple(keys) for keys, _ in indexes} <= unique_keys(mongo[db_name][collection_name])
+
+
+@pytest.mark.parametrize("service", ["model_1", "model_2"])
+def test_imported_services_bootstrap_indexes(request, service):
+    app = request.getfixturevalue(service).app
+    assert any(hook.__name__ == "ensure_indexes_once" for hook in app.before_request_funcs[None])
+
+
+PROFILE = {"model": "Model1", "layers": [
+    {"depth": 0.1, "initial_conc": 4e-9, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+]}
+
+
+def reset_databases(mongo):
+    """What database/database_initialize.py clears."""
+    for db_name, collection_name in (("soil_database", "soil_profiles"), ("soil_database", "counters"),
+                                     ("plotting_database", "plotting"), ("plotting_database", "simulation_cache"),
+                                     ("plotting_database", "sweeps"), ("plotting_database", "counters")):
+        mongo[db_name][collection_name].delete_many({})
+    bump_cache_generation(mongo["plotting_database"])
+
+
+def test_result_cache_does_not_survive_a_database_reset(mongo, model_1, monkeypatch):
+    monkeypatch.setattr(model_1.result_cache, "check_seconds", 0)
+    monkeypatch.setattr(model_1.result_cache, "next_check", 0.0)
+    client = model_1.app.test_client()
+    run = {"max_iter": 100, "steady_state_tol": 1e-12}
+    reset_databases(mongo)
+    profile_id = client.post("/model/soil-profile", json=PROFILE).json["id"]
+    first = client.post("/model/bioturbation/run", json=dict(run, profile_id=profile_id)).json
+    assert client.post("/model/bioturbation/run", json=dict(run, profile_id=profile_id)).json["cached"]
+
+    reset_databases(mongo)
+    profile_id = client.post("/model/soil-profile", json=PROFILE).json["id"]
+    after_reset = client.post("/model/bioturbation/run", json=dict(run, profile_id=profile_id)).json
+    assert "cached" not in after_reset
+    assert after_reset["simulation_id"] == first["simulation_id"]
+    assert mongo["plotting_database"]["plotting"].count_documents({}) == 1
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_sweep_with_fewer_points_than_processes(request, monkeypatch, service, prefix):
+    module = request.getfixturevalue(service)
+    # Chunked as for 4 worker processes, the kernels still run in the test process
+    monkeypatch.setattr(module.routes, "processes", 4)
+    client = module.app.test_client()
+    profile_id = client.post(f"{prefix}/soil-profile", json=PROFILE).json["id"]
+    response = client.post(f"{prefix}/bioturbation/sweep",
+                           json={"profile_id": profile_id, "max_iter": 100, "parameters": {"beta": [1e-8]}})
+    assert response.status_code == 201, response.json
+    assert response.json["points"] == 1
+
+
+@pytest.mark.parametrize("service, prefix, options", [
+    ("model_1", "/model", {"mode": "adaptive"}),
+    ("model_2", "", {"mode": "fast-forward"}),
+    ("model_2", "", {"solver": "crank-nicolson"}),
+])
+def test_batch_rejects_unsupported_run_options(request, service, prefix, options):
+    client = request.getfixturevalue(service).app.test_client()
+    response = client.post(f"{prefix}/bioturbation/run/batch",
+                           json=dict(options, profiles=[PROFILE], max_iter=10))
+    assert response.status_code == 400
+    assert "only support" in response.json["error"]
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_batch_and_sweep_routes_are_shared(request, service, prefix):
+    client = request.getfixturevalue(service).app.test_client()
+    profile_id = client.post(f"{prefix}/soil-profile", json=PROFILE).json["id"]
+    batch = client.post(f"{prefix}/bioturbation/run/batch",
+                        json={"profile_ids": [profile_id, 10**9], "max_iter": 50})
+    assert batch.status_code == 201
+    assert [result["profile_id"] for result in batch.json["results"]] == [profile_id]
+    assert batch.json["errors"] == [{"index": 1, "profile_id": 10**9, "error": "Soil profile not found"}]
+
+    sweep = client.post(f"{prefix}/bioturbation/sweep",
+                        json={"profile_id": profile_id, "max_iter": 50, "parameters": {"beta": [1e-8, 2e-8]}})
+    stored = client.get(f"{prefix}/bioturbation/sweep/{sweep.json['sweep_id']}").json
+    assert stored["points"] == 2 and stored["profile_id"] == profile_id
+    assert client.get(f"{prefix}/cache/stats").status_code == 200
+
+
+@pytest.mark.parametrize("service, prefix, options", [
+    ("model_1", "/model", {"engine": "matrix"}),
+    ("model_2", "", {"mode": "fast-forward"}),
+])
+def test_single_run_history_is_bounded(request, mongo, service, prefix, options):
+    client = request.getfixturevalue(service).app.test_client()
+    profile_id = client.post(f"{prefix}/soil-profile", json=PROFILE).json["id"]
+    run = client.post(f"{prefix}/bioturbation/run", json=dict(
+        options, profile_id=profile_id, max_iter=10**5, steady_state_tol=0, cache=False,
+    )).json
+    window = client.get(f"{prefix}/bioturbation/history/{run['simulation_id']}/window").json
+    assert len(window["time_steps"]) <= HISTORY_MAX_SAMPLES
+    assert window["time_steps"][-1] >= 10**5 - 1
+
+
+MODEL_2_PROFILE = dict(PROFILE, model="Model2", h=0.2)
+
+
+def stable_dt(error):
+    return float(re.search(r"use dt <= ([0-9.e+]+) s", error).group(1))
+
+
+def test_unstable_explicit_grid_is_rejected(model_2):
+    client = model_2.app.test_client()
+    profile_id = client.post("/soil-profile", json=MODEL_2_PROFILE).json["id"]
+    for grid in ({"Nx": 2000}, {"dx": 1e-4}):
+        response = client.post("/bioturbation/run", json=dict(grid, profile_id=profile_id, max_iter=50))
+        assert response.status_code == 400
+        assert "unstable" in response.json["error"]
+
+    # At the largest stable dt the fine grid runs and stays finite
+    dt = stable_dt(client.post("/bioturbation/run", json={"profile_id": profile_id, "Nx": 2000}).json["error"])
+    run = client.post("/bioturbation/run", json={"profile_id": profile_id, "Nx": 2000, "dt": dt, "max_iter": 50})
+    assert run.status_code == 201
+    window = client.get(f"/bioturbation/history/{run.json['simulation_id']}/window").json
+    assert all(math.isfinite(value) for layer in window["layers"] for value in layer["conc"])
+
+    implicit = client.post("/bioturbation/run", json={"profile_id": profile_id, "Nx": 2000, "max_iter": 50,
+                                                       "solver": "backward-euler"})
+    assert implicit.status_code == 201
+
+
+def test_unstable_explicit_batch_and_sweep_are_rejected(model_2):
+    client = model_2.app.test_client()
+    batch = client.post("/bioturbation/run/batch", json={
+        "profiles": [MODEL_2_PROFILE, dict(MODEL_2_PROFILE, layers=[dict(layer, depth=10) for layer in PROFILE["layers"]])],
+        "Nx": 2000, "max_iter": 10,
+    })
+    assert batch.status_code == 201
+    assert [result["index"] for result in batch.json["results"]] == [1]
+    assert batch.json["errors"][0]["index"] == 0 and "unstable" in batch.json["errors"][0]["error"]
+
+    sweep = client.post("/bioturbation/sweep", json={
+        "profile": MODEL_2_PROFILE, "max_iter": 10, "parameters": {"dt": [3600, 86400 * 365 * 1000]},
+    })
+    assert sweep.status_code == 400
+    assert "unstable for 1 of the 2 sweep points" in sweep.json["error"]
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_adaptive_run_reports_solver_work(request, service, prefix):
+    client = request.getfixturevalue(service).app.test_client()
+    profile_id = client.post(f"{prefix}/soil-profile", json=PROFILE).json["id"]
+    response = client.post(f"{prefix}/bioturbation/run",
+                           json={"profile_id": profile_id, "mode": "adaptive", "max_iter": 500, "cache": False})
+    assert response.status_code == 201, response.json
+    assert response.json["evaluations"] >= response.json["solver_steps"] > 0
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_bulk_create_mixes_validation_errors_with_created_profiles(request, service, prefix):
+    client = request.getfixturevalue(service).app.test_client()
+    no_beta = {"model": "Model1", "layers": [{"depth": 0.1, "initial_conc": 0, "earthworm_density": 20}]}
+    response = client.post(f"{prefix}/soil-profile/batch",
+                           json={"profiles": [PROFILE, {"model": "Model1"}, PROFILE, no_beta]})
+    assert response.status_code == 201
+    ids = response.json["ids"]
+    assert ids[1] is None and ids[3] is None and ids[2] == ids[0] + 1
+    assert response.json["errors"] == [{"index": 1, "error": "Missing layers"},
+                                       {"index": 3, "error": "Missing required fields"}]
+    for profile_id in (ids[0], ids[2]):
+        stored = client.get(f"{prefix}/soil-profile/{profile_id}").json
+        assert [layer["id"] for layer in stored["layers"]] == [1, 2]
+
+
+@pytest.mark.parametrize("service, prefix", [("model_1", "/model"), ("model_2", "")])
+def test_bulk_create_writes_profiles_with_one_insert_many(request, service, prefix, monkeypatch):
+    module = request.getfixturevalue(service)
+    collection = module.routes.soil_profiles
+    writes = []
+    insert_many = collection.insert_many
+    monkeypatch.setattr(collection, "insert_many", lambda documents, **kwargs: (
+        writes.append(len(documents)), insert_many(documents, **kwargs))[1])
+    monkeypatch.setattr(collection, "insert_one", lambda *args, **kwargs: pytest.fail("insert_one was used"))
+    response = module.app.test_client().post(f"{prefix}/soil-profile/batch", json=[PROFILE] * 5)
+    assert response.status_code == 201
+    assert writes == [5]
+    assert None not in response.json["ids"] and response.json["errors"] == []
+
+
+@pytest.mark.parametrize("body", [{"profiles": [{"model": "Model1"}]}, {"profiles": "nope"}])
+def test_bulk_create_without_valid_profiles_is_rejected(model_1, body):
+    response = model_1.app.test_client().post("/model/soil-profile/batch", json=body)
+    assert response.status_code == 400
@@ -0,0 +1,49 @@
+"""The shared kernel pool with real worker processes."""
+import os
+import signal
+import time
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+import process_pool
+from process_pool import map_kernel, run_kernel
+from simulation.kernels import model_1_kernel
+from simulation.profiles import model_1_run_params
+
+LAYERS = [
+    {"id": 1, "conc": 4e-9, "bioturbation_rate": 2e-8},
+    {"id": 2, "conc": 0, "bioturbation_rate": 2e-8},
+]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(process_pool, "SIMULATION_PROCESSES", 2)
+    monkeypatch.setattr(process_pool, "_pool", None)
+    yield
+    if process_pool._pool is not None:
+        process_pool._pool.shutdown()
+
+
+def test_kernels_run_in_worker_processes(pool):
+    params = model_1_run_params(LAYERS, {"max_iter": 100})
+    in_process = model_1_kernel(params)
+    results = map_kernel(model_1_kernel, [(params,), (params,)])
+    assert [result["iterations"] for result in results] == [in_process["iterations"]] * 2
+    assert os.getpid() not in map_kernel(os.getpid, [()] * 4)
+
+
+def test_killed_worker_recreates_the_pool(pool):
+    worker = run_kernel(os.getpid)
+    broken = process_pool.get_pool()
+    os.kill(worker, signal.SIGKILL)
+
+    # The pool notices the dead worker asynchronously, the next calls fail until it does
+    deadline = time.monotonic() + 30
+    with pytest.raises(BrokenProcessPool):
+        while time.monotonic() < deadline:
+            map_kernel(os.getpid, [()])
+    assert process_pool._pool is None
+
+    params = model_1_run_params(LAYERS, {"max_iter": 100})
+    assert run_kernel(model_1_kernel, params)["iterations"] == model_1_kernel(params)["iterations"]
+    assert process_pool.get_pool() is not broken
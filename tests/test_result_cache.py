@@ -0,0 +1,59 @@
+import pytest
+from result_cache import ResultCache, bump_cache_generation
+
+
+@pytest.fixture
+def collection(mongo):
+    collection = mongo["result_cache_test"]["simulation_cache"]
+    collection.drop()
+    collection.create_index("key", unique=True)
+    collection.database["cache_generations"].drop()
+    yield collection
+    collection.drop()
+
+
+def test_memory_hit_does_not_query_mongo(collection, monkeypatch):
+    cache = ResultCache(collection, enabled=True, check_seconds=60)
+    cache.put("a", {"simulation_id": 1})
+    monkeypatch.setattr(collection, "find", lambda *args, **kwargs: pytest.fail("memory hit queried Mongo"))
+    monkeypatch.setattr(cache.generations, "find_one", lambda *args, **kwargs: pytest.fail("generation read early"))
+    assert cache.get_many(["a"]) == {"a": {"simulation_id": 1}}
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_bumped_generation_invalidates_memory(collection):
+    cache = ResultCache(collection, enabled=True, check_seconds=0)
+    cache.put("a", {"simulation_id": 1})
+    collection.delete_many({})
+    bump_cache_generation(collection.database)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_generation_is_checked_at_most_every_check_seconds(collection):
+    cache = ResultCache(collection, enabled=True, check_seconds=60)
+    cache.put("a", {"simulation_id": 1})
+    collection.delete_many({})
+    bump_cache_generation(collection.database)
+    assert cache.get("a") == {"simulation_id": 1}
+    cache.next_check = 0.0  # the check interval has passed
+    assert cache.get("a") is None
+
+
+def test_newer_mongo_entry_replaces_memory(collection):
+    cache = ResultCache(collection, enabled=True, check_seconds=0)
+    other = ResultCache(collection, enabled=True, check_seconds=0)
+    cache.put("a", {"simulation_id": 1})
+    collection.delete_many({})
+    bump_cache_generation(collection.database)
+    other.put("a", {"simulation_id": 7})
+    assert cache.get_many(["a"]) == {"a": {"simulation_id": 7}}
+    assert cache.get("a") == {"simulation_id": 7}
+
+
+def test_lost_insert_race_reads_the_winning_entry(collection):
+    cache, other = ResultCache(collection, enabled=True), ResultCache(collection, enabled=True)
+    other.put("a", {"simulation_id": 1})
+    cache.put("a", {"simulation_id": 2})
+    assert cache.get("a") == {"simulation_id": 1}
@@ -0,0 +1,72 @@
+"""NDJSON framing of streamed runs and stored histories, through the Model 1 service."""
+import json
+import pytest
+
+PROFILE = {"model": "Model1", "layers": [
+    {"depth": 0.1, "initial_conc": 4e-9, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+    {"depth": 0.1, "initial_conc": 0, "earthworm_density": 20, "beta": 1e-8},
+]}
+
+
+def ndjson(response):
+    assert response.mimetype == "application/x-ndjson"
+    text = response.get_data(as_text=True)
+    assert text.endswith("\n")
+    return [json.loads(line) for line in text.splitlines()]
+
+
+@pytest.fixture
+def client(model_1):
+    return model_1.app.test_client()
+
+
+@pytest.fixture
+def run(client):
+    """A stored 40-step run and its response body."""
+    profile_id = client.post("/model/soil-profile", json=PROFILE).json["id"]
+    body = client.post("/model/bioturbation/run", json={
+        "profile_id": profile_id, "max_iter": 39, "steady_state_tol": 0, "cache": False,
+    }).json
+    assert body["iterations"] == 40
+    return body
+
+
+def test_run_stream_rows_then_result(client):
+    profile_id = client.post("/model/soil-profile", json=PROFILE).json["id"]
+    lines = ndjson(client.post("/model/bioturbation/run", json={
+        "profile_id": profile_id, "max_iter": 21, "steady_state_tol": 0, "stream": True, "stream_every": 5,
+    }))
+    *rows, last = lines
+    # Every 5th step and the last one, then the response body with its status
+    assert [row["step"] for row in rows] == [0, 5, 10, 15, 20, 22]
+    assert all(set(row) == {"step", "conc"} and len(row["conc"]) == 3 for row in rows)
+    assert last["status"] == 201
+    assert last["result"]["iterations"] == 22 and "simulation_id" in last["result"]
+
+
+def test_stored_history_stream(client, run):
+    header, *rows = ndjson(client.get(f"/model/bioturbation/history/{run['simulation_id']}"))
+    assert header == {"simulation_id": run["simulation_id"], "model": "Model1", "profile_id": run["profile_id"],
+                      "layer_ids": [1, 2, 3], "samples": 41}
+    assert [row["step"] for row in rows] == list(range(41))
+
+    window = client.get(f"/model/bioturbation/history/{run['simulation_id']}/window").json
+    assert [row["conc"] for row in rows] == [list(values) for values in zip(*(layer["conc"] for layer in window["layers"]))]
+
+
+@pytest.mark.parametrize("every, chunk", [(3, 4), (7, 1), (1, 100)])
+def test_stored_history_stream_every_and_chunk(client, run, every, chunk):
+    response = client.get(f"/model/bioturbation/history/{run['simulation_id']}?every={every}&chunk={chunk}")
+    header, *rows = ndjson(response)
+    assert header["samples"] == len(rows) == len(range(0, 41, every))
+    assert [row["step"] for row in rows] == list(range(0, 41, every))
+
+
+@pytest.mark.parametrize("query", ["every=0", "chunk=0"])
+def test_stored_history_stream_rejects_bad_options(client, run, query):
+    assert client.get(f"/model/bioturbation/history/{run['simulation_id']}?{query}").status_code == 400
+
+
+def test_stored_history_stream_of_unknown_simulation(client):
+    assert client.get("/model/bioturbation/history/999999999").status_code == 404
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from simulation.kernels import model_1_kernel, model_1_sweep_kernel, model_2_sweep_kernel
+from simulation.profiles import model_1_run_params, process_model_1_layers, process_model_2_layers
+from simulation.sweep import merge_sweep_summaries, sweep_chunks
+
+LAYERS = [{"depth": 0.1, "initial_conc": 4e-9 if i == 0 else 0, "earthworm_density": 20, "beta": 1e-8}
+          for i in range(3)]
+
+
+def sweep_params(model, values):
+    params = {"parameters": {"beta": values}, "dt": 86400, "tol": 1e-12, "max_iter": 200, "history": None}
+    if model == "Model1":
+        params["layers"] = process_model_1_layers({"layers": LAYERS})[0]
+        return model_1_sweep_kernel, params
+    params.update(layers=process_model_2_layers({"layers": LAYERS})[0], h=0.2, Nx=10)
+    return model_2_sweep_kernel, params
+
+
+@pytest.mark.parametrize("model", ["Model1", "Model2"])
+def test_empty_chunk_returns_empty_summary(model):
+    kernel, params = sweep_params(model, [1e-8])
+    summary = kernel(dict(params, chunk=(1, 2)))
+    assert summary["iterations"] == [] and summary["converged"] == []
+    assert summary["final"].shape == (0, len(LAYERS))
+
+
+@pytest.mark.parametrize("model", ["Model1", "Model2"])
+@pytest.mark.parametrize("points", [1, 3])
+def test_more_chunks_than_points_match_one_chunk(model, points):
+    kernel, params = sweep_params(model, list(np.linspace(1e-8, 3e-8, points)))
+    whole = kernel(params)
+    chunked = merge_sweep_summaries([kernel(dict(params, chunk=(k, 4))) for k in range(4)])
+    assert chunked["iterations"] == whole["iterations"]
+    np.testing.assert_array_equal(chunked["final"], whole["final"])
+
+
+def test_sweep_chunks_never_exceed_points():
+    assert sweep_chunks({"beta": [1e-8]}, 8) == 1
+    assert sweep_chunks({"beta": [1e-8, 2e-8], "depth": [0.1, 0.2, 0.3]}, 4) == 4
+    assert sweep_chunks({"beta": [1e-8, 2e-8]}, 0) == 1
+
+
+def test_model_1_sweep_converged_matches_the_run():
+    layers = process_model_1_layers({"layers": LAYERS})[0]
+    steady = model_1_kernel(model_1_run_params(layers, {"steady_state_tol": 1e-12, "max_iter": 10**5}))["iterations"]
+    kernel, params = sweep_params("Model1", [1e-8])
+    # The run loop takes up to max_iter + 1 steps, so the last allowed step still counts
+    on_last_step = kernel(dict(params, max_iter=steady - 1))
+    assert on_last_step["iterations"] == [steady] and on_last_step["converged"] == [True]
+    short = kernel(dict(params, max_iter=steady - 2))
+    assert short["iterations"] == [steady - 1] and short["converged"] == [False]